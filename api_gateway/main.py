@@ -1,20 +1,121 @@
-import json
+import asyncio
 import os
 import uuid
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Form, File, UploadFile, HTTPException
-from typing import List
+from typing import List, Optional, Tuple
+from google.api_core.exceptions import NotFound
 from google.cloud import storage, pubsub_v1
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+from shared import codec, instrumentation
+from shared.event_models import OperationDetails, OperationReceivedEvent
+from shared.transport import get_transport
 
 # --- Configuración ---
 app = FastAPI(title="API Gateway")
+instrumentation.instrument_app(app, "api-gateway")
 storage_client = storage.Client()
-publisher = pubsub_v1.PublisherClient()
+
+# El publisher (Pub/Sub, o el transporte de MESSAGE_TRANSPORT) agrupa los mensajes en lotes; el endpoint bulk publica todos sus
+# eventos a la vez y deja que el cliente los empaquete según esta configuración.
+PUBLISH_BATCH_SETTINGS = pubsub_v1.types.BatchSettings(
+    max_messages=int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100")),
+    max_bytes=int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024))),
+    max_latency=float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.01")),
+)
+publisher = get_transport(batch_settings=PUBLISH_BATCH_SETTINGS)
 
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
 BUCKET_NAME = "capitalexpress-operations" # Usando el nombre de tu nueva lógica
 EVENT_TOPIC_NAME = "operations-received"  # El tópico inicial y genérico
 topic_path = publisher.topic_path(PROJECT_ID, EVENT_TOPIC_NAME)
+BULK_MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "500"))
+bucket = storage_client.bucket(BUCKET_NAME)
+
+# Pool acotado para las subidas a GCS: el cliente de storage es bloqueante,
+# así que las subidas corren en hilos y el event loop queda libre.
+UPLOAD_MAX_WORKERS = int(os.getenv("GCS_UPLOAD_MAX_WORKERS", "8"))
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS, thread_name_prefix="gcs-upload")
+
+@app.on_event("shutdown")
+def on_shutdown():
+    upload_executor.shutdown(wait=True)
+
+@instrumentation.traced("gcs.upload")
+def _upload_blob(blob_path: str, file: UploadFile) -> str:
+    # Se sube directamente desde el archivo temporal (spool) de UploadFile,
+    # sin copiar el contenido a memoria.
+    file.file.seek(0)
+    bucket.blob(blob_path).upload_from_file(file.file, content_type=file.content_type)
+    file.file.seek(0)
+    gcs_path = f"gs://{BUCKET_NAME}/{blob_path}"
+    print(f"Archivo subido: {gcs_path}")
+    return gcs_path
+
+def _delete_blobs(blob_paths: List[str]):
+    for blob_path in blob_paths:
+        try:
+            bucket.blob(blob_path).delete()
+            print(f"Rollback: archivo eliminado gs://{BUCKET_NAME}/{blob_path}")
+        except NotFound:
+            pass
+        except Exception as e:
+            print(f"ADVERTENCIA: no se pudo eliminar {blob_path} en el rollback: {e}")
+
+async def upload_operation_files(operation_id: str, uploads: List[Tuple[UploadFile, str]]) -> List[str]:
+    """
+    Sube en paralelo (con el pool acotado) una lista de (archivo, subcarpeta)
+    a GCS. Si alguna subida falla, elimina las que sí se completaron y
+    lanza HTTPException. Retorna las rutas gs:// en el mismo orden de entrada.
+    """
+    loop = asyncio.get_running_loop()
+    blob_paths = [f"{operation_id}/{subfolder}/{file.filename}" for file, subfolder in uploads]
+    results = await asyncio.gather(
+        *(loop.run_in_executor(upload_executor, instrumentation.in_context(_upload_blob), blob_path, file)
+          for blob_path, (file, _) in zip(blob_paths, uploads)),
+        return_exceptions=True
+    )
+
+    failed = [(file, r) for (file, _), r in zip(uploads, results) if isinstance(r, BaseException)]
+    if failed:
+        for file, error in failed:
+            print(f"ERROR subiendo {file.filename}: {error}")
+        uploaded = [p for p, r in zip(blob_paths, results) if not isinstance(r, BaseException)]
+        await loop.run_in_executor(upload_executor, _delete_blobs, uploaded)
+        raise HTTPException(status_code=500, detail=f"Error al subir el archivo {failed[0][0].filename}.")
+    return results
+
+async def delete_operation_files(gcs_paths: List[str]):
+    """Elimina los archivos ya subidos de una operación cuyo evento no se pudo publicar."""
+    prefix = f"gs://{BUCKET_NAME}/"
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(upload_executor, _delete_blobs, [p[len(prefix):] for p in gcs_paths])
+
+def new_operation_id() -> str:
+    return f"OP-{uuid.uuid4().hex[:8].upper()}"
+
+def build_received_event(operation_id: str, file_paths: dict, tasa: float, comision: float,
+                         adelanto: float, cuenta_bancaria: str, correos: str) -> OperationReceivedEvent:
+    return OperationReceivedEvent(
+        operation_id=operation_id,
+        status="RECEIVED",
+        received_at=datetime.datetime.utcnow().isoformat(),
+        file_paths=file_paths,
+        operation_details=OperationDetails(
+            tasa=tasa,
+            comision=comision,
+            adelanto=adelanto,
+            cuenta_bancaria=cuenta_bancaria,
+            correos_adicionales=correos.split(',') if correos else []
+        )
+    )
+
+async def publish_received_event(event: OperationReceivedEvent):
+    # publish() solo encola el mensaje en el lote actual; se espera la
+    # confirmación sin bloquear el event loop.
+    future = codec.publish(publisher, topic_path, event)
+    await asyncio.wrap_future(future)
 
 @app.post("/api/v1/submit-operation", status_code=202)
 async def submit_operation(
@@ -32,61 +133,158 @@ async def submit_operation(
     sube los archivos a GCS en carpetas estructuradas y publica
     un único evento enriquecido para el orquestador.
     """
-    operation_id = f"OP-{uuid.uuid4().hex[:8].upper()}"
+    operation_id = new_operation_id()
     print(f"Iniciando nueva operación: {operation_id}")
 
-    # Helper para subir archivos
-    def upload_file(file: UploadFile, subfolder: str) -> str:
-        try:
-            blob_path = f"{operation_id}/{subfolder}/{file.filename}"
-            blob = storage_client.bucket(BUCKET_NAME).blob(blob_path)
-            blob.upload_from_file(file.file, content_type=file.content_type)
-            file.file.seek(0)
-            gcs_path = f"gs://{BUCKET_NAME}/{blob_path}"
-            print(f"Archivo subido: {gcs_path}")
-            return gcs_path
-        except Exception as e:
-            print(f"ERROR subiendo {file.filename}: {e}")
-            raise HTTPException(status_code=500, detail=f"Error al subir el archivo {file.filename}.")
-
     try:
-        # 1. Subir todos los archivos a GCS en sus carpetas correspondientes
-        xml_path = upload_file(xml_file, "xml")
-        pdf_path = upload_file(pdf_file, "pdf")
-        respaldo_paths = [upload_file(f, "respaldos") for f in respaldo_files]
-        
+        # 1. Subir todos los archivos a GCS en paralelo, en sus carpetas correspondientes
+        uploads = [(xml_file, "xml"), (pdf_file, "pdf")] + [(f, "respaldos") for f in respaldo_files]
+        gcs_paths = await upload_operation_files(operation_id, uploads)
+        xml_path, pdf_path, *respaldo_paths = gcs_paths
+
         all_file_paths = {
             "xml": xml_path,
             "pdf": pdf_path,
             "respaldos": respaldo_paths
         }
 
-        # 2. Construir el evento enriquecido para el orquestador
-        event_to_publish = {
-            "operation_id": operation_id,
-            "status": "RECEIVED",
-            "received_at": datetime.datetime.utcnow().isoformat(),
-            "file_paths": all_file_paths,
-            "operation_details": {
-                "tasa": tasa,
-                "comision": comision,
-                "adelanto": adelanto,
-                "cuenta_bancaria": cuenta_bancaria,
-                "correos_adicionales": correos.split(',') if correos else []
-            }
-        }
+        try:
+            # 2. Construir el evento enriquecido para el orquestador
+            event_to_publish = build_received_event(
+                operation_id, all_file_paths, tasa, comision, adelanto, cuenta_bancaria, correos
+            )
+
+            # 3. Publicar el evento inicial
+            await publish_received_event(event_to_publish)
+        except Exception:
+            # Sin evento nadie procesará la operación: sus archivos no deben quedar huérfanos en GCS.
+            await delete_operation_files(gcs_paths)
+            raise
 
-        # 3. Publicar el evento inicial
-        future = publisher.publish(topic_path, json.dumps(event_to_publish).encode("utf-8"))
-        future.result()
-        
         print(f"[API Gateway] Evento de recepción publicado para op: {operation_id}")
         return {"status": "received", "operation_id": operation_id}
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ERROR en API Gateway para op {operation_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Error interno del servidor: {str(e)}")
 
+class BulkOperationItem(BaseModel):
+    """
+    Una línea del manifiesto de /submit-operations/bulk, con los mismos tipos
+    que los campos de formulario de /submit-operation.
+    """
+    model_config = ConfigDict(allow_inf_nan=False, coerce_numbers_to_str=True)
+
+    tasa: float
+    comision: float
+    adelanto: float
+    cuenta_bancaria: str
+    correos: str = ""
+    xml_file: str
+    pdf_file: str
+    respaldo_files: List[str] = []
+
+    @field_validator("tasa", "comision", "adelanto", mode="before")
+    @classmethod
+    def _reject_booleans(cls, value):
+        # En modo laxo pydantic convierte true/false en 1.0/0.0.
+        if isinstance(value, bool):
+            raise ValueError("debe ser un número")
+        return value
+
+async def _submit_bulk_item(index: int, item: BulkOperationItem, files_by_name: dict) -> dict:
+    operation_id = new_operation_id()
+    try:
+        xml_file = files_by_name[item.xml_file]
+        pdf_file = files_by_name[item.pdf_file]
+        respaldo_files = [files_by_name[name] for name in item.respaldo_files]
+
+        uploads = [(xml_file, "xml"), (pdf_file, "pdf")] + [(f, "respaldos") for f in respaldo_files]
+        gcs_paths = await upload_operation_files(operation_id, uploads)
+        xml_path, pdf_path, *respaldo_paths = gcs_paths
+
+        try:
+            event_to_publish = build_received_event(
+                operation_id,
+                {"xml": xml_path, "pdf": pdf_path, "respaldos": respaldo_paths},
+                item.tasa, item.comision, item.adelanto, item.cuenta_bancaria, item.correos
+            )
+            await publish_received_event(event_to_publish)
+        except Exception:
+            await delete_operation_files(gcs_paths)
+            raise
+        print(f"[API Gateway] Evento de recepción publicado para op: {operation_id} (bulk #{index})")
+        return {"index": index, "status": "received", "operation_id": operation_id}
+    except HTTPException as e:
+        return {"index": index, "status": "error", "operation_id": operation_id, "error": e.detail}
+    except Exception as e:
+        print(f"ERROR en API Gateway para op {operation_id} (bulk #{index}): {e}")
+        return {"index": index, "status": "error", "operation_id": operation_id, "error": str(e)}
+
+def _validate_bulk_item(line: str, files_by_name: dict, claimed: set) -> Tuple[Optional[BulkOperationItem], Optional[str]]:
+    """
+    Valida y convierte una línea del manifiesto antes de subir cualquier
+    archivo. Retorna (operación, None) o (None, mensaje de error).
+    """
+    try:
+        item = BulkOperationItem.model_validate_json(line)
+    except ValidationError as e:
+        fields = ", ".join(".".join(str(part) for part in detail["loc"]) or "(línea)" for detail in e.errors())
+        return None, f"Campos inválidos ({fields}): {e.errors()[0]['msg']}"
+    names = [item.xml_file, item.pdf_file] + item.respaldo_files
+    not_found = [n for n in names if n not in files_by_name]
+    if not_found:
+        return None, f"Archivos no incluidos en la solicitud: {', '.join(not_found)}"
+    reused = [n for n in names if n in claimed]
+    if reused:
+        return None, f"Archivos referenciados por más de una operación: {', '.join(reused)}"
+    claimed.update(names)
+    return item, None
+
+@app.post("/api/v1/submit-operations/bulk", status_code=202)
+async def submit_operations_bulk(
+    manifest: str = Form(...),
+    files: List[UploadFile] = File(...)
+):
+    """
+    Recibe varias operaciones en una sola solicitud. `manifest` es NDJSON:
+    una operación por línea con los mismos campos que /submit-operation
+    (`tasa`, `comision`, `adelanto`, `cuenta_bancaria`, `correos`) y los
+    nombres de sus archivos (`xml_file`, `pdf_file`, `respaldo_files`),
+    que deben venir en `files`. Las subidas de todas las operaciones
+    comparten el pool acotado y los eventos se publican en lote.
+    Retorna el resultado de cada operación en el orden del manifiesto.
+    """
+    files_by_name = {}
+    for f in files:
+        if f.filename in files_by_name:
+            raise HTTPException(status_code=400, detail=f"Nombre de archivo duplicado: {f.filename}")
+        files_by_name[f.filename] = f
+
+    lines = [line for line in manifest.splitlines() if line.strip()]
+    if not lines:
+        raise HTTPException(status_code=400, detail="El manifiesto está vacío.")
+    if len(lines) > BULK_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"Máximo {BULK_MAX_OPERATIONS} operaciones por solicitud.")
+
+    results = [None] * len(lines)
+    tasks, claimed = [], set()
+    for index, line in enumerate(lines):
+        item, error = _validate_bulk_item(line, files_by_name, claimed)
+        if error:
+            results[index] = {"index": index, "status": "error", "error": error}
+            continue
+        tasks.append(_submit_bulk_item(index, item, files_by_name))
+
+    print(f"[API Gateway] Bulk: {len(tasks)} de {len(lines)} operaciones válidas.")
+    for result in await asyncio.gather(*tasks):
+        results[result["index"]] = result
+
+    received = sum(1 for r in results if r["status"] == "received")
+    return {"received": received, "failed": len(results) - received, "operations": results}
+
 @app.get("/health")
 def health_check():
     return {"status": "ok", "service": "API Gateway"}
\ No newline at end of file
@@ -0,0 +1,44 @@
+import importlib.util
+import os
+import socket
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, os.path.dirname(SERVICE_DIR))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def gcs_emulator():
+    """gcp-storage-emulator en memoria, con el bucket de operaciones."""
+    from gcp_storage_emulator.server import create_server
+
+    port = _free_port()
+    server = create_server("127.0.0.1", port, in_memory=True, default_bucket="capitalexpress-operations")
+    server.start()
+    yield server, f"http://127.0.0.1:{port}"
+    server.stop()
+
+
+@pytest.fixture(scope="session")
+def gateway(gcs_emulator):
+    """El gateway con GCS en el emulador y el transporte en proceso."""
+    _, emulator_url = gcs_emulator
+    os.environ.update({
+        "MESSAGE_TRANSPORT": "inprocess",
+        "STORAGE_EMULATOR_HOST": emulator_url,
+        "GOOGLE_CLOUD_PROJECT": "operaciones-peru",
+    })
+    spec = importlib.util.spec_from_file_location("gateway_main", os.path.join(SERVICE_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.upload_executor.shutdown(wait=True)
@@ -0,0 +1,129 @@
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(gateway):
+    return TestClient(gateway.app)
+
+
+def operation(name: str, **overrides) -> dict:
+    item = {"tasa": 1.5, "comision": 100, "adelanto": 90, "cuenta_bancaria": "191-1234567-0-01",
+            "correos": "a@example.com,b@example.com", "xml_file": f"{name}.xml", "pdf_file": f"{name}.pdf",
+            "respaldo_files": [f"{name}-respaldo.pdf"]}
+    item.update(overrides)
+    return item
+
+
+def files_for(*names):
+    return [("files", (f"{name}{suffix}", b"contenido", "application/octet-stream"))
+            for name in names for suffix in (".xml", ".pdf", "-respaldo.pdf")]
+
+
+def submit_bulk(client, items, files):
+    manifest = "\n".join(item if isinstance(item, str) else json.dumps(item) for item in items)
+    response = client.post("/api/v1/submit-operations/bulk", data={"manifest": manifest}, files=files)
+    assert response.status_code == 202, response.text
+    return response.json()
+
+
+def blob_names(gateway, operation_id: str):
+    return [blob.name for blob in gateway.bucket.list_blobs(prefix=f"{operation_id}/")]
+
+
+def count_blobs(gateway) -> int:
+    return sum(1 for _ in gateway.bucket.list_blobs())
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "tiempo de espera agotado"
+        time.sleep(0.05)
+
+
+def subscribe(gateway):
+    received = []
+    consumer = gateway.publisher.subscribe(gateway.EVENT_TOPIC_NAME, "operations-received-test",
+                                           lambda m: received.append(json.loads(m.data)))
+    return received, consumer
+
+
+def test_invalid_fields_are_rejected_before_any_upload(gateway, client):
+    uploads_before = count_blobs(gateway)
+    items = [
+        operation("texto", tasa="abc"),
+        operation("booleano", comision=True),
+        operation("infinito", adelanto="inf"),
+        operation("correos", correos=["a@example.com"]),
+        operation("respaldos", respaldo_files="respaldos-respaldo.pdf"),
+        operation("cuenta", cuenta_bancaria=None),
+        "{no es json",
+        "[1, 2]",
+    ]
+    body = submit_bulk(client, items, files_for("texto", "booleano", "infinito", "correos", "respaldos", "cuenta"))
+
+    assert body["received"] == 0 and body["failed"] == len(items)
+    errors = [result["error"] for result in body["operations"]]
+    for field, error in zip(["tasa", "comision", "adelanto", "correos", "respaldo_files", "cuenta_bancaria"], errors):
+        assert error.startswith(f"Campos inválidos ({field})"), error
+    assert all("operation_id" not in result for result in body["operations"])
+    assert count_blobs(gateway) == uploads_before
+
+
+def test_fields_are_coerced_like_the_form_endpoint(gateway, client):
+    received, consumer = subscribe(gateway)
+    try:
+        body = submit_bulk(client, [operation("coercion", tasa="1.25", comision=100, cuenta_bancaria=1911234567)],
+                           files_for("coercion"))
+        [result] = body["operations"]
+        assert result["status"] == "received"
+        wait_for(lambda: any(e["operation_id"] == result["operation_id"] for e in received))
+    finally:
+        consumer.stop()
+
+    [event] = [e for e in received if e["operation_id"] == result["operation_id"]]
+    details = event["operation_details"]
+    assert details["tasa"] == 1.25 and details["comision"] == 100.0
+    assert details["cuenta_bancaria"] == "1911234567"
+    assert details["correos_adicionales"] == ["a@example.com", "b@example.com"]
+    assert len(blob_names(gateway, result["operation_id"])) == 3
+
+
+def test_failed_publish_deletes_the_uploaded_files(gateway, client, monkeypatch):
+    async def failing_publish(event):
+        raise RuntimeError("broker caído")
+
+    monkeypatch.setattr(gateway, "publish_received_event", failing_publish)
+    body = submit_bulk(client, [operation("sin-evento")], files_for("sin-evento"))
+
+    [result] = body["operations"]
+    assert result["status"] == "error" and "broker caído" in result["error"]
+    assert blob_names(gateway, result["operation_id"]) == []
+
+
+def test_failed_publish_deletes_the_uploaded_files_of_a_single_operation(gateway, client, monkeypatch):
+    async def failing_publish(event):
+        raise RuntimeError("broker caído")
+
+    uploaded = []
+    delete_operation_files = gateway.delete_operation_files
+
+    async def tracking_delete(gcs_paths):
+        uploaded.extend(gcs_paths)
+        await delete_operation_files(gcs_paths)
+
+    monkeypatch.setattr(gateway, "publish_received_event", failing_publish)
+    monkeypatch.setattr(gateway, "delete_operation_files", tracking_delete)
+    response = client.post(
+        "/api/v1/submit-operation",
+        data={"tasa": "1.5", "comision": "100", "adelanto": "90", "cuenta_bancaria": "191"},
+        files=[("xml_file", ("op.xml", b"x")), ("pdf_file", ("op.pdf", b"p")), ("respaldo_files", ("r.pdf", b"r"))],
+    )
+
+    assert response.status_code == 500
+    [operation_id] = {path.split("/")[3] for path in uploaded}
+    assert len(uploaded) == 3 and blob_names(gateway, operation_id) == []
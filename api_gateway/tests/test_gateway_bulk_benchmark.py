@@ -0,0 +1,68 @@
+"""
+Benchmark de rendimiento del gateway: N operaciones enviadas como N solicitudes
+concurrentes a /submit-operation frente a una sola solicitud a
+/submit-operations/bulk (pytest-benchmark):
+
+    pytest api_gateway/tests/test_gateway_bulk_benchmark.py --benchmark-only
+
+GCS es gcp-storage-emulator en memoria y los eventos van al transporte en
+proceso, así que se mide el gateway (parseo multipart, subidas por el pool
+acotado, publicación) y no la red hasta GCS. El emulador se vuelve más lento
+a medida que acumula objetos, por eso se vacía antes de cada ronda. Cada caso
+agrega a extra_info `operations_per_sec`, que se ve con --benchmark-json=<archivo>.
+"""
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+httpx = pytest.importorskip("httpx")
+
+OPERATIONS = 20
+FILE_BYTES = 20 * 1024
+FORM = {"tasa": "1.5", "comision": "100", "adelanto": "90", "cuenta_bancaria": "191-1234567-0-01",
+        "correos": "a@example.com"}
+CONTENT = b"x" * FILE_BYTES
+
+
+def single_requests(client: httpx.AsyncClient):
+    return [
+        client.post("/api/v1/submit-operation", data=FORM, files=[
+            ("xml_file", (f"op{i}.xml", CONTENT)), ("pdf_file", (f"op{i}.pdf", CONTENT)),
+            ("respaldo_files", (f"op{i}-respaldo.pdf", CONTENT)),
+        ])
+        for i in range(OPERATIONS)
+    ]
+
+
+def bulk_request(client: httpx.AsyncClient):
+    manifest = "\n".join(
+        json.dumps(dict(FORM, xml_file=f"op{i}.xml", pdf_file=f"op{i}.pdf", respaldo_files=[f"op{i}-respaldo.pdf"]))
+        for i in range(OPERATIONS)
+    )
+    files = [("files", (f"op{i}{suffix}", CONTENT))
+             for i in range(OPERATIONS) for suffix in (".xml", ".pdf", "-respaldo.pdf")]
+    return [client.post("/api/v1/submit-operations/bulk", data={"manifest": manifest}, files=files)]
+
+
+async def submit(app, build_requests) -> int:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://gateway", timeout=120) as client:
+        responses = await asyncio.gather(*build_requests(client))
+    assert all(response.status_code == 202 for response in responses), responses[0].text
+    received = [response.json().get("received", 1) for response in responses]
+    return sum(received)
+
+
+@pytest.mark.parametrize("mode", ["single", "bulk"])
+def test_gateway_bulk_benchmark(benchmark, gateway, gcs_emulator, mode):
+    emulator, _ = gcs_emulator
+    build_requests = single_requests if mode == "single" else bulk_request
+    received = benchmark.pedantic(lambda: asyncio.run(submit(gateway.app, build_requests)),
+                                  setup=lambda: emulator.wipe(keep_buckets=True), rounds=5, warmup_rounds=1)
+
+    assert received == OPERATIONS
+    benchmark.extra_info["operations"] = OPERATIONS
+    if benchmark.stats:
+        benchmark.extra_info["operations_per_sec"] = round(OPERATIONS / benchmark.stats.stats.mean, 1)
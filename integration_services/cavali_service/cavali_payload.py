@@ -0,0 +1,111 @@
+import base64
+import hashlib
+import json
+from typing import Iterator, List
+
+# Tamaño de lectura desde GCS: múltiplo de 3 para que cada trozo se codifique
+# en base64 sin relleno intermedio.
+READ_CHUNK_SIZE = 3 * 64 * 1024
+
+def base64_length(raw_size: int) -> int:
+    return 4 * ((raw_size + 2) // 3)
+
+class GcsXmlSource:
+    """XML referenciado en GCS: se lee por trozos y se codifica en base64 al vuelo."""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.filename = blob.name.rsplit("/", 1)[-1]
+        self.encoded_size = base64_length(blob.size)
+        # Clave de contenido para el CavaliResultStore, sin descargar el objeto.
+        self.cache_key = f"md5:{blob.md5_hash}" if blob.md5_hash else None
+
+    def iter_base64(self) -> Iterator[bytes]:
+        with self.blob.open("rb", chunk_size=READ_CHUNK_SIZE) as reader:
+            while True:
+                chunk = reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.b64encode(chunk)
+
+class InlineXmlSource:
+    """XML que llega ya en base64 dentro del comando (formato anterior, xml_files_data)."""
+
+    def __init__(self, filename: str, content_base64: str):
+        self.filename = filename
+        self.content = content_base64.encode("ascii")
+        self.encoded_size = len(self.content)
+        self.cache_key = f"sha256:{hashlib.sha256(base64.b64decode(self.content)).hexdigest()}"
+
+    def iter_base64(self) -> Iterator[bytes]:
+        yield self.content
+
+def plan_batches(sources: List, max_files: int, max_bytes: int) -> List[List]:
+    """
+    Agrupa los XML en lotes que no superan `max_files` archivos ni `max_bytes`
+    de contenido codificado. Un XML que por sí solo excede el presupuesto va
+    en un lote propio.
+    """
+    batches, current, current_bytes = [], [], 0
+    for source in sources:
+        if current and (len(current) >= max_files or current_bytes + source.encoded_size > max_bytes):
+            batches.append(current)
+            current, current_bytes = [], 0
+        current.append(source)
+        current_bytes += source.encoded_size
+    if current:
+        batches.append(current)
+    return batches
+
+class StreamingBlockPayload:
+    """
+    Cuerpo JSON del bloqueo de Cavali generado mientras se envía:
+
+        {"processDetail": {"processNumber": N},
+         "invoiceXMLDetail": {"invoiceXML": [{"name": ..., "fileXml": "<base64>"}, ...]}}
+
+    El base64 de cada XML se produce por trozos a medida que requests lee el
+    cuerpo, así la memoria no depende del tamaño de las facturas. Como el
+    tamaño codificado se conoce de antemano, `__len__` permite enviar
+    Content-Length en lugar de transfer-encoding chunked.
+    """
+
+    def __init__(self, process_number: int, sources: List):
+        self._parts = [f'{{"processDetail": {{"processNumber": {int(process_number)}}}, '
+                       f'"invoiceXMLDetail": {{"invoiceXML": ['.encode("ascii")]
+        for i, source in enumerate(sources):
+            prefix = ", " if i else ""
+            self._parts.append(f'{prefix}{{"name": {json.dumps(source.filename)}, "fileXml": "'.encode("ascii"))
+            self._parts.append(source)
+            self._parts.append(b'"}')
+        self._parts.append(b"]}}")
+        self._length = sum(len(p) if isinstance(p, bytes) else p.encoded_size for p in self._parts)
+        self._chunks = self._iter_chunks()
+        self._current = b""
+        self._position = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from part.iter_base64()
+
+    def read(self, size: int = -1) -> bytes:
+        pieces, remaining = [], size
+        while remaining != 0:
+            if self._position >= len(self._current):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._current, self._position = chunk, 0
+                continue
+            end = len(self._current) if remaining < 0 else min(len(self._current), self._position + remaining)
+            pieces.append(self._current[self._position:end])
+            if remaining > 0:
+                remaining -= end - self._position
+            self._position = end
+        return b"".join(pieces)
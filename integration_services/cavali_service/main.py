@@ -1,18 +1,32 @@
-import base64
-import json
+import asyncio
 import os
 import requests
-import time
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request
-from google.cloud import pubsub_v1
-from typing import List, Dict, Any
+from pydantic import ValidationError
+from requests.adapters import HTTPAdapter
+from google.cloud import storage
+from typing import Callable, List, Dict, Any, Tuple
+from token_cache import TokenCache
+from cavali_payload import GcsXmlSource, InlineXmlSource, StreamingBlockPayload, plan_batches
+from status_scheduler import CavaliStatusScheduler
+from process_numbers import ProcessNumberGenerator, sequence_blob_from_uri
+from shared import codec, instrumentation
+from shared.event_models import CavaliCommand
+from shared.transport import get_transport, start_pull_consumers, stop_pull_consumers
+from result_store import CavaliResultStore
 
 app = FastAPI(title="Cavali Service")
+instrumentation.instrument_app(app, "cavali-service")
 
 # --- Configuración ---
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
-publisher = pubsub_v1.PublisherClient()
+publisher = get_transport()
+COMMAND_TOPIC_NAME = "commands-validate-cavali"
+COMMAND_TOPIC_PATH = publisher.topic_path(PROJECT_ID, COMMAND_TOPIC_NAME)
+consumers = []
 EVENT_TOPIC_PATH = publisher.topic_path(PROJECT_ID, "events-cavali-validated")
+storage_client = storage.Client()
 
 # Lee la configuración de Cavali de las variables de entorno inyectadas
 CAVALI_CONFIG = {
@@ -24,45 +38,123 @@ CAVALI_CONFIG = {
     "block_url": os.getenv("CAVALI_BLOCK_URL"),
     "status_url": os.getenv("CAVALI_STATUS_URL"),
     "batch_size": 30,
+    # Presupuesto de bytes (XML ya codificado en base64) por lote de bloqueo.
+    "batch_max_bytes": int(os.getenv("CAVALI_BATCH_MAX_BYTES", str(8 * 1024 * 1024))),
+    "max_concurrent_batches": int(os.getenv("CAVALI_MAX_CONCURRENT_BATCHES", "10")),
+    "token_refresh_margin": float(os.getenv("CAVALI_TOKEN_REFRESH_MARGIN", "60")),
+    "status_initial_delay": float(os.getenv("CAVALI_STATUS_INITIAL_DELAY", "2")),
+    "status_max_delay": float(os.getenv("CAVALI_STATUS_MAX_DELAY", "60")),
+    "status_max_wait": float(os.getenv("CAVALI_STATUS_MAX_WAIT", "1800")),
+    # Estados de proceso que Cavali reporta mientras el bloqueo sigue en curso.
+    "pending_states": {s.strip().upper() for s in os.getenv("CAVALI_PENDING_STATES", "PENDIENTE,EN PROCESO,PROCESANDO,PENDING,IN_PROGRESS").split(",") if s.strip()},
+    # Estados terminales exitosos: solo estos se guardan en el CavaliResultStore.
+    "success_states": {s.strip().upper() for s in os.getenv("CAVALI_SUCCESS_STATES", "PROCESADO,BLOQUEADO,EXITOSO,COMPLETADO,SUCCESS,COMPLETED").split(",") if s.strip()},
+    # Resultado por factura (hash del XML) para no volver a bloquear las ya procesadas.
+    "result_store_max_entries": int(os.getenv("CAVALI_RESULT_STORE_MAX_ENTRIES", "10000")),
+    "result_store_path": os.getenv("CAVALI_RESULT_STORE_PATH") or None,
+    # Contador de processNumber compartido entre instancias (gs://bucket/objeto); sin él es local.
+    "process_number_object": os.getenv("CAVALI_PROCESS_NUMBER_OBJECT") or None,
+    "process_number_block": int(os.getenv("CAVALI_PROCESS_NUMBER_BLOCK", "100")),
     "enabled": os.getenv('CAVALI_ENABLED', 'true').lower() == 'true'
 }
 
 # --- Lógica de Negocio (de cavali_adapter.py) ---
 
-def get_access_token() -> str:
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CAVALI_CONFIG["client_id"],
-        "client_secret": CAVALI_CONFIG["client_secret"],
-        "scope": CAVALI_CONFIG["scope"]
-    }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-    print("Obteniendo token de Cavali...")
-    response = requests.post(CAVALI_CONFIG["token_url"], data=data, headers=headers, timeout=30)
-    response.raise_for_status()
-    print("Token de Cavali obtenido exitosamente.")
-    return response.json()["access_token"]
-
-def send_batch(self, batch: List[Dict[str, Any]], headers: Dict[str, str], batch_number: int) -> Dict[str, Any]:
+class CavaliClient:
+    """
+    Cliente de Cavali con una sesión HTTP keep-alive compartida por todo el
+    proceso y un pool acotado para enviar lotes en paralelo. El límite de
+    concurrencia es global: vale para todas las operaciones en curso.
+    """
+
+    def __init__(self, config: Dict[str, Any], result_store: CavaliResultStore = None):
+        self.token_url = config["token_url"]
+        self.block_url = config["block_url"]
+        self.status_url = config["status_url"]
+        self.api_key = config["api_key"]
+        self.client_id = config["client_id"]
+        self.client_secret = config["client_secret"]
+        self.scope = config["scope"]
+        self.is_enabled = config["enabled"]
+        self.BATCH_SIZE = config["batch_size"]
+        self.batch_max_bytes = config["batch_max_bytes"]
+        self.max_concurrent_batches = config["max_concurrent_batches"]
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.max_concurrent_batches * 2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches, thread_name_prefix="cavali-batch")
+        self._process_numbers = ProcessNumberGenerator(
+            sequence_blob_from_uri(storage_client, config["process_number_object"]),
+            block_size=config["process_number_block"]
+        )
+        self.tokens = TokenCache(self._fetch_access_token, refresh_margin=config["token_refresh_margin"])
+        self.result_store = result_store
+
+    def close(self):
+        self.tokens.close()
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    @instrumentation.traced("cavali.token")
+    def _fetch_access_token(self) -> Tuple[str, float]:
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": self.scope
+        }
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        print("Obteniendo token de Cavali...")
+        response = self.session.post(self.token_url, data=data, headers=headers, timeout=30)
+        response.raise_for_status()
+        token_response = response.json()
+        expires_in = float(token_response.get("expires_in", 300))
+        print(f"Token de Cavali obtenido exitosamente (vence en {expires_in:.0f}s).")
+        return token_response["access_token"], expires_in
+
+    def _post(self, url: str, payload: Dict[str, Any] = None, timeout: int = 30,
+              body_factory: Callable[[], Any] = None) -> requests.Response:
+        """
+        POST autenticado con el token en caché; ante un 401 renueva el token y
+        reintenta una vez. `body_factory` crea un cuerpo en streaming nuevo en
+        cada intento (un stream ya leído no se puede reenviar).
+        """
+        token = self.tokens.get_token()
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "x-api-key": self.api_key,
+                "Content-Type": "application/json"
+            }
+            if body_factory is not None:
+                response = self.session.post(url, data=body_factory(), headers=headers, timeout=timeout)
+            else:
+                response = self.session.post(url, json=payload, headers=headers, timeout=timeout)
+            if response.status_code != 401 or attempt == 1:
+                break
+            print("Cavali rechazó el token (401). Renovándolo...")
+            token = self.tokens.force_refresh(token)
+        response.raise_for_status()
+        return response
+
+    def _send_batch(self, batch: List[Any], batch_number: int) -> Dict[str, Any]:
         """
-        Envía un único lote a Cavali (paso 1) y consulta su estado (paso 2).
+        Envía un único lote a Cavali para bloqueo (paso 1). El estado (paso 2)
+        lo consulta después el CavaliStatusScheduler a partir de `id_proceso`.
         """
-        resultado_bloqueo = None
         try:
             # PASO 1: Enviar el lote para bloqueo
-            invoice_xml_list = [
-                {"name": f['filename'], "fileXml": base64.b64encode(f['content_bytes']).decode("utf-8")}
-                for f in batch
-            ]
-            process_number = int(time.time()) + batch_number
-            payload_bloqueo = {
-                "processDetail": {"processNumber": process_number},
-                "invoiceXMLDetail": {"invoiceXML": invoice_xml_list}
-            }
-            
-            print(f"Enviando Lote #{batch_number} ({len(batch)} facturas) a Cavali...")
-            response_bloqueo = requests.post(self.block_url, json=payload_bloqueo, headers=headers, timeout=60)
-            response_bloqueo.raise_for_status()
+            # El cuerpo se codifica mientras se envía: cada XML se lee por trozos.
+            process_number = self._process_numbers.next()
+            batch_bytes = sum(source.encoded_size for source in batch)
+            print(f"Enviando Lote #{batch_number} ({len(batch)} facturas, {batch_bytes} bytes) a Cavali...")
+            with instrumentation.span("cavali.block", invoices=len(batch), bytes=batch_bytes):
+                response_bloqueo = self._post(
+                    self.block_url, timeout=60,
+                    body_factory=lambda: StreamingBlockPayload(process_number, batch)
+                )
             resultado_bloqueo = response_bloqueo.json()
             print(f"Respuesta de Bloqueo para Lote #{batch_number}: {resultado_bloqueo}")
 
@@ -70,31 +162,68 @@ def send_batch(self, batch: List[Dict[str, Any]], headers: Dict[str, str], batch
             if not id_proceso:
                 raise ValueError("La respuesta de bloqueo de Cavali no contiene 'idProceso'.")
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             print(f"Error en el Paso 1 (Bloqueo) para el Lote #{batch_number}: {e}")
             return {"bloqueo_resultado": {"status": "error", "message": str(e)}, "estado_resultado": None}
-        
-        try:
-            payload_estado = {"ProcessFilter": {"idProcess": id_proceso}}
-            print(f"Consultando estado del proceso {id_proceso} (Lote #{batch_number})...")
-            response_estado = requests.post(self.status_url, json=payload_estado, headers=headers, timeout=30)
-            response_estado.raise_for_status()
-            resultado_estado = response_estado.json()
-            print(f"Respuesta de Estado para Lote #{batch_number}: {resultado_estado}")
-        
-        except requests.exceptions.RequestException as e:
-            print(f"Error en el Paso 2 (Estado) para el Lote #{batch_number}: {e}")
-            return {"bloqueo_resultado": resultado_bloqueo, "estado_resultado": {"status": "error", "message": str(e)}}
 
         return {
             "bloqueo_resultado": resultado_bloqueo,
-            "estado_resultado": resultado_estado
+            "id_proceso": id_proceso,
+            "estado_resultado": None,
+            "facturas": [{"name": source.filename, "cache_key": source.cache_key} for source in batch]
         }
 
-def validate_invoices_in_batches(self, xml_files: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    @instrumentation.traced("cavali.status")
+    def poll_status(self, id_proceso) -> Dict[str, Any]:
+        """Consulta el estado de un proceso de bloqueo (paso 2)."""
+        payload_estado = {"ProcessFilter": {"idProcess": id_proceso}}
+        response_estado = self._post(self.status_url, payload_estado, timeout=30)
+        resultado_estado = response_estado.json()
+        print(f"Respuesta de Estado para el proceso {id_proceso}: {resultado_estado}")
+        return resultado_estado
+
+    @instrumentation.traced("gcs.metadata")
+    def load_gcs_sources(self, gcs_paths: List[str]) -> List[GcsXmlSource]:
+        """Lee en paralelo solo los metadatos (tamaño) de cada XML en GCS; el contenido se lee al enviar."""
+        def load(gcs_path):
+            bucket_name, blob_name = gcs_path.replace("gs://", "").split("/", 1)
+            blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+            if blob is None:
+                raise FileNotFoundError(f"No existe el objeto {gcs_path}")
+            return GcsXmlSource(blob)
+        return list(self._executor.map(load, gcs_paths))
+
+    def split_cached(self, xml_files: List[Any]) -> Tuple[List[Any], List[Dict[str, Any]]]:
+        """
+        Separa los XML cuyo resultado terminal ya está en el CavaliResultStore.
+        Retorna (XML por enviar, resultados en caché agrupados por el proceso
+        de Cavali que los bloqueó).
+        """
+        if self.result_store is None:
+            return xml_files, []
+        to_send, cached = [], {}
+        for source in xml_files:
+            result = self.result_store.get(source.cache_key) if source.cache_key else None
+            if result is None:
+                to_send.append(source)
+                continue
+            # Sin clave "id_proceso": el scheduler no vuelve a consultar estos resultados.
+            entry = cached.setdefault(str(result["id_proceso"]), {
+                "desde_cache": True,
+                "id_proceso_cacheado": result["id_proceso"],
+                "estado_resultado": result["estado_resultado"],
+                "facturas": []
+            })
+            entry["facturas"].append({"name": source.filename, "cache_key": source.cache_key})
+        return to_send, list(cached.values())
+
+    def validate_invoices_in_batches(self, xml_files: List[Any]) -> List[Dict[str, Any]]:
         """
-        Divide la lista completa de XML en lotes y procesa cada uno.
-        Retorna una lista con todas las respuestas combinadas de Cavali.
+        Divide la lista completa de XML en lotes (por cantidad y por bytes) y
+        los envía a bloqueo en paralelo (hasta `max_concurrent_batches` a la
+        vez). Las facturas que Cavali ya procesó (según el CavaliResultStore)
+        no se reenvían. Retorna una lista con las respuestas de bloqueo de
+        Cavali, en el orden de los lotes, seguida de los resultados en caché.
         """
         if not self.is_enabled:
             print("ADVERTENCIA: La integración con Cavali está deshabilitada (CAVALI_ENABLED=false). Omitiendo el envío.")
@@ -104,26 +233,154 @@ def validate_invoices_in_batches(self, xml_files: List[Dict[str, Any]]) -> List[
             print("Lote de XML vacío. No se envía a Cavali.")
             return [{"status": "skipped", "message": "No XML files to process."}]
 
-        token = self._get_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "x-api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
+        xml_files, cached_results = self.split_cached(xml_files)
+        if cached_results:
+            print(f"{sum(len(r['facturas']) for r in cached_results)} XML ya procesados por Cavali; se usa el resultado en caché.")
 
         # Dividir la lista de archivos en lotes (chunks)
-        batches = [xml_files[i:i + self.BATCH_SIZE] for i in range(0, len(xml_files), self.BATCH_SIZE)]
-        all_results = []
+        batches = plan_batches(xml_files, self.BATCH_SIZE, self.batch_max_bytes)
         
-        print(f"Total de {len(xml_files)} XML a procesar en {len(batches)} lote(s) de hasta {self.BATCH_SIZE} c/u.")
+        print(f"Total de {len(xml_files)} XML a procesar en {len(batches)} lote(s) de hasta {self.BATCH_SIZE} c/u "
+              f"y {self.batch_max_bytes} bytes.")
 
-        for i, batch in enumerate(batches):
-            batch_result = self._send_batch(batch, headers, i + 1)
-            all_results.append(batch_result)
-            if i < len(batches) - 1:
-                print("Siguiente lote...")
-        
-        return all_results
+        futures = [
+            self._executor.submit(instrumentation.in_context(self._send_batch), batch, i + 1)
+            for i, batch in enumerate(batches)
+        ]
+        return [future.result() for future in futures] + cached_results
+
+    def record_results(self, cavali_results: List[Dict[str, Any]]):
+        """
+        Guarda por factura el resultado de Cavali, solo si fue exitoso: el
+        proceso terminó en un estado de CAVALI_SUCCESS_STATES y, si la
+        respuesta detalla la factura, ella también. Los errores de bloqueo,
+        los vencimientos y las facturas rechazadas no se guardan, así un
+        reintento las vuelve a enviar.
+        """
+        if self.result_store is None:
+            return
+        for result in cavali_results:
+            estado = result.get("estado_resultado")
+            if not result.get("id_proceso") or not is_successful_status(estado):
+                continue
+            invoice_states = _find_invoice_states(estado, {f["name"] for f in result.get("facturas", [])})
+            for factura in result.get("facturas", []):
+                state = invoice_states.get(factura["name"])
+                if not factura["cache_key"] or (state is not None and state.strip().upper() not in CAVALI_CONFIG["success_states"]):
+                    continue
+                self.result_store.put(factura["cache_key"], {"id_proceso": result["id_proceso"], "estado_resultado": estado})
+
+def _find_process_state(data):
+    # Cavali no documenta una ruta fija para el estado; se busca la primera clave conocida.
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if key.lower() in ("estado", "estadoproceso", "processstatus", "status") and isinstance(value, str):
+                return value
+        for value in data.values():
+            state = _find_process_state(value)
+            if state is not None:
+                return state
+    elif isinstance(data, list):
+        for value in data:
+            state = _find_process_state(value)
+            if state is not None:
+                return state
+    return None
+
+def _find_invoice_states(data, names) -> Dict[str, str]:
+    # Si Cavali detalla las facturas, cada detalle es un objeto que menciona el
+    # nombre del archivo (con o sin extensión) junto a su propio estado.
+    keys = {name: name for name in names}
+    keys.update({name.rsplit(".", 1)[0]: name for name in names})
+    states = {}
+    def walk(node):
+        if isinstance(node, dict):
+            matched = [keys[v] for v in node.values() if isinstance(v, str) and v in keys]
+            state = next((v for k, v in node.items()
+                          if k.lower() in ("estado", "estadoproceso", "processstatus", "status") and isinstance(v, str)), None)
+            for name in matched:
+                if state is not None:
+                    states[name] = state
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+    walk(data)
+    return states
+
+def is_successful_status(resultado_estado: Dict[str, Any]) -> bool:
+    """Terminal y exitoso: el estado del proceso está entre CAVALI_SUCCESS_STATES."""
+    if not isinstance(resultado_estado, dict) or resultado_estado.get("status") in ("timeout", "error"):
+        return False
+    state = _find_process_state(resultado_estado)
+    return state is not None and state.strip().upper() in CAVALI_CONFIG["success_states"]
+
+def is_terminal_status(resultado_estado: Dict[str, Any]) -> bool:
+    """
+    Un proceso es terminal si su estado no está entre CAVALI_PENDING_STATES.
+    Si la respuesta no trae un estado reconocible se considera terminal, como
+    cuando el estado se consultaba una sola vez.
+    """
+    state = _find_process_state(resultado_estado)
+    return state is None or state.strip().upper() not in CAVALI_CONFIG["pending_states"]
+
+def publish_cavali_result(op_id: str, cavali_results: List[Dict[str, Any]]):
+    try:
+        cavali_client.record_results(cavali_results)
+    except Exception as e:
+        print(f"ADVERTENCIA: no se pudo guardar el resultado de Cavali en caché para op {op_id}: {e}")
+    result_event = {"operation_id": op_id, "status": "SUCCESS", "cavali_results": cavali_results}
+    # Corre en el hilo del scheduler: se espera la confirmación para que un fallo
+    # quede registrado (el scheduler lo reporta) en lugar de perderse en silencio.
+    codec.publish(publisher, EVENT_TOPIC_PATH, result_event).result()
+    print(f"[Cavali Service] Éxito para op: {op_id}")
+
+result_store = CavaliResultStore(
+    max_entries=CAVALI_CONFIG["result_store_max_entries"],
+    sqlite_path=CAVALI_CONFIG["result_store_path"]
+)
+cavali_client = CavaliClient(CAVALI_CONFIG, result_store)
+status_scheduler = CavaliStatusScheduler(
+    cavali_client.poll_status, is_terminal_status, publish_cavali_result,
+    initial_delay=CAVALI_CONFIG["status_initial_delay"],
+    max_delay=CAVALI_CONFIG["status_max_delay"],
+    max_wait=CAVALI_CONFIG["status_max_wait"],
+    max_concurrent_polls=CAVALI_CONFIG["max_concurrent_batches"]
+)
+
+@app.on_event("startup")
+async def on_startup():
+    global consumers
+    status_scheduler.start()
+    consumers = start_pull_consumers([COMMAND_TOPIC_NAME], "cavali-service", process_message, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown_consumers():
+    # Se detienen antes que el resto: los mensajes en curso aún necesitan los clientes y el event loop.
+    await stop_pull_consumers(consumers)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    handoff_pending_operations(status_scheduler.stop())
+    cavali_client.close()
+
+def handoff_pending_operations(unfinished: List[Tuple[str, List[Dict[str, Any]], float]]):
+    """
+    Devuelve al bus las operaciones que aún esperaban a Cavali: se publican
+    de nuevo en commands-validate-cavali con sus lotes ya bloqueados, y la
+    instancia que las reciba solo retoma la consulta de estado.
+    """
+    futures = []
+    for op_id, batch_results, deadline in unfinished:
+        command = {"operation_id": op_id, "pending_batches": batch_results, "poll_deadline": deadline}
+        futures.append((op_id, codec.publish(publisher, COMMAND_TOPIC_PATH, command)))
+    for op_id, future in futures:
+        try:
+            future.result(timeout=10)
+            print(f"[Cavali Service] Consulta de estado de op {op_id} traspasada a otra instancia.")
+        except Exception as e:
+            print(f"ERROR: no se pudo traspasar la consulta de estado de op {op_id}; queda sin resultado: {e}")
 
 
 @app.post("/", status_code=204)
@@ -131,29 +388,57 @@ async def handle_pubsub_message(request: Request):
     envelope = await request.json()
     message = envelope.get("message")
     if not message: return ""
+    return await process_message(message)
 
-    command = json.loads(base64.b64decode(message["data"]).decode("utf-8"))
-    op_id = command.get("operation_id")
-    # El orquestador debe enviar los XML como una lista de diccionarios:
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
+    try:
+        command = codec.decode_push_message(CavaliCommand, message)
+    except ValidationError as e:
+        print(f"[Cavali Service] Comando inválido descartado: {e}")
+        error_event = codec.invalid_command_event(message, e)
+        if error_event is not None:
+            await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, error_event))
+        return ""
+    op_id = command.operation_id
+    if command.pending_batches:
+        print(f"[Cavali Service] Retomando la consulta de estado para op: {op_id}")
+        status_scheduler.track(op_id, command.pending_batches, deadline=command.poll_deadline)
+        return ""
+    if status_scheduler.is_tracking(op_id):
+        # Reentrega mientras los lotes siguen en curso: no se vuelven a bloquear.
+        print(f"[Cavali Service] La op {op_id} ya espera a Cavali; se ignora el duplicado.")
+        return ""
+    # El orquestador envía referencias a GCS en xml_file_paths; se acepta aún el
+    # formato anterior con el contenido en línea:
     # [{"filename": "...", "content_bytes": "base64-encoded-content"}, ...]
-    xml_files_data = command.get("xml_files_data", [])
+    xml_file_paths = command.xml_file_paths
+    xml_files_data = command.xml_files_data
 
     print(f"[Cavali Service] Comando recibido para op: {op_id}")
     result_event = {"operation_id": op_id}
 
     if not CAVALI_CONFIG["enabled"]:
         result_event.update({"status": "SKIPPED", "cavali_results": "Service disabled"})
-    elif not xml_files_data:
+    elif not xml_file_paths and not xml_files_data:
         result_event.update({"status": "SKIPPED", "cavali_results": "No XML files provided"})
     else:
         try:
             # Aquí la lógica completa de tu adapter
-            cavali_responses = validate_invoices_in_batches(xml_files_data)
-            result_event.update({"status": "SUCCESS", "cavali_results": cavali_responses})
-            print(f"[Cavali Service] Éxito para op: {op_id}")
+            # El cliente es bloqueante (requests); se ejecuta fuera del event loop.
+            loop = asyncio.get_running_loop()
+            if xml_file_paths:
+                sources = await loop.run_in_executor(None, instrumentation.in_context(cavali_client.load_gcs_sources), xml_file_paths)
+            else:
+                sources = [InlineXmlSource(f.filename, f.content_bytes) for f in xml_files_data]
+            block_results = await loop.run_in_executor(None, instrumentation.in_context(cavali_client.validate_invoices_in_batches), sources)
+            # El evento events-cavali-validated lo publica el scheduler cuando
+            # todos los lotes llegan a un estado terminal.
+            status_scheduler.track(op_id, block_results)
+            return ""
         except Exception as e:
             print(f"[Cavali Service] ERROR para op {op_id}: {e}")
             result_event.update({"status": "ERROR", "error_message": str(e)})
 
-    publisher.publish(EVENT_TOPIC_PATH, json.dumps(result_event).encode("utf-8"))
+    await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, result_event))
     return ""
\ No newline at end of file
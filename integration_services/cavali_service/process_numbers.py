@@ -0,0 +1,69 @@
+import threading
+import time
+from typing import Optional, Tuple
+
+from google.api_core.exceptions import PreconditionFailed
+
+# Cavali guarda processNumber como entero de 32 bits con signo: como máximo
+# 10 dígitos (2147483647). El valor original era int(time.time()) + número de
+# lote (~1.7e9), y este generador se mantiene en ese mismo rango.
+MAX_PROCESS_NUMBER = 2**31 - 1
+
+class ProcessNumberGenerator:
+    """
+    Genera los processNumber de Cavali, únicos entre instancias del servicio.
+
+    Con `sequence_blob` (un objeto de GCS) los números salen de un contador
+    compartido: cada instancia reserva bloques de `block_size` números con una
+    escritura condicionada a la generación del objeto, así dos instancias
+    nunca obtienen el mismo bloque. El contador arranca en int(time.time()),
+    por encima de los números que ya se enviaron con el esquema anterior.
+
+    Sin `sequence_blob` el contador es local (una sola instancia): parte de
+    int(time.time()) y avanza de uno en uno.
+    """
+
+    def __init__(self, sequence_blob=None, block_size: int = 100, max_attempts: int = 10):
+        self.sequence_blob = sequence_blob
+        self.block_size = block_size
+        self.max_attempts = max_attempts
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve()
+            value = self._next
+            self._next += 1
+        if value > MAX_PROCESS_NUMBER:
+            raise OverflowError(f"processNumber {value} excede el máximo de Cavali ({MAX_PROCESS_NUMBER}).")
+        return value
+
+    def _reserve(self) -> Tuple[int, int]:
+        if self.sequence_blob is None:
+            start = max(self._next, int(time.time()))
+            return start, start + 1
+        for _ in range(self.max_attempts):
+            try:
+                start, generation = self._read_sequence()
+                # if_generation_match=0: solo se crea si nadie más lo creó antes.
+                self.sequence_blob.upload_from_string(str(start + self.block_size), if_generation_match=generation)
+            except PreconditionFailed:
+                continue  # otra instancia reservó un bloque entre la lectura y la escritura
+            return start, start + self.block_size
+        raise RuntimeError("No se pudo reservar un bloque de processNumber en GCS (demasiada contención).")
+
+    def _read_sequence(self) -> Tuple[int, int]:
+        blob = self.sequence_blob.bucket.get_blob(self.sequence_blob.name)
+        if blob is None:
+            return int(time.time()), 0
+        return int(blob.download_as_text(if_generation_match=blob.generation)), blob.generation
+
+def sequence_blob_from_uri(storage_client, uri: Optional[str]):
+    """Objeto de GCS del contador a partir de 'gs://bucket/ruta', o None si no se configuró."""
+    if not uri:
+        return None
+    bucket_name, blob_name = uri.replace("gs://", "").split("/", 1)
+    return storage_client.bucket(bucket_name).blob(blob_name)
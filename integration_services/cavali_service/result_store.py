@@ -0,0 +1,58 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+class CavaliResultStore:
+    """
+    Resultado terminal de Cavali por factura, indexado por el hash del XML
+    (md5 de GCS o SHA-256 del contenido). Sirve para no volver a bloquear
+    facturas que Cavali ya procesó cuando una operación se reintenta o se
+    reenvía en parte. Tiene un nivel LRU en memoria y, opcionalmente, un
+    archivo SQLite.
+
+    Es un caché local de cada instancia, no un registro durable: la memoria
+    se pierde al reiniciar y el archivo SQLite sobrevive solo si
+    CAVALI_RESULT_STORE_PATH apunta a un volumen persistente (en Cloud Run el
+    disco local es memoria y desaparece con la instancia). Una factura que no
+    está aquí simplemente se vuelve a enviar a Cavali.
+    """
+
+    def __init__(self, max_entries: int = 10000, sqlite_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS cavali_results (invoice_key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+            self._db.commit()
+
+    def get(self, invoice_key: str) -> Optional[dict]:
+        with self._lock:
+            result = self._memory.get(invoice_key)
+            if result is None and self._db is not None:
+                row = self._db.execute("SELECT result FROM cavali_results WHERE invoice_key = ?", (invoice_key,)).fetchone()
+                if row is not None:
+                    result = json.loads(row[0])
+                    self._remember(invoice_key, result)
+            elif result is not None:
+                self._memory.move_to_end(invoice_key)
+            return dict(result) if result is not None else None
+
+    def put(self, invoice_key: str, result: dict):
+        with self._lock:
+            self._remember(invoice_key, dict(result))
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cavali_results (invoice_key, result) VALUES (?, ?)",
+                    (invoice_key, json.dumps(result))
+                )
+                self._db.commit()
+
+    def _remember(self, invoice_key: str, result: dict):
+        self._memory[invoice_key] = result
+        self._memory.move_to_end(invoice_key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
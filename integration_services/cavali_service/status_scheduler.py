@@ -0,0 +1,175 @@
+import contextvars
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from shared import instrumentation
+
+class CavaliStatusScheduler:
+    """
+    Consulta en segundo plano el estado de los procesos de bloqueo de Cavali.
+
+    Cavali procesa los bloqueos de forma asíncrona, así que en lugar de
+    consultar una sola vez justo después del bloqueo, cada `idProceso`
+    pendiente se consulta con backoff exponencial y jitter hasta que llega a
+    un estado terminal (o vence `max_wait`). Los procesos que vencen en el
+    mismo ciclo se consultan juntos, y si varias operaciones esperan el mismo
+    `idProceso` se consulta una sola vez. Cuando todos los lotes de una
+    operación terminan se llama a `on_complete(operation_id, resultados)`.
+
+    El estado vive en memoria: al detener el servicio, `stop()` retorna las
+    operaciones que aún esperaban a Cavali para que otra instancia las retome
+    con `track(..., deadline=...)` sin volver a bloquear sus facturas.
+    """
+
+    def __init__(self, poll_status: Callable[[Any], Dict[str, Any]], is_terminal: Callable[[Dict[str, Any]], bool],
+                 on_complete: Callable[[str, List[Dict[str, Any]]], None], initial_delay: float = 2.0,
+                 max_delay: float = 60.0, max_wait: float = 1800.0, max_concurrent_polls: int = 10):
+        self.poll_status = poll_status
+        self.is_terminal = is_terminal
+        self.on_complete = on_complete
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_polls, thread_name_prefix="cavali-status")
+        self._heap = []               # (próxima consulta, idProceso)
+        self._processes = {}          # idProceso -> {"delay", "deadline", "waiters": [(op_id, índice de lote)]}
+        self._operations = {}         # op_id -> {"results": [...], "pending": n, "context": Context}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=instrumentation.in_service(self._run), name="cavali-status-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> List[Tuple[str, List[Dict[str, Any]], float]]:
+        """
+        Detiene el scheduler y retorna las operaciones sin terminar como
+        (op_id, resultados por lote, plazo límite en epoch). Los lotes que ya
+        llegaron a un estado terminal traen su `estado_resultado`.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._executor.shutdown(wait=True)
+
+        with self._cond:
+            offset = time.time() - time.monotonic()
+            unfinished = []
+            for op_id, operation in self._operations.items():
+                deadlines = [process["deadline"] for process in self._processes.values()
+                             if any(waiter[0] == op_id for waiter in process["waiters"])]
+                unfinished.append((op_id, operation["results"], min(deadlines) + offset))
+            self._operations.clear()
+            self._processes.clear()
+            self._heap.clear()
+            return unfinished
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._processes)
+
+    def is_tracking(self, op_id: str) -> bool:
+        with self._cond:
+            return op_id in self._operations
+
+    def track(self, op_id: str, batch_results: List[Dict[str, Any]], deadline: Optional[float] = None):
+        """
+        Registra los lotes de una operación tras el bloqueo. Solo se consultan
+        los lotes con `id_proceso` y sin `estado_resultado` (los de bloqueo
+        fallido o ya terminados se conservan tal cual). Si no queda ninguno
+        pendiente, `on_complete` se llama de inmediato. `deadline` (epoch) es
+        el plazo de una operación retomada; por defecto, ahora + `max_wait`.
+        """
+        results = [dict(r) for r in batch_results]
+        to_poll = [(i, r["id_proceso"]) for i, r in enumerate(results)
+                   if r.get("id_proceso") and r.get("estado_resultado") is None]
+        if not to_poll:
+            self.on_complete(op_id, results)
+            return
+
+        now = time.monotonic()
+        process_deadline = now + (self.max_wait if deadline is None else deadline - time.time())
+        with self._cond:
+            if op_id in self._operations:
+                print(f"La op {op_id} ya tiene lotes pendientes en Cavali; se ignora el duplicado.")
+                return
+            # `on_complete` corre con el contexto de quien registró la operación (p. ej. su traza).
+            self._operations[op_id] = {"results": results, "pending": len(to_poll),
+                                       "context": contextvars.copy_context()}
+            for index, id_proceso in to_poll:
+                process = self._processes.get(id_proceso)
+                if process is None:
+                    process = {"delay": self.initial_delay, "deadline": process_deadline, "waiters": []}
+                    self._processes[id_proceso] = process
+                    heapq.heappush(self._heap, (now + self._jitter(self.initial_delay), id_proceso))
+                process["waiters"].append((op_id, index))
+            self._cond.notify()
+
+    def _jitter(self, delay: float) -> float:
+        return random.uniform(delay / 2, delay)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = set()
+                while self._heap and self._heap[0][0] <= now:
+                    due.add(heapq.heappop(self._heap)[1])
+
+            futures = {id_proceso: self._executor.submit(contextvars.copy_context().run, self.poll_status, id_proceso)
+                       for id_proceso in due}
+            for id_proceso, future in futures.items():
+                try:
+                    estado = future.result()
+                    error = None
+                except Exception as e:
+                    estado, error = None, e
+                self._handle_poll(id_proceso, estado, error)
+
+    def _handle_poll(self, id_proceso, estado: Optional[Dict[str, Any]], error: Optional[Exception]):
+        completed = []
+        with self._cond:
+            process = self._processes.get(id_proceso)
+            if process is None:
+                return
+            now = time.monotonic()
+            if estado is not None and self.is_terminal(estado):
+                final = estado
+            elif now >= process["deadline"]:
+                final = {"status": "timeout", "message": f"Cavali no terminó el proceso en {self.max_wait:.0f}s",
+                         "ultimo_estado": estado if estado is not None else str(error)}
+            else:
+                if error is not None:
+                    print(f"ADVERTENCIA: error consultando el proceso {id_proceso} en Cavali: {error}")
+                process["delay"] = min(process["delay"] * 2, self.max_delay)
+                heapq.heappush(self._heap, (now + self._jitter(process["delay"]), id_proceso))
+                return
+
+            del self._processes[id_proceso]
+            for op_id, index in process["waiters"]:
+                operation = self._operations[op_id]
+                operation["results"][index]["estado_resultado"] = final
+                operation["pending"] -= 1
+                if operation["pending"] == 0:
+                    del self._operations[op_id]
+                    completed.append((op_id, operation["results"], operation["context"]))
+
+        for op_id, results, context in completed:
+            try:
+                context.run(self.on_complete, op_id, results)
+            except Exception as e:
+                print(f"ERROR notificando el resultado de Cavali para op {op_id}: {e}")
@@ -0,0 +1,58 @@
+import importlib.util
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+ROOT = os.path.dirname(os.path.dirname(SERVICE_DIR))
+sys.path.insert(0, ROOT)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def fake_cavali():
+    """loadtest/fake_apis.py sin latencia, con procesos que tardan 1 s en terminar."""
+    os.environ.update({"FAKE_CAVALI_LATENCY_MS": "0", "FAKE_CAVALI_PROCESS_SECONDS": "1"})
+    sys.path.insert(0, os.path.join(ROOT, "loadtest"))
+    import fake_apis
+    import uvicorn
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_apis.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield fake_apis, f"http://127.0.0.1:{port}/cavali"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture(scope="session")
+def cavali(fake_cavali):
+    _, base_url = fake_cavali
+    os.environ.update({
+        "MESSAGE_TRANSPORT": "inprocess",
+        # Solo se usan XML en línea; el cliente de GCS no llega a conectarse.
+        "STORAGE_EMULATOR_HOST": "http://127.0.0.1:9",
+        "CAVALI_TOKEN_URL": f"{base_url}/token",
+        "CAVALI_BLOCK_URL": f"{base_url}/block",
+        "CAVALI_STATUS_URL": f"{base_url}/status",
+        "CAVALI_STATUS_INITIAL_DELAY": "0.2",
+        "CAVALI_STATUS_MAX_DELAY": "0.2",
+    })
+    spec = importlib.util.spec_from_file_location("cavali_main", os.path.join(SERVICE_DIR, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    module.cavali_client.close()
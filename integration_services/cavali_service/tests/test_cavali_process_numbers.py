@@ -0,0 +1,81 @@
+import threading
+
+from google.api_core.exceptions import PreconditionFailed
+
+from process_numbers import MAX_PROCESS_NUMBER, ProcessNumberGenerator
+
+
+class FakeBucket:
+    """Bucket en memoria con la semántica de if_generation_match de GCS."""
+
+    def __init__(self):
+        self.objects = {}  # nombre -> (contenido, generación)
+        self.lock = threading.Lock()
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        if name not in self.objects:
+            return None
+        blob = FakeBlob(self, name)
+        blob.generation = self.objects[name][1]
+        return blob
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+
+    def download_as_text(self, if_generation_match=None):
+        with self.bucket.lock:
+            content, generation = self.bucket.objects[self.name]
+            if if_generation_match is not None and generation != if_generation_match:
+                raise PreconditionFailed("generation mismatch")
+            return content
+
+    def upload_from_string(self, data, if_generation_match=None):
+        with self.bucket.lock:
+            generation = self.bucket.objects.get(self.name, (None, 0))[1]
+            if if_generation_match is not None and generation != if_generation_match:
+                raise PreconditionFailed("generation mismatch")
+            self.bucket.objects[self.name] = (data, generation + 1)
+
+
+def test_local_generator_stays_in_int32_range():
+    generator = ProcessNumberGenerator()
+    numbers = [generator.next() for _ in range(1000)]
+    assert len(set(numbers)) == 1000
+    assert numbers == sorted(numbers)
+    assert 10**9 < numbers[0] and numbers[-1] <= MAX_PROCESS_NUMBER
+
+
+def test_instances_sharing_a_sequence_never_collide():
+    bucket = FakeBucket()
+    generators = [ProcessNumberGenerator(bucket.blob("cavali/process-number"), block_size=7) for _ in range(4)]
+    numbers = []
+    lock = threading.Lock()
+
+    def worker(generator):
+        values = [generator.next() for _ in range(200)]
+        with lock:
+            numbers.extend(values)
+
+    threads = [threading.Thread(target=worker, args=(g,)) for g in generators for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(numbers) == len(set(numbers)) == 1600
+    assert max(numbers) <= MAX_PROCESS_NUMBER
+
+
+def test_sequence_continues_after_restart():
+    bucket = FakeBucket()
+    first = ProcessNumberGenerator(bucket.blob("seq"), block_size=10)
+    used = [first.next() for _ in range(3)]
+    restarted = ProcessNumberGenerator(bucket.blob("seq"), block_size=10)
+    assert restarted.next() == used[0] + 10
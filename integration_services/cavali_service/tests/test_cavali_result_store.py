@@ -0,0 +1,40 @@
+from result_store import CavaliResultStore
+
+
+def batch(id_proceso, estado, *names):
+    return {"id_proceso": id_proceso, "estado_resultado": estado,
+            "facturas": [{"name": name, "cache_key": f"md5:{name}"} for name in names]}
+
+
+def client_with_store(cavali):
+    store = CavaliResultStore()
+    client = cavali.CavaliClient(cavali.CAVALI_CONFIG, store)
+    client.close()
+    return client, store
+
+
+def test_only_successful_processes_are_cached(cavali):
+    client, store = client_with_store(cavali)
+    client.record_results([
+        batch(1, {"response": {"idProceso": 1, "estado": "PROCESADO"}}, "ok.xml"),
+        batch(2, {"response": {"idProceso": 2, "estado": "RECHAZADO"}}, "rechazado.xml"),
+        batch(3, {"status": "timeout", "ultimo_estado": {"response": {"estado": "PENDIENTE"}}}, "vencido.xml"),
+        {"bloqueo_resultado": {"status": "error"}, "estado_resultado": None,
+         "facturas": [{"name": "sin-bloqueo.xml", "cache_key": "md5:sin-bloqueo.xml"}]},
+    ])
+    assert store.get("md5:ok.xml")["id_proceso"] == 1
+    for name in ("rechazado.xml", "vencido.xml", "sin-bloqueo.xml"):
+        assert store.get(f"md5:{name}") is None
+
+
+def test_rejected_invoices_in_a_successful_process_are_not_cached(cavali):
+    client, store = client_with_store(cavali)
+    estado = {"response": {"idProceso": 7, "estado": "PROCESADO", "facturas": [
+        {"archivo": "F001-1.xml", "estado": "BLOQUEADO"},
+        {"archivo": "F001-2", "estado": "RECHAZADO", "mensaje": "Factura ya registrada"},
+    ]}}
+    client.record_results([batch(7, estado, "F001-1.xml", "F001-2.xml", "F001-3.xml")])
+    assert store.get("md5:F001-1.xml") is not None
+    assert store.get("md5:F001-2.xml") is None
+    # Sin detalle propio, la factura toma el estado del proceso.
+    assert store.get("md5:F001-3.xml") is not None
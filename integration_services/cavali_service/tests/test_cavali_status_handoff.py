@@ -0,0 +1,90 @@
+import asyncio
+import base64
+import json
+import time
+
+
+def subscribe(cavali, topic):
+    received = []
+    consumer = cavali.publisher.subscribe(topic, f"{topic}-test", lambda m: received.append(json.loads(m.data)))
+    return received, consumer
+
+
+def push(payload: dict) -> dict:
+    return {"data": base64.b64encode(json.dumps(payload).encode()).decode(), "attributes": {}}
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "tiempo de espera agotado"
+        time.sleep(0.05)
+
+
+def new_instance(cavali, monkeypatch):
+    """Cliente y scheduler nuevos, como los de otra instancia del servicio."""
+    client = cavali.CavaliClient(cavali.CAVALI_CONFIG)
+    scheduler = cavali.CavaliStatusScheduler(
+        client.poll_status, cavali.is_terminal_status, cavali.publish_cavali_result,
+        initial_delay=0.2, max_delay=0.2, max_wait=30,
+    )
+    monkeypatch.setattr(cavali, "cavali_client", client)
+    monkeypatch.setattr(cavali, "status_scheduler", scheduler)
+    scheduler.start()
+    return client, scheduler
+
+
+def command(op_id):
+    xml = base64.b64encode(f"<Invoice>{op_id}</Invoice>".encode()).decode()
+    return {"operation_id": op_id, "xml_files_data": [{"filename": f"{op_id}.xml", "content_bytes": xml}]}
+
+
+def test_shutdown_hands_pending_polls_back_to_the_bus(cavali, fake_cavali, monkeypatch):
+    fake_apis, _ = fake_cavali
+    events, events_consumer = subscribe(cavali, "events-cavali-validated")
+    commands, commands_consumer = subscribe(cavali, cavali.COMMAND_TOPIC_NAME)
+    try:
+        client, scheduler = new_instance(cavali, monkeypatch)
+        asyncio.run(cavali.process_message(push(command("op-handoff"))))
+        blocked = dict(fake_apis._processes)
+        assert len(blocked) == 1 and scheduler.is_tracking("op-handoff")
+        next_block_id = next(fake_apis._process_ids)
+
+        # La instancia se detiene antes de que Cavali termine el proceso.
+        cavali.handoff_pending_operations(scheduler.stop())
+        client.close()
+        wait_for(lambda: commands)
+        handoff = commands[0]
+        assert handoff["operation_id"] == "op-handoff"
+        assert [b["id_proceso"] for b in handoff["pending_batches"]] == list(blocked)
+        assert handoff["poll_deadline"] > time.time()
+        assert events == []
+
+        # Otra instancia recibe el traspaso y solo consulta el estado: no vuelve a bloquear.
+        client, scheduler = new_instance(cavali, monkeypatch)
+        asyncio.run(cavali.process_message(push(handoff)))
+        wait_for(lambda: events, timeout=15)
+        scheduler.stop()
+        client.close()
+
+        assert events[0]["status"] == "SUCCESS"
+        [result] = events[0]["cavali_results"]
+        assert result["id_proceso"] == list(blocked)[0]
+        assert result["estado_resultado"]["response"]["estado"] == "PROCESADO"
+        assert next(fake_apis._process_ids) == next_block_id + 1
+    finally:
+        events_consumer.stop()
+        commands_consumer.stop()
+
+
+def test_redelivery_while_tracking_does_not_block_again(cavali, fake_cavali, monkeypatch):
+    fake_apis, _ = fake_cavali
+    client, scheduler = new_instance(cavali, monkeypatch)
+    try:
+        asyncio.run(cavali.process_message(push(command("op-duplicate"))))
+        blocks = next(fake_apis._process_ids)
+        asyncio.run(cavali.process_message(push(command("op-duplicate"))))
+        assert next(fake_apis._process_ids) == blocks + 1
+    finally:
+        scheduler.stop()
+        client.close()
@@ -0,0 +1,54 @@
+import time
+
+from token_cache import TokenCache
+
+
+class FakeTokenEndpoint:
+    def __init__(self, expires_in: float):
+        self.expires_in = expires_in
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f"token-{self.calls}", self.expires_in
+
+
+def test_margin_is_clamped_for_short_lived_tokens():
+    endpoint = FakeTokenEndpoint(expires_in=20)
+    cache = TokenCache(endpoint, refresh_margin=60)
+    try:
+        # Con el margen sin limitar (60s > 20s) cada petición volvería a pedir el token.
+        assert cache.get_token() == "token-1"
+        assert cache.get_token() == "token-1"
+        assert endpoint.calls == 1
+    finally:
+        cache.close()
+
+
+def test_background_refresh_runs_before_token_goes_stale():
+    endpoint = FakeTokenEndpoint(expires_in=4)
+    cache = TokenCache(endpoint, refresh_margin=1)
+    try:
+        cache.get_token()
+        # Margen 1s: el token deja de ser fresco a los 3s y se renueva a los 2s.
+        time.sleep(2.5)
+        assert endpoint.calls == 2
+        assert cache._is_fresh()
+        assert cache.get_token() == "token-2"
+        assert endpoint.calls == 2
+    finally:
+        cache.close()
+
+
+def test_background_refresh_skips_when_newer_token_is_cached():
+    endpoint = FakeTokenEndpoint(expires_in=300)
+    cache = TokenCache(endpoint, refresh_margin=10)
+    try:
+        cache.get_token()
+        stale_generation = cache._generation
+        cache.force_refresh("token-1")
+        cache._background_refresh(stale_generation)
+        assert endpoint.calls == 2
+        assert cache.get_token() == "token-2"
+    finally:
+        cache.close()
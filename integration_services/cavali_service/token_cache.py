@@ -0,0 +1,92 @@
+import threading
+import time
+from typing import Callable, Optional, Tuple
+from shared import instrumentation
+
+class TokenCache:
+    """
+    Caché de un token OAuth (client credentials) compartida por todo el proceso.
+
+    - Respeta `expires_in`: el token se reutiliza hasta `refresh_margin`
+      segundos antes de que venza. El margen se limita a una fracción
+      (`max_margin_fraction`) de `expires_in`, para que un token de vida corta
+      no nazca ya vencido.
+    - Un temporizador en segundo plano lo renueva un margen antes de ese
+      límite (a `expires_in - 2 * margen`), así las peticiones normalmente no
+      esperan al endpoint de tokens. Si al dispararse ya hay un token más
+      nuevo en caché, no vuelve a pedirlo.
+    - Single-flight: si varios hilos necesitan renovar a la vez, solo uno
+      llama al endpoint y los demás reutilizan su resultado.
+    - `force_refresh(token)` descarta un token rechazado (401) sin renovar
+      más de una vez si varios hilos reportan el mismo token.
+    """
+
+    def __init__(self, fetch_token: Callable[[], Tuple[str, float]], refresh_margin: float = 60.0,
+                 retry_interval: float = 10.0, max_margin_fraction: float = 0.25):
+        self.fetch_token = fetch_token
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.max_margin_fraction = max_margin_fraction
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._margin = refresh_margin
+        self._generation = 0  # cuenta los tokens obtenidos; el temporizador recuerda el suyo
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+
+    def _is_fresh(self) -> bool:
+        return self._token is not None and time.monotonic() < self._expires_at - self._margin
+
+    def get_token(self) -> str:
+        if self._is_fresh():
+            return self._token
+        with self._lock:
+            if not self._is_fresh():
+                self._refresh_locked()
+            return self._token
+
+    def force_refresh(self, stale_token: str) -> str:
+        with self._lock:
+            if self._token == stale_token or not self._is_fresh():
+                self._refresh_locked()
+            return self._token
+
+    def _refresh_locked(self):
+        token, expires_in = self.fetch_token()
+        self._token = token
+        self._expires_at = time.monotonic() + expires_in
+        self._margin = min(self.refresh_margin, expires_in * self.max_margin_fraction)
+        self._generation += 1
+        self._schedule(max(expires_in - 2 * self._margin, 1.0))
+
+    def _schedule(self, delay: float):
+        if self._closed:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(delay, instrumentation.in_service(self._background_refresh), args=(self._generation,))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self, generation: int):
+        with self._lock:
+            # Otro hilo (p. ej. force_refresh) ya dejó en caché un token más nuevo que el
+            # que programó este temporizador.
+            if self._closed or generation != self._generation:
+                return
+            try:
+                self._refresh_locked()
+            except Exception as e:
+                print(f"ADVERTENCIA: no se pudo renovar el token de Cavali en segundo plano: {e}")
+                # Se reintenta mientras el token actual siga vigente; si vence,
+                # la siguiente petición lo renovará de forma síncrona.
+                if time.monotonic() + self.retry_interval < self._expires_at:
+                    self._schedule(self.retry_interval)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
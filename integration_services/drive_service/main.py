@@ -1,57 +1,120 @@
-import base64
-import json
+import asyncio
 import os
-import io
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request
-from google.cloud import pubsub_v1, storage
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google.cloud import storage
 from googleapiclient.http import MediaIoBaseUpload
+from pydantic import ValidationError
+from shared import codec, instrumentation
+from shared.event_models import DriveCommand
+from shared.google_clients import get_google_service
+from shared.transport import get_transport, start_pull_consumers, stop_pull_consumers
 
 app = FastAPI(title="Drive Service")
+instrumentation.instrument_app(app, "drive-service")
 
 # --- Configuración ---
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
-publisher = pubsub_v1.PublisherClient()
+publisher = get_transport()
+COMMAND_TOPIC_NAME = "commands-archive-drive"
+consumers = []
 EVENT_TOPIC_PATH = publisher.topic_path(PROJECT_ID, "events-drive-archived")
 storage_client = storage.Client()
 CLIENT_SECRETS_JSON = os.getenv("CLIENT_SECRETS_FILE")
 OAUTH_TOKEN_JSON = os.getenv("OAUTH_TOKEN_FILE")
 DRIVE_PARENT_FOLDER_ID = os.getenv("DRIVE_PARENT_FOLDER_ID") # Asegúrate de crear este secreto
 
+# Subidas: cuántos archivos se archivan a la vez y de qué tamaño es cada trozo
+# (múltiplo de 256 KiB, como exige Drive). La memoria por hilo queda acotada
+# por el trozo, sin importar el tamaño de los PDF.
+DRIVE_UPLOAD_CONCURRENCY = int(os.getenv("DRIVE_UPLOAD_CONCURRENCY", "8"))
+DRIVE_CHUNK_SIZE = int(os.getenv("DRIVE_CHUNK_SIZE", str(8 * 1024 * 1024)))
+DRIVE_NUM_RETRIES = int(os.getenv("DRIVE_NUM_RETRIES", "3"))
+upload_executor = ThreadPoolExecutor(max_workers=DRIVE_UPLOAD_CONCURRENCY, thread_name_prefix="drive-upload")
+
+@app.on_event("startup")
+async def on_startup():
+    global consumers
+    consumers = start_pull_consumers([COMMAND_TOPIC_NAME], "drive-service", process_message, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown_consumers():
+    # Se detienen antes que el resto: los mensajes en curso aún necesitan los clientes y el event loop.
+    await stop_pull_consumers(consumers)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    upload_executor.shutdown(wait=True)
+
 def get_drive_service():
-    client_config = json.loads(CLIENT_SECRETS_JSON).get("installed")
-    token_info = json.loads(OAUTH_TOKEN_JSON)
-    creds = Credentials.from_authorized_user_info(info=token_info, client_config=client_config)
-    return build('drive', 'v3', credentials=creds)
+    # Un único cliente por proceso; su transporte es seguro entre hilos.
+    return get_google_service('drive', 'v3', CLIENT_SECRETS_JSON, OAUTH_TOKEN_JSON)
+
+@instrumentation.traced("gcs.metadata")
+def _get_blob(gcs_path: str):
+    bucket_name, blob_name = gcs_path.replace("gs://", "").split("/", 1)
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"No existe el objeto {gcs_path}")
+    return blob
+
+@instrumentation.traced("drive.upload")
+def _upload_blob(drive_service, blob, folder_id: str):
+    """
+    Sube un objeto de GCS a Drive leyéndolo por trozos: el lector de GCS
+    alimenta directamente la subida, sin cargar el archivo en memoria. Los
+    archivos que caben en un trozo van en una sola petición multipart; los
+    demás, en una subida resumable de DRIVE_CHUNK_SIZE por petición.
+    """
+    file_metadata = {'name': os.path.basename(blob.name), 'parents': [folder_id]}
+    with blob.open("rb", chunk_size=DRIVE_CHUNK_SIZE) as reader:
+        media = MediaIoBaseUpload(
+            reader, mimetype=blob.content_type or 'application/octet-stream',
+            chunksize=DRIVE_CHUNK_SIZE, resumable=blob.size > DRIVE_CHUNK_SIZE
+        )
+        drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute(
+            num_retries=DRIVE_NUM_RETRIES
+        )
 
 # --- Lógica de Negocio (de google_drive_adapter.py) ---
 def archive_operation_files(drive_service, operation_id: str, file_paths: list) -> str:
     print(f"[{operation_id}] Iniciando subida a Google Drive...")
     folder_name = f"Operacion_{operation_id}"
-    
+
+    # Los metadatos de GCS se consultan mientras se crea la carpeta.
+    blob_futures = [upload_executor.submit(instrumentation.in_context(_get_blob), gcs_path) for gcs_path in file_paths]
+
     folder_metadata = {
         'name': folder_name,
         'mimeType': 'application/vnd.google-apps.folder',
         'parents': [DRIVE_PARENT_FOLDER_ID]
     }
-    folder = drive_service.files().create(body=folder_metadata, fields='id, webViewLink').execute()
+    with instrumentation.span("drive.create_folder"):
+        folder = drive_service.files().create(body=folder_metadata, fields='id, webViewLink').execute(
+            num_retries=DRIVE_NUM_RETRIES
+        )
     folder_id = folder.get('id')
     folder_url = folder.get('webViewLink')
 
-    for gcs_path in file_paths:
+    # Los más grandes primero: el tiempo total tiende al del archivo más grande.
+    uploads = []
+    for gcs_path, blob_future in zip(file_paths, blob_futures):
+        try:
+            uploads.append((gcs_path, blob_future.result()))
+        except Exception as e:
+            print(f"ADVERTENCIA: Falló la subida de {os.path.basename(gcs_path)}. Error: {e}")
+    uploads.sort(key=lambda upload: upload[1].size or 0, reverse=True)
+
+    upload_futures = [
+        (gcs_path, upload_executor.submit(instrumentation.in_context(_upload_blob), drive_service, blob, folder_id))
+        for gcs_path, blob in uploads
+    ]
+    for gcs_path, future in upload_futures:
         try:
-            filename = os.path.basename(gcs_path)
-            bucket_name, blob_name = gcs_path.replace("gs://", "").split("/", 1)
-            blob = storage_client.bucket(bucket_name).blob(blob_name)
-            file_content = blob.download_as_bytes()
-            
-            file_metadata = {'name': filename, 'parents': [folder_id]}
-            media = MediaIoBaseUpload(io.BytesIO(file_content), resumable=True)
-            drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+            future.result()
         except Exception as e:
-            print(f"ADVERTENCIA: Falló la subida de {filename}. Error: {e}")
-            
+            print(f"ADVERTENCIA: Falló la subida de {os.path.basename(gcs_path)}. Error: {e}")
+
     return folder_url
 
 @app.post("/", status_code=204)
@@ -59,20 +122,35 @@ async def handle_pubsub_message(request: Request):
     envelope = await request.json()
     message = envelope.get("message")
     if not message: return ""
+    return await process_message(message)
 
-    command = json.loads(base64.b64decode(message["data"]).decode("utf-8"))
-    op_id = command.get("operation_id")
-    file_paths = command.get("file_paths", [])
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
+    try:
+        command = codec.decode_push_message(DriveCommand, message)
+    except ValidationError as e:
+        print(f"[Drive Service] Comando inválido descartado: {e}")
+        error_event = codec.invalid_command_event(message, e)
+        if error_event is not None:
+            await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, error_event))
+        return ""
+    op_id = command.operation_id
+    file_paths = command.file_paths
 
     result_event = {"operation_id": op_id}
     print(f"[Drive Service] Comando recibido para op: {op_id}")
     try:
+        # Las subidas son bloqueantes; se ejecutan fuera del event loop.
+        loop = asyncio.get_running_loop()
         service = get_drive_service()
-        folder_url = archive_operation_files(service, op_id, file_paths)
+        folder_url = await loop.run_in_executor(
+            None, instrumentation.in_context(archive_operation_files), service, op_id, file_paths
+        )
         result_event.update({"status": "SUCCESS", "drive_folder_url": folder_url})
     except Exception as e:
         print(f"[Drive Service] ERROR para op {op_id}: {e}")
         result_event.update({"status": "ERROR", "error_message": str(e)})
 
-    publisher.publish(EVENT_TOPIC_PATH, json.dumps(result_event).encode("utf-8"))
+    # Se espera la confirmación del broker; un fallo hace que el comando se reintente.
+    await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, result_event))
     return ""
\ No newline at end of file
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Callable, Dict, List, Optional
+
+class DigestRequest:
+    """Un comando de confirmación a la espera de que salga su resumen."""
+
+    def __init__(self, operation_id: str, subject: str, invoices: list, attachment_paths: list,
+                 future: asyncio.Future):
+        self.operation_id = operation_id
+        self.subject = subject
+        self.invoices = invoices
+        self.attachment_paths = attachment_paths
+        self.future = future
+
+class Digest:
+    """Todas las confirmaciones pendientes de un destinatario, enviadas como un único correo."""
+
+    def __init__(self, recipient: str, requests: List[DigestRequest]):
+        self.recipient = recipient
+        self.requests = requests
+
+    @property
+    def operation_ids(self) -> List[str]:
+        return [r.operation_id for r in self.requests]
+
+    @property
+    def invoices(self) -> list:
+        return [invoice for r in self.requests for invoice in r.invoices]
+
+    @property
+    def attachment_paths(self) -> list:
+        return [path for r in self.requests for path in r.attachment_paths]
+
+class DigestBuffer:
+    """
+    Acumula los comandos de confirmación por destinatario durante `window`
+    segundos y los envía juntos: un correo por destinatario, y todos los
+    destinatarios del ciclo en una sola llamada a `send_digests`.
+
+    `submit` no retorna hasta que el resumen que incluye esa operación se
+    envió (o lanza el error del envío), así el mensaje de Pub/Sub solo se
+    confirma después del envío. `send_digests` es bloqueante: recibe la lista
+    de Digest y retorna, en el mismo orden, None o la excepción de cada uno.
+    """
+
+    def __init__(self, send_digests: Callable[[List[Digest]], List[Optional[Exception]]], window: float = 60.0,
+                 max_operations: int = 50):
+        self.send_digests = send_digests
+        self.window = window
+        self.max_operations = max_operations
+        self._pending: Dict[str, List[DigestRequest]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, recipient: str, operation_id: str, subject: str, invoices: list,
+                     attachment_paths: list) -> int:
+        """Espera a que salga el resumen de `recipient`; retorna cuántas operaciones incluyó."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        requests = self._pending.setdefault(recipient, [])
+        requests.append(DigestRequest(operation_id, subject, invoices, attachment_paths, future))
+
+        if len(requests) >= self.max_operations:
+            self._schedule_flush(loop, 0)
+        elif self._flush_handle is None:
+            self._schedule_flush(loop, self.window)
+        return await future
+
+    def _schedule_flush(self, loop: asyncio.AbstractEventLoop, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        digests = [Digest(recipient, requests) for recipient, requests in pending.items()]
+        print(f"[Gmail Service] Enviando {len(digests)} resumen(es) con "
+              f"{sum(len(d.requests) for d in digests)} operación(es).")
+        try:
+            errors = await asyncio.get_running_loop().run_in_executor(None, self.send_digests, digests)
+        except Exception as e:
+            errors = [e] * len(digests)
+
+        for digest, error in zip(digests, errors):
+            for request in digest.requests:
+                if request.future.done():
+                    continue
+                if error is not None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(len(digest.requests))
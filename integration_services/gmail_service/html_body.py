@@ -0,0 +1,90 @@
+from datetime import datetime
+
+# Plantillas precompiladas: producen el mismo HTML que DataFrame.to_html(index=False,
+# border=0, justify='center', classes='invoices_table') sin cargar pandas.
+DISPLAY_COLUMNS = ['RUC Emisor', 'Empresa Emisora', 'Documento', 'Monto Factura', 'Monto Neto', 'Fecha de Pago']
+TABLE_HEADER = (
+    '<table class="dataframe invoices_table">\n'
+    '  <thead>\n'
+    '    <tr style="text-align: center;">\n'
+    + ''.join(f'      <th>{column}</th>\n' for column in DISPLAY_COLUMNS) +
+    '    </tr>\n'
+    '  </thead>\n'
+    '  <tbody>\n'
+)
+TABLE_ROW = '    <tr>\n' + '      <td>{}</td>\n' * len(DISPLAY_COLUMNS) + '    </tr>\n'
+TABLE_FOOTER = '  </tbody>\n</table>'
+EMAIL_TEMPLATE = """
+        <!DOCTYPE html>
+        <html lang="es">
+        <head>
+            <meta charset="UTF-8">
+            <style>
+                body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; font-size: 14px; color: #333; line-height: 1.6; }}
+                .email-container {{ max-width: 700px; margin: 20px auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9; }}
+                table.invoices_table {{ border-collapse: collapse; width: 100%; margin: 25px 0; }}
+                th, td {{ text-align: left; padding: 12px; border-bottom: 1px solid #eee; }}
+                th {{ background-color: #f2f2f2; font-weight: 600; color: #555; }}
+                .highlight {{ font-weight: 600; color: #0056b3; }}
+                .disclaimer {{ font-style: italic; color: #777; font-size: 11px; margin-top: 30px; border-top: 1px solid #eee; padding-top: 15px; }}
+            </style>
+        </head>
+        <body>
+            <div class="email-container">
+                <p>Estimados señores,</p>
+                <p>
+                    Por medio de la presente, les informamos que los señores de 
+                    {clientes_html} nos han transferido la(s) siguiente(s)
+                    factura(s) negociable(s). Agradeceríamos su amable confirmación.
+                </p>
+                <h3>Detalle de las facturas:</h3>
+                {tabla_html}
+                <p class="disclaimer"><strong>Cláusula Legal:</strong> Sin perjuicio de lo anteriormente mencionado, nos permitimos recordarles que toda acción tendiente a simular 
+                la emisión de la referida factura negociable para obtener un beneficio, teniendo pleno conocimiento de que la misma no proviene de una relación comercial verdadera, 
+                se encuentra sancionada penalmente como delito de estafa en nuestro ordenamiento jurídico. Asimismo, en caso de que vuestra representada cometa un delito de forma 
+                conjunta con el emitente de la factura, dicha acción podría tipificarse como delito de asociación ilícita para delinquir, según el artículo 317 del Código Penal, 
+                por lo que nos reservamos el derecho de iniciar las acciones penales correspondientes.</p>
+            </div>
+        </body>
+        </html>
+        """
+
+CLIENT_TEMPLATE = '<span class="highlight">{}</span> (RUC: {})'
+HTML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+def _cell(value) -> str:
+    # to_html escapa &, < y > y recorta los espacios de cada celda.
+    return str(value).translate(HTML_ESCAPES).strip()
+
+def _format_amount(invoice: dict, field: str) -> str:
+    return f"{invoice.get('currency', '')} {float(invoice.get(field, 0)):,.2f}".strip()
+
+def _format_date(value) -> str:
+    if not value:
+        return 'NaN'
+    return datetime.fromisoformat(str(value)).strftime('%d/%m/%Y')
+
+def create_html_body(invoice_data_list: list) -> str:
+        """
+        Crea el cuerpo HTML del correo a partir de una lista de datos de facturas
+        (diccionarios, como los envía el orquestador, o modelos pydantic). En un
+        resumen con facturas de varios clientes se nombra a cada uno.
+        """
+        if not invoice_data_list:
+            return "<p>No se encontraron datos de facturas válidos para procesar en esta operación.</p>"
+
+        invoices = [invoice if isinstance(invoice, dict) else invoice.model_dump() for invoice in invoice_data_list]
+        clientes = dict.fromkeys((invoice.get('client_name'), invoice.get('client_ruc')) for invoice in invoices)
+        clientes_html = ', '.join(CLIENT_TEMPLATE.format(nombre, ruc) for nombre, ruc in clientes)
+
+        rows = [
+            TABLE_ROW.format(
+                _cell(invoice.get('debtor_ruc')), _cell(invoice.get('debtor_name')), _cell(invoice.get('document_id')),
+                _cell(_format_amount(invoice, 'total_amount')), _cell(_format_amount(invoice, 'net_amount')),
+                _cell(_format_date(invoice.get('due_date')))
+            )
+            for invoice in invoices
+        ]
+        tabla_html = TABLE_HEADER + ''.join(rows) + TABLE_FOOTER
+
+        return EMAIL_TEMPLATE.format(clientes_html=clientes_html, tabla_html=tabla_html)
@@ -1,153 +1,211 @@
+import asyncio
 import base64
-import json
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import FastAPI, Request
-from google.cloud import pubsub_v1, storage
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from google.cloud import storage
+from googleapiclient.http import MediaIoBaseUpload
+from pydantic import ValidationError
+from shared import codec, instrumentation
+from shared.event_models import GmailCommand
+from shared.google_clients import get_google_service
+from shared.transport import get_transport, start_pull_consumers, stop_pull_consumers
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
-import pandas as pd
+from mime_stream import GcsAttachment, StreamingMimeMessage
+from digest import DigestBuffer
+from html_body import create_html_body
 
 app = FastAPI(title="Gmail Service")
+instrumentation.instrument_app(app, "gmail-service")
 
 # --- Configuración ---
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
-publisher = pubsub_v1.PublisherClient()
+publisher = get_transport()
+COMMAND_TOPIC_NAME = "commands-send-gmail"
+consumers = []
 EVENT_TOPIC_PATH = publisher.topic_path(PROJECT_ID, "events-gmail-sent")
 storage_client = storage.Client()
 CLIENT_SECRETS_JSON = os.getenv("CLIENT_SECRETS_FILE")
 OAUTH_TOKEN_JSON = os.getenv("OAUTH_TOKEN_FILE")
 
+# El mensaje se sube a Gmail como message/rfc822 en trozos de este tamaño
+# (múltiplo de 256 KiB); los adjuntos se leen de GCS a medida que se envían.
+GMAIL_UPLOAD_CHUNK_SIZE = int(os.getenv("GMAIL_UPLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))
+GMAIL_NUM_RETRIES = int(os.getenv("GMAIL_NUM_RETRIES", "3"))
+GCS_METADATA_CONCURRENCY = int(os.getenv("GCS_METADATA_CONCURRENCY", "8"))
+gcs_executor = ThreadPoolExecutor(max_workers=GCS_METADATA_CONCURRENCY, thread_name_prefix="gcs-metadata")
+
+# Modo resumen (opcional): las confirmaciones a un mismo destinatario se
+# acumulan GMAIL_DIGEST_WINDOW segundos y salen en un solo correo. La ventana
+# debe ser menor que el ack deadline de la suscripción (máx. 600 s), porque la
+# petición de Pub/Sub queda abierta hasta que el resumen se envía.
+GMAIL_DIGEST_ENABLED = os.getenv("GMAIL_DIGEST_ENABLED", "false").lower() == "true"
+GMAIL_DIGEST_WINDOW = float(os.getenv("GMAIL_DIGEST_WINDOW", "60"))
+GMAIL_DIGEST_MAX_OPERATIONS = int(os.getenv("GMAIL_DIGEST_MAX_OPERATIONS", "50"))
+GMAIL_DIGEST_SUBJECT = os.getenv("GMAIL_DIGEST_SUBJECT", "Confirmación de facturas negociables ({n} operaciones)")
+# Los resúmenes que caben en este tamaño se envían juntos en batch requests de
+# Gmail (que no admiten subidas de media); los más grandes, uno por uno.
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "20"))
+GMAIL_BATCH_MAX_MESSAGE_BYTES = int(os.getenv("GMAIL_BATCH_MAX_MESSAGE_BYTES", str(1024 * 1024)))
+
+@app.on_event("startup")
+async def on_startup():
+    global consumers
+    consumers = start_pull_consumers([COMMAND_TOPIC_NAME], "gmail-service", process_message, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown_consumers():
+    # Se detienen antes que el resto: los mensajes en curso aún necesitan los clientes y el event loop.
+    await stop_pull_consumers(consumers)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await digest_buffer.flush()
+    gcs_executor.shutdown(wait=True)
+
 def get_gmail_service():
-    client_config = json.loads(CLIENT_SECRETS_JSON).get("installed")
-    token_info = json.loads(OAUTH_TOKEN_JSON)
-    creds = Credentials.from_authorized_user_info(info=token_info, client_config=client_config)
-    return build('gmail', 'v1', credentials=creds)
+    # Un único cliente por proceso; su transporte es seguro entre hilos.
+    return get_google_service('gmail', 'v1', CLIENT_SECRETS_JSON, OAUTH_TOKEN_JSON)
 
 # --- Lógica de Negocio (de gmail_adapter.py) ---
 
-def create_html_body(invoice_data_list: list) -> str:
-        """
-        Crea el cuerpo HTML del correo a partir de una lista de datos de facturas.
-        """
-        if not invoice_data_list:
-            return "<p>No se encontraron datos de facturas válidos para procesar en esta operación.</p>"
-
-        cliente_nombre = invoice_data_list[0].client_name
-        cliente_ruc = invoice_data_list[0].client_ruc
-
-        data_for_df = [invoice.dict() for invoice in invoice_data_list]
-        df = pd.DataFrame(data_for_df)
-
-        df['total_amount'] = df.apply(
-            lambda row: f"{row.get('currency', '')} {float(row.get('total_amount', 0)):,.2f}".strip(),
-            axis=1
-        )
-        df['net_amount'] = df.apply(
-            lambda row: f"{row.get('currency', '')} {float(row.get('net_amount', 0)):,.2f}".strip(),
-            axis=1
-        )
-        df['due_date'] = pd.to_datetime(df['due_date']).dt.strftime('%d/%m/%Y')
-
-        df_display = df.rename(columns={
-            'total_amount': 'Monto Factura',
-            'due_date': 'Fecha de Pago',
-            'debtor_name': 'Empresa Emisora',
-            'debtor_ruc': 'RUC Emisor',
-            'document_id': 'Documento',
-            'net_amount': 'Monto Neto'
-        })
-        
-        display_columns = ['RUC Emisor', 'Empresa Emisora', 'Documento', 'Monto Factura', 'Monto Neto', 'Fecha de Pago']
-        df_html = df_display[display_columns]
-
-        tabla_html = df_html.to_html(index=False, border=0, justify='center', classes='invoices_table')
-
-        mensaje_html = f"""
-        <!DOCTYPE html>
-        <html lang="es">
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Helvetica, Arial, sans-serif; font-size: 14px; color: #333; line-height: 1.6; }}
-                .email-container {{ max-width: 700px; margin: 20px auto; padding: 20px; border: 1px solid #ddd; border-radius: 8px; background-color: #f9f9f9; }}
-                table.invoices_table {{ border-collapse: collapse; width: 100%; margin: 25px 0; }}
-                th, td {{ text-align: left; padding: 12px; border-bottom: 1px solid #eee; }}
-                th {{ background-color: #f2f2f2; font-weight: 600; color: #555; }}
-                .highlight {{ font-weight: 600; color: #0056b3; }}
-                .disclaimer {{ font-style: italic; color: #777; font-size: 11px; margin-top: 30px; border-top: 1px solid #eee; padding-top: 15px; }}
-            </style>
-        </head>
-        <body>
-            <div class="email-container">
-                <p>Estimados señores,</p>
-                <p>
-                    Por medio de la presente, les informamos que los señores de 
-                    <span class="highlight">{cliente_nombre}</span> (RUC: {cliente_ruc}) nos han transferido la(s) siguiente(s)
-                    factura(s) negociable(s). Agradeceríamos su amable confirmación.
-                </p>
-                <h3>Detalle de las facturas:</h3>
-                {tabla_html}
-                <p class="disclaimer"><strong>Cláusula Legal:</strong> Sin perjuicio de lo anteriormente mencionado, nos permitimos recordarles que toda acción tendiente a simular 
-                la emisión de la referida factura negociable para obtener un beneficio, teniendo pleno conocimiento de que la misma no proviene de una relación comercial verdadera, 
-                se encuentra sancionada penalmente como delito de estafa en nuestro ordenamiento jurídico. Asimismo, en caso de que vuestra representada cometa un delito de forma 
-                conjunta con el emitente de la factura, dicha acción podría tipificarse como delito de asociación ilícita para delinquir, según el artículo 317 del Código Penal, 
-                por lo que nos reservamos el derecho de iniciar las acciones penales correspondientes.</p>
-            </div>
-        </body>
-        </html>
-        """
-        return mensaje_html
-
-def send_confirmation_email(gmail_service, recipient: str, subject: str, invoices: list, attachment_paths: list):
-    html_body = create_html_body(invoices)
+@instrumentation.traced("gcs.metadata")
+def _get_attachment(gcs_path: str) -> GcsAttachment:
+    bucket_name, blob_name = gcs_path.replace("gs://", "").split("/", 1)
+    blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"No existe el objeto {gcs_path}")
+    return GcsAttachment(blob)
+
+def build_message_stream(recipient: str, subject: str, html_body: str, attachments: list) -> StreamingMimeMessage:
+    """
+    Renderiza con el paquete email las cabeceras y el cuerpo HTML, dejando en
+    cada adjunto un marcador en lugar del contenido; el stream reemplaza cada
+    marcador por el base64 del objeto de GCS mientras se sube.
+    """
     message = MIMEMultipart()
     message['to'] = recipient
     message['subject'] = subject
     message.attach(MIMEText(html_body, 'html'))
 
-    for gcs_path in attachment_paths:
-        filename = os.path.basename(gcs_path)
-        bucket_name, blob_name = gcs_path.replace("gs://", "").split("/", 1)
-        blob = storage_client.bucket(bucket_name).blob(blob_name)
-        file_content = blob.download_as_bytes()
-        
+    markers = []
+    for attachment in attachments:
+        marker = f"@@adjunto-{uuid.uuid4().hex}@@"
+        markers.append(marker.encode("ascii"))
         part = MIMEBase('application', 'octet-stream')
-        part.set_payload(file_content)
-        encoders.encode_base64(part)
-        part.add_header('Content-Disposition', f"attachment; filename=\"{filename}\"")
+        part.set_payload(marker)
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', f"attachment; filename=\"{attachment.filename}\"")
         message.attach(part)
 
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    gmail_service.users().messages().send(userId='me', body={'raw': raw_message}).execute()
+    parts, rendered = [], message.as_bytes()
+    for marker, attachment in zip(markers, attachments):
+        before, rendered = rendered.split(marker, 1)
+        parts.extend([before, attachment])
+    parts.append(rendered)
+    return StreamingMimeMessage(parts, retain=GMAIL_UPLOAD_CHUNK_SIZE)
+
+def prepare_message(recipient: str, subject: str, invoices: list, attachment_paths: list) -> StreamingMimeMessage:
+    html_body = create_html_body(invoices)
+    # Los metadatos (tamaño) de los adjuntos se consultan en paralelo; el contenido se lee al subir.
+    futures = [gcs_executor.submit(instrumentation.in_context(_get_attachment), path) for path in attachment_paths]
+    attachments = [future.result() for future in futures]
+    return build_message_stream(recipient, subject, html_body, attachments)
+
+@instrumentation.traced("gmail.send")
+def send_message_stream(gmail_service, stream: StreamingMimeMessage):
+    media = MediaIoBaseUpload(stream, mimetype='message/rfc822', chunksize=GMAIL_UPLOAD_CHUNK_SIZE, resumable=True)
+    gmail_service.users().messages().send(userId='me', media_body=media).execute(num_retries=GMAIL_NUM_RETRIES)
+
+def send_confirmation_email(gmail_service, recipient: str, subject: str, invoices: list, attachment_paths: list):
+    send_message_stream(gmail_service, prepare_message(recipient, subject, invoices, attachment_paths))
     print(f"Correo enviado a {recipient}")
 
+def send_digests(digests: list) -> list:
+    """
+    Envía un correo por resumen. Los pequeños van en batch requests de Gmail
+    (hasta GMAIL_BATCH_SIZE por petición HTTP); los que superan
+    GMAIL_BATCH_MAX_MESSAGE_BYTES se suben en streaming uno por uno. Retorna
+    None o la excepción de cada resumen, en orden.
+    """
+    gmail_service = get_gmail_service()
+    errors, inline = [None] * len(digests), []
+    for i, digest in enumerate(digests):
+        try:
+            subject = digest.requests[0].subject if len(digest.requests) == 1 else GMAIL_DIGEST_SUBJECT.format(n=len(digest.requests))
+            stream = prepare_message(digest.recipient, subject, digest.invoices, digest.attachment_paths)
+            if len(stream) <= GMAIL_BATCH_MAX_MESSAGE_BYTES:
+                inline.append((i, base64.urlsafe_b64encode(stream.read()).decode()))
+            else:
+                send_message_stream(gmail_service, stream)
+        except Exception as e:
+            errors[i] = e
+
+    def on_response(request_id, response, exception):
+        errors[int(request_id)] = exception
+
+    for start in range(0, len(inline), GMAIL_BATCH_SIZE):
+        batch = gmail_service.new_batch_http_request(callback=on_response)
+        for i, raw_message in inline[start:start + GMAIL_BATCH_SIZE]:
+            batch.add(gmail_service.users().messages().send(userId='me', body={'raw': raw_message}), request_id=str(i))
+        try:
+            with instrumentation.span("gmail.batch_send", messages=len(inline[start:start + GMAIL_BATCH_SIZE])):
+                batch.execute()
+        except Exception as e:
+            for i, _ in inline[start:start + GMAIL_BATCH_SIZE]:
+                errors[i] = e
+
+    for digest, error in zip(digests, errors):
+        if error is None:
+            print(f"Resumen enviado a {digest.recipient} ({len(digest.requests)} operación(es))")
+    return errors
+
+digest_buffer = DigestBuffer(send_digests, window=GMAIL_DIGEST_WINDOW, max_operations=GMAIL_DIGEST_MAX_OPERATIONS)
+
 @app.post("/", status_code=204)
 async def handle_pubsub_message(request: Request):
     envelope = await request.json()
     message = envelope.get("message")
     if not message: return ""
+    return await process_message(message)
 
-    command = json.loads(base64.b64decode(message["data"]).decode("utf-8"))
-    op_id = command.get("operation_id")
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
+    try:
+        command = codec.decode_push_message(GmailCommand, message)
+    except ValidationError as e:
+        print(f"[Gmail Service] Comando inválido descartado: {e}")
+        error_event = codec.invalid_command_event(message, e)
+        if error_event is not None:
+            await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, error_event))
+        return ""
+    op_id = command.operation_id
     # El orquestador debe enviar todos estos datos
-    recipient = command.get("recipient_email")
-    subject = command.get("email_subject")
-    invoices_data = command.get("invoices_data", [])
-    attachment_paths = command.get("attachment_paths", [])
+    recipient = command.recipient_email
+    subject = command.email_subject
+    invoices_data = [invoice.model_dump(exclude_unset=True) for invoice in command.invoices_data]
+    attachment_paths = command.attachment_paths
 
     result_event = {"operation_id": op_id}
     print(f"[Gmail Service] Comando recibido para op: {op_id}")
     try:
-        service = get_gmail_service()
-        send_confirmation_email(service, recipient, subject, invoices_data, attachment_paths)
-        result_event.update({"status": "SUCCESS", "sent_to": recipient})
+        if GMAIL_DIGEST_ENABLED:
+            # Cada operación publica su propio evento cuando sale el resumen que la incluye.
+            digest_size = await digest_buffer.submit(recipient, op_id, subject, invoices_data, attachment_paths)
+            result_event.update({"status": "SUCCESS", "sent_to": recipient, "digest_operations": digest_size})
+        else:
+            service = get_gmail_service()
+            # El envío es bloqueante; se ejecuta fuera del event loop.
+            await asyncio.get_running_loop().run_in_executor(
+                None, instrumentation.in_context(send_confirmation_email), service, recipient, subject, invoices_data, attachment_paths
+            )
+            result_event.update({"status": "SUCCESS", "sent_to": recipient})
     except Exception as e:
         print(f"[Gmail Service] ERROR para op {op_id}: {e}")
         result_event.update({"status": "ERROR", "error_message": str(e)})
 
-    publisher.publish(EVENT_TOPIC_PATH, json.dumps(result_event).encode("utf-8"))
+    await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, result_event))
     return ""
\ No newline at end of file
@@ -0,0 +1,93 @@
+import base64
+import io
+from typing import Iterator, List
+
+# Lectura desde GCS en múltiplos de 57 bytes: cada trozo se codifica en líneas
+# completas de base64 (76 caracteres + salto de línea), como email.encoders.
+BASE64_LINE_BYTES = 57
+READ_CHUNK_SIZE = BASE64_LINE_BYTES * 4096
+
+def encoded_length(raw_size: int) -> int:
+    """Tamaño de base64.encodebytes() para `raw_size` bytes."""
+    encoded = 4 * ((raw_size + 2) // 3)
+    return encoded + (encoded + 75) // 76
+
+class GcsAttachment:
+    """Adjunto en GCS: se lee por trozos y se codifica en base64 MIME al vuelo."""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self.filename = blob.name.rsplit("/", 1)[-1]
+        self.encoded_size = encoded_length(blob.size)
+
+    def iter_encoded(self) -> Iterator[bytes]:
+        pending = b""
+        with self.blob.open("rb", chunk_size=READ_CHUNK_SIZE) as reader:
+            while True:
+                chunk = reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                pending += chunk
+                usable = len(pending) - len(pending) % BASE64_LINE_BYTES
+                if usable:
+                    yield base64.encodebytes(pending[:usable])
+                    pending = pending[usable:]
+        if pending:
+            yield base64.encodebytes(pending)
+
+class StreamingMimeMessage:
+    """
+    Mensaje MIME (message/rfc822) generado mientras se sube a Gmail.
+
+    `parts` alterna bytes ya renderizados (cabeceras, cuerpo HTML, límites
+    multipart) con GcsAttachment, cuyo contenido se codifica a medida que se
+    lee. El tamaño total se conoce de antemano, así que MediaIoBaseUpload puede
+    pedirlo con seek(0, SEEK_END). Solo se conservan los últimos `retain`
+    bytes, para que la subida resumable pueda volver a enviar el último trozo.
+    """
+
+    def __init__(self, parts: List, retain: int):
+        self._parts = parts
+        self._length = sum(len(p) if isinstance(p, bytes) else p.encoded_size for p in parts)
+        self._chunks = self._iter_chunks()
+        self._retain = retain
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._position = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _iter_chunks(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from part.iter_encoded()
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            target = offset
+        elif whence == io.SEEK_CUR:
+            target = self._position + offset
+        else:
+            target = self._length + offset
+        if target < self._buffer_start:
+            raise io.UnsupportedOperation(f"No se puede volver al byte {target}: ya se descartó del stream.")
+        self._position = target
+        return target
+
+    def read(self, size: int = -1) -> bytes:
+        end = self._length if size is None or size < 0 else min(self._position + size, self._length)
+        while self._buffer_start + len(self._buffer) < end:
+            self._buffer += next(self._chunks)
+        data = bytes(self._buffer[self._position - self._buffer_start:end - self._buffer_start])
+        self._position = max(self._position, end)
+        discard = self._position - self._retain - self._buffer_start
+        if discard > 0:
+            del self._buffer[:discard]
+            self._buffer_start += discard
+        return data
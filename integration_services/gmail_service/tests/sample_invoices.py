@@ -0,0 +1,17 @@
+"""Facturas de ejemplo para las pruebas y el benchmark del cuerpo del correo."""
+from shared.event_models import InvoiceData
+
+
+def invoice(i: int, **overrides) -> InvoiceData:
+    fields = dict(
+        document_id=f"E001-{i}", issue_date="2024-05-01", due_date=f"2024-06-{i % 28 + 1:02d}",
+        currency="PEN", total_amount=1234.5 * i, net_amount=1200 * i + 0.005,
+        debtor_name=f"Deudor {i} S.A.C.", debtor_ruc=f"20{i:09d}",
+        client_name="Cliente S.A.", client_ruc="20100000001",
+    )
+    fields.update(overrides)
+    return InvoiceData(**fields)
+
+
+def build_invoices(n: int) -> list:
+    return [invoice(i) for i in range(1, n + 1)]
@@ -0,0 +1,41 @@
+import pytest
+
+from html_body import create_html_body
+from sample_invoices import invoice
+
+pytest.importorskip("pandas")
+pytestmark = pytest.mark.filterwarnings("ignore:The `dict` method is deprecated")
+import pandas_html_body  # noqa: E402
+
+
+CASES = {
+    "una_factura": [invoice(1)],
+    "cincuenta_facturas": [invoice(i) for i in range(50)],
+    "escapes_html": [invoice(1, debtor_name="Pérez & Hijos <S.A.>", document_id="F001-\"7\"")],
+    "espacios": [invoice(1, debtor_name="  Deudor con espacios  ", currency="")],
+    "montos_grandes": [invoice(1, total_amount=1234567890.125, net_amount=0.0, currency="USD")],
+    "sin_moneda": [invoice(1, currency=None)],
+    "sin_fecha": [invoice(1, due_date=None), invoice(2, due_date=None)],
+    "fecha_parcial": [invoice(1), invoice(2, due_date=None)],
+    "campos_vacios": [invoice(1, debtor_name=None, debtor_ruc=None, document_id=None)],
+    "nombre_largo": [invoice(1, debtor_name="Deudor " * 40)],
+    "fecha_con_hora": [invoice(1, due_date="2024-06-30T18:45:00")],
+}
+
+
+@pytest.mark.parametrize("invoices", CASES.values(), ids=CASES.keys())
+def test_matches_pandas_output_byte_for_byte(invoices):
+    expected = pandas_html_body.create_html_body(invoices)
+    assert create_html_body(invoices).encode() == expected.encode()
+    assert create_html_body([i.model_dump() for i in invoices]) == expected
+
+
+def test_empty_list():
+    assert create_html_body([]) == pandas_html_body.create_html_body([])
+
+
+def test_digest_names_every_client():
+    # Único cambio intencional: el renderizador anterior solo nombraba al primer cliente.
+    invoices = [invoice(1), invoice(2, client_name="Otro Cliente", client_ruc="20200000002")]
+    html = create_html_body(invoices)
+    assert 'Cliente S.A.</span> (RUC: 20100000001), <span class="highlight">Otro Cliente</span> (RUC: 20200000002)' in html
@@ -0,0 +1,78 @@
+"""
+Benchmark del cuerpo HTML del correo: plantillas (html_body) frente al
+renderizador anterior con pandas (pandas_html_body), con 1, 50 y 1000 facturas:
+
+    pytest integration_services/gmail_service/tests/test_gmail_render_benchmark.py --benchmark-only
+
+La columna Mean del reporte es el tiempo de render. Cada caso agrega a
+extra_info, medidos en un proceso nuevo: `import_ms` e `import_rss_kib` (lo que
+cuesta importar el renderizador, pandas incluido) y `render_peak_kib` (cuánto
+crece la memoria residente al renderizar). Se ven con --benchmark-json=<archivo>.
+"""
+import functools
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from sample_invoices import build_invoices
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("pandas")
+pytestmark = pytest.mark.filterwarnings("ignore:The `dict` method is deprecated")
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(TESTS_DIR)
+REPO_DIR = os.path.dirname(os.path.dirname(SERVICE_DIR))
+
+RENDERERS = {"plantilla": "html_body", "pandas": "pandas_html_body"}
+SIZES = [1, 50, 1000]
+
+
+# pydantic ya está cargado en el servicio, así que se importa antes de medir;
+# lo que se mide es solo el módulo del renderizador y lo que arrastra.
+MEASURE_SCRIPT = """
+import importlib, json, sys, time, warnings
+warnings.simplefilter("ignore")
+from sample_invoices import build_invoices
+
+def status(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+module_name, n = sys.argv[1], int(sys.argv[2])
+invoices = build_invoices(n)
+rss_before, start = status("VmRSS"), time.perf_counter()
+module = importlib.import_module(module_name)
+import_ms, import_rss = (time.perf_counter() - start) * 1000, status("VmRSS") - rss_before
+
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+before = status("VmRSS")
+module.create_html_body(invoices)
+print(json.dumps({"import_ms": round(import_ms, 1), "import_rss_kib": import_rss,
+                  "render_peak_kib": status("VmHWM") - before}))
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def measure(module_name: str, n: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([TESTS_DIR, SERVICE_DIR, REPO_DIR]))
+    result = subprocess.run([sys.executable, "-c", MEASURE_SCRIPT, module_name, str(n)],
+                            capture_output=True, text=True, cwd=TESTS_DIR, env=env, check=True)
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize("n", SIZES)
+@pytest.mark.parametrize("renderer", list(RENDERERS))
+def test_gmail_render_benchmark(benchmark, renderer, n):
+    module_name = RENDERERS[renderer]
+    create_html_body = __import__(module_name).create_html_body
+    invoices = build_invoices(n)
+
+    html = benchmark(create_html_body, invoices)
+
+    assert html.count("<tr>") == n
+    benchmark.extra_info.update(measure(module_name, n))
@@ -1,52 +1,195 @@
-import base64
-import json
+import asyncio
+import hashlib
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List
 from fastapi import FastAPI, Request, HTTPException
-from google.cloud import pubsub_v1, storage
-from parser import extract_invoice_data
+from pydantic import ValidationError
+from google.cloud import storage
+from parser import PARSER_VERSION, extract_invoice_data, try_extract_invoice_data
+from parse_cache import ParseCache
+from shared import codec, instrumentation
+from shared.event_models import ParseCommand
+from shared.transport import get_transport, start_pull_consumers, stop_pull_consumers
 
 app = FastAPI(title="Parser Service")
+instrumentation.instrument_app(app, "parser-service")
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
+COMMAND_TOPIC_NAME = "commands-parse-xml"
 RESULT_TOPIC_NAME = "events-invoices-parsed"
-publisher = pubsub_v1.PublisherClient()
+publisher = get_transport()
 topic_path = publisher.topic_path(PROJECT_ID, RESULT_TOPIC_NAME)
 storage_client = storage.Client()
 
-def read_xml_from_gcs(gcs_path):
+# Modo batch: las descargas de GCS corren en hilos y el parseo (CPU) en un pool de procesos.
+DOWNLOAD_CONCURRENCY = int(os.getenv("PARSER_DOWNLOAD_CONCURRENCY", "16"))
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", str(os.cpu_count() or 1)))
+download_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY, thread_name_prefix="gcs-download")
+parse_pool = None
+consumers = []
+
+# Caché de resultados por contenido (SHA-256 de los bytes o md5 de GCS).
+parse_cache = ParseCache(
+    PARSER_VERSION,
+    max_entries=int(os.getenv("PARSE_CACHE_MAX_ENTRIES", "1024")),
+    sqlite_path=os.getenv("PARSE_CACHE_SQLITE_PATH") or None
+)
+
+@app.on_event("startup")
+async def on_startup():
+    global parse_pool, consumers
+    # "spawn" evita heredar por fork los hilos de gRPC de los clientes de Google.
+    parse_pool = ProcessPoolExecutor(max_workers=PARSER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    consumers = start_pull_consumers([COMMAND_TOPIC_NAME], "parser-service", process_message, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown_consumers():
+    # Se detienen antes que el resto: los mensajes en curso aún necesitan los clientes y el event loop.
+    await stop_pull_consumers(consumers)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if parse_pool is not None:
+        parse_pool.shutdown(wait=True)
+    download_executor.shutdown(wait=True)
+
+@instrumentation.traced("gcs.download")
+def load_xml_or_cached(gcs_path):
+    """
+    Consulta primero el md5 que GCS guarda del objeto (solo metadatos): si ya
+    se parseó ese contenido, no se descarga. Si no, descarga y busca por
+    SHA-256. Retorna (invoice_data_cacheado, None, claves) o (None, xml_bytes, claves).
+    """
     parts = gcs_path.replace("gs://", "").split("/", 1)
-    bucket = storage_client.bucket(parts[0])
-    blob = bucket.blob(parts[1])
-    return blob.download_as_bytes()
+    blob = storage_client.bucket(parts[0]).get_blob(parts[1])
+    if blob is None:
+        raise FileNotFoundError(f"No existe el objeto {gcs_path}")
+
+    md5_key = f"md5:{blob.md5_hash}" if blob.md5_hash else None
+    if md5_key:
+        # Si falla, el SHA-256 de abajo registra el único fallo de este XML.
+        cached = parse_cache.get(md5_key, count_miss=False)
+        if cached is not None:
+            return cached, None, [md5_key]
+
+    # Se fija la generación leída para que el md5 corresponda a los bytes descargados.
+    xml_bytes = blob.download_as_bytes(if_generation_match=blob.generation)
+    keys = [f"sha256:{hashlib.sha256(xml_bytes).hexdigest()}", md5_key]
+    cached = parse_cache.get(keys[0])
+    if cached is not None:
+        parse_cache.put(keys, cached)
+        return cached, None, keys
+    return None, xml_bytes, keys
+
+def parse_xml_with_cache(gcs_path) -> dict:
+    cached, xml_bytes, keys = load_xml_or_cached(gcs_path)
+    if cached is not None:
+        print(f"[Parser Service] Resultado en caché para {gcs_path}")
+        return cached
+    with instrumentation.span("parse"):
+        invoice_data = extract_invoice_data(xml_bytes)
+    parse_cache.put(keys, invoice_data)
+    return invoice_data
+
+async def parse_xml_batch(xml_paths: List[str]) -> List[dict]:
+    """
+    Descarga todos los XML en paralelo y parsea en el pool de procesos los que
+    no estén en la caché. Retorna una entrada por archivo, en el mismo orden,
+    con su resultado o error.
+    """
+    loop = asyncio.get_running_loop()
+    downloads = await asyncio.gather(
+        *(loop.run_in_executor(download_executor, instrumentation.in_context(load_xml_or_cached), path) for path in xml_paths),
+        return_exceptions=True
+    )
+
+    async def parse_one(path, download):
+        if isinstance(download, BaseException):
+            return {"xml_file_path": path, "status": "ERROR", "error_message": f"Error descargando: {download}"}
+        cached, xml_bytes, keys = download
+        if cached is not None:
+            return {"xml_file_path": path, "status": "SUCCESS", "invoice_data": cached}
+        with instrumentation.span("parse"):
+            result = await loop.run_in_executor(parse_pool, try_extract_invoice_data, xml_bytes)
+        if result["status"] == "SUCCESS":
+            parse_cache.put(keys, result["invoice_data"])
+        return {"xml_file_path": path, **result}
+
+    return await asyncio.gather(*(parse_one(path, download) for path, download in zip(xml_paths, downloads)))
+
+def build_batch_result_event(op_id: str, file_results: List[dict]) -> dict:
+    parsed = [r["invoice_data"] for r in file_results if r["status"] == "SUCCESS"]
+    errors = [r for r in file_results if r["status"] == "ERROR"]
+    if not parsed:
+        status = "ERROR"
+    elif errors:
+        status = "PARTIAL"
+    else:
+        status = "SUCCESS"
+    result_event = {
+        "operation_id": op_id, "status": status,
+        "parsed_invoice_data": parsed,
+        "file_results": file_results
+    }
+    if errors:
+        result_event["error_message"] = "; ".join(f"{r['xml_file_path']}: {r['error_message']}" for r in errors)
+    return result_event
 
 @app.post("/", status_code=204)
 async def handle_pubsub_message(request: Request):
     envelope = await request.json()
     message = envelope.get("message")
     if not message: raise HTTPException(status_code=400, detail="Payload inválido")
+    return await process_message(message)
 
-    command = json.loads(base64.b64decode(message["data"]).decode("utf-8"))
-    op_id = command.get("operation_id")
-    xml_path = command.get("xml_file_path")
-    
-    if not op_id or not xml_path: return ""
-        
-    print(f"[Parser Service] Procesando op {op_id} desde {xml_path}")
-
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
     try:
-        xml_bytes = read_xml_from_gcs(xml_path)
-        invoice_data = extract_invoice_data(xml_bytes)
-        result_event = {
-            "operation_id": op_id, "status": "SUCCESS",
-            "parsed_invoice_data": invoice_data
-        }
-    except Exception as e:
-        print(f"[Parser Service] ERROR en {op_id}: {e}")
-        result_event = {
-            "operation_id": op_id, "status": "ERROR",
-            "error_message": str(e)
-        }
-
-    future = publisher.publish(topic_path, json.dumps(result_event).encode("utf-8"))
-    future.result()
+        command = codec.decode_push_message(ParseCommand, message)
+    except ValidationError as e:
+        print(f"[Parser Service] Comando inválido descartado: {e}")
+        error_event = codec.invalid_command_event(message, e)
+        if error_event is not None:
+            await asyncio.wrap_future(codec.publish(publisher, topic_path, error_event))
+        return ""
+    op_id = command.operation_id
+    xml_paths = command.xml_file_paths
+    xml_path = command.xml_file_path
+
+    if not op_id or not (xml_paths or xml_path): return ""
+
+    if xml_paths:
+        # Modo batch (ParseCommand.xml_file_paths): un único evento con el resultado de cada archivo.
+        print(f"[Parser Service] Procesando op {op_id}: {len(xml_paths)} XML en modo batch")
+        try:
+            result_event = build_batch_result_event(op_id, await parse_xml_batch(xml_paths))
+        except Exception as e:
+            print(f"[Parser Service] ERROR en {op_id}: {e}")
+            result_event = {
+                "operation_id": op_id, "status": "ERROR",
+                "error_message": str(e)
+            }
+    else:
+        print(f"[Parser Service] Procesando op {op_id} desde {xml_path}")
+        try:
+            invoice_data = parse_xml_with_cache(xml_path)
+            result_event = {
+                "operation_id": op_id, "status": "SUCCESS",
+                "parsed_invoice_data": invoice_data
+            }
+        except Exception as e:
+            print(f"[Parser Service] ERROR en {op_id}: {e}")
+            result_event = {
+                "operation_id": op_id, "status": "ERROR",
+                "error_message": str(e)
+            }
+
+    # Se espera la confirmación sin bloquear el event loop.
+    await asyncio.wrap_future(codec.publish(publisher, topic_path, result_event))
     print(f"[Parser Service] Resultado publicado para op: {op_id}")
-    return ""
\ No newline at end of file
+    return ""
+
+@app.get("/cache/stats")
+def cache_stats():
+    return parse_cache.stats()
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+class ParseCache:
+    """
+    Caché de resultados de extract_invoice_data direccionada por contenido.
+
+    Las claves son el SHA-256 de los bytes del XML o el md5 que GCS guarda del
+    objeto (lo que permite saltarse la descarga). Tiene un nivel LRU en memoria
+    y, opcionalmente, un nivel persistente en un archivo SQLite. Todas las
+    claves llevan la versión del parser, así que un cambio en la lógica de
+    extracción invalida lo anterior.
+    """
+
+    def __init__(self, version: str, max_entries: int = 1024, sqlite_path: Optional[str] = None):
+        self.version = version
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS parse_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # Descarta resultados de versiones anteriores del parser.
+            self._db.execute("DELETE FROM parse_cache WHERE key NOT LIKE ?", (f"{self._prefix()}%",))
+            self._db.commit()
+
+    def _prefix(self) -> str:
+        return f"v{self.version}:"
+
+    def get(self, key: str, count_miss: bool = True) -> Optional[dict]:
+        """
+        `count_miss=False` para una consulta a la que seguirá otra con una
+        clave distinta del mismo contenido: así un XML cuenta un solo fallo.
+        """
+        versioned_key = self._prefix() + key
+        with self._lock:
+            value = self._memory.get(versioned_key)
+            if value is not None:
+                self._memory.move_to_end(versioned_key)
+                self._counters["memory_hits"] += 1
+                return dict(value)
+            if self._db is not None:
+                row = self._db.execute("SELECT value FROM parse_cache WHERE key = ?", (versioned_key,)).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(versioned_key, value)
+                    self._counters["persistent_hits"] += 1
+                    return dict(value)
+            if count_miss:
+                self._counters["misses"] += 1
+            return None
+
+    def put(self, keys: Iterable[str], value: dict):
+        versioned_keys = [self._prefix() + key for key in keys if key]
+        with self._lock:
+            for versioned_key in versioned_keys:
+                self._remember(versioned_key, dict(value))
+            if self._db is not None and versioned_keys:
+                encoded = json.dumps(value)
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO parse_cache (key, value) VALUES (?, ?)",
+                    [(versioned_key, encoded) for versioned_key in versioned_keys]
+                )
+                self._db.commit()
+
+    def _remember(self, versioned_key: str, value: dict):
+        self._memory[versioned_key] = value
+        self._memory.move_to_end(versioned_key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        stats["parser_version"] = self.version
+        stats["persistent"] = self._db is not None
+        return stats
@@ -1,36 +1,124 @@
 from lxml import etree
 from datetime import datetime, timedelta
 
+# Versión de la lógica de extracción: se usa para invalidar la caché de
+# resultados (parse_cache) cada vez que cambia lo que devuelve el parser.
+PARSER_VERSION = "2"
+
+NS = {
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2'
+}
+CBC = '{%s}' % NS['cbc']
+CAC = '{%s}' % NS['cac']
+
+def _xpath(expression: str) -> etree.XPath:
+    return etree.XPath(expression, namespaces=NS, smart_strings=False)
+
+# En UBL 2.1 todos los datos que se extraen cuelgan de hijos directos del
+# documento. Se recorren esos hijos una sola vez y las búsquedas siguientes
+# se hacen solo dentro del subárbol que corresponde, no en todo el XML (las
+# InvoiceLine pueden ser miles de nodos).
+TOP_LEVEL_TAGS = {
+    CBC + 'ID', CBC + 'IssueDate', CAC + 'PaymentTerms', CAC + 'LegalMonetaryTotal',
+    CAC + 'AccountingSupplierParty', CAC + 'AccountingCustomerParty'
+}
+
+# XPath precompiladas, evaluadas dentro de cada AccountingParty.
+PARTY_NAME_XPATH = _xpath('.//cac:PartyLegalEntity/cbc:RegistrationName')
+PARTY_ID_XPATH = _xpath('.//cac:PartyIdentification/cbc:ID')
+
+# Respaldo para documentos que no siguen la estructura UBL estándar: las
+# mismas búsquedas de descendientes que antes, pero precompiladas.
+DESCENDANT_XPATHS = {
+    CBC + 'IssueDate': _xpath('.//cbc:IssueDate'),
+    CAC + 'PaymentTerms': _xpath('.//cac:PaymentTerms'),
+    CAC + 'LegalMonetaryTotal': _xpath('.//cac:LegalMonetaryTotal'),
+    CAC + 'AccountingSupplierParty': _xpath('.//cac:AccountingSupplierParty'),
+    CAC + 'AccountingCustomerParty': _xpath('.//cac:AccountingCustomerParty'),
+}
+
+def _parse_document(xml_content_bytes: bytes):
+    """
+    libxml2 detecta el encoding a partir del BOM o de la declaración XML, así
+    que los bytes se parsean directamente, sin decodificar ni recodificar.
+    Sin declaración se asume UTF-8; si falla se reintenta como ISO-8859-1.
+    """
+    try:
+        return etree.fromstring(xml_content_bytes)
+    except etree.XMLSyntaxError:
+        return etree.fromstring(xml_content_bytes, etree.XMLParser(encoding='iso-8859-1'))
+
+def _text(element, default=None):
+    return element.text.strip() if element is not None and element.text is not None else default
+
+def _first_child(element, tag):
+    for child in element.iterchildren(tag):
+        return child
+    return None
+
+def _first_match(elements, xpath):
+    for element in elements:
+        matches = xpath(element)
+        if matches:
+            return matches[0]
+    return None
+
 def extract_invoice_data(xml_content_bytes: bytes) -> dict:
     """
     Toma el contenido de un archivo XML en bytes, lo parsea y devuelve
     un diccionario con los datos extraídos de la factura.
-    
+
     Esta función es una adaptación de tu método _parse_xml_files.
-   
+
     """
-    try:
-        xml_content = xml_content_bytes.decode('iso-8859-1')
-        root = etree.fromstring(xml_content.encode('utf-8'))
-    except Exception:
-        xml_content = xml_content_bytes.decode('utf-8').lstrip('\ufeff')
-        root = etree.fromstring(xml_content.encode('utf-8'))
-
-    ns = {
-        'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
-        'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2'
-    }
+    root = _parse_document(xml_content_bytes)
+
+    top_level = {}
+    for child in root.iterchildren(*TOP_LEVEL_TAGS):
+        top_level.setdefault(child.tag, []).append(child)
+
+    def elements(tag):
+        return top_level.get(tag) or DESCENDANT_XPATHS[tag](root)
+
+    # PaymentTerms: forma de pago, vencimiento y detracción en una sola pasada.
+    payment_form_element = due_date_element = detraction_element = None
+    for terms in elements(CAC + 'PaymentTerms'):
+        terms_ids = set()
+        means_id = due = percent = None
+        for child in terms.iterchildren(CBC + 'ID', CBC + 'PaymentMeansID', CBC + 'PaymentDueDate', CBC + 'PaymentPercent'):
+            if child.tag == CBC + 'ID':
+                terms_ids.add(child.text)
+            elif child.tag == CBC + 'PaymentMeansID':
+                means_id = child if means_id is None else means_id
+            elif child.tag == CBC + 'PaymentDueDate':
+                due = child if due is None else due
+            else:
+                percent = child if percent is None else percent
+        if payment_form_element is None and means_id is not None and 'FormaPago' in terms_ids:
+            payment_form_element = means_id
+        if due_date_element is None and due is not None:
+            due_date_element = due
+        if detraction_element is None and percent is not None and 'Detraccion' in terms_ids:
+            detraction_element = percent
+
+    payable_element = None
+    for monetary_total in elements(CAC + 'LegalMonetaryTotal'):
+        payable_element = _first_child(monetary_total, CBC + 'PayableAmount')
+        if payable_element is not None:
+            break
 
-    def find_text(xpath, default=None):
-        element = root.find(xpath, ns)
-        return element.text.strip() if element is not None and element.text is not None else default
+    issue_dates = elements(CBC + 'IssueDate')
+    document_ids = top_level.get(CBC + 'ID')
+    customer_parties = elements(CAC + 'AccountingCustomerParty')
+    supplier_parties = elements(CAC + 'AccountingSupplierParty')
 
     # Extracción de datos
-    issue_date_str = find_text('.//cbc:IssueDate')
-    total_amount = float(find_text('.//cac:LegalMonetaryTotal/cbc:PayableAmount', '0'))
-    payment_form = find_text(".//cac:PaymentTerms[cbc:ID='FormaPago']/cbc:PaymentMeansID")
-    due_date_str = find_text('.//cac:PaymentTerms/cbc:PaymentDueDate')
-    
+    issue_date_str = _text(issue_dates[0] if issue_dates else None)
+    total_amount = float(_text(payable_element, '0'))
+    payment_form = _text(payment_form_element)
+    due_date_str = _text(due_date_element)
+
     # Lógica de fechas
     issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d') if issue_date_str else None
     due_date = None
@@ -44,22 +132,32 @@ def extract_invoice_data(xml_content_bytes: bytes) -> dict:
     issue_date_iso = issue_date.isoformat() if issue_date else None
     due_date_iso = due_date.isoformat() if due_date else None
 
-    currency_element = root.find('.//cac:LegalMonetaryTotal/cbc:PayableAmount', ns)
-    currency = currency_element.get('currencyID', 'N/A') if currency_element is not None else 'N/A'
-    detraction_amount = float(find_text(".//cac:PaymentTerms[cbc:ID='Detraccion']/cbc:PaymentPercent", '0'))
+    currency = payable_element.get('currencyID', 'N/A') if payable_element is not None else 'N/A'
+    detraction_amount = float(_text(detraction_element, '0'))
     net_amount = total_amount * (100 - detraction_amount) / 100
 
     invoice_data = {
-        "document_id": find_text('./cbc:ID'),
+        "document_id": _text(document_ids[0] if document_ids else None),
         "issue_date": issue_date_iso,
         "due_date": due_date_iso,
         "currency": currency,
         "total_amount": total_amount,
         "net_amount": net_amount,
-        "debtor_name": find_text('.//cac:AccountingCustomerParty//cac:PartyLegalEntity/cbc:RegistrationName'),
-        "debtor_ruc": find_text('.//cac:AccountingCustomerParty//cac:PartyIdentification/cbc:ID'),
-        "client_name": find_text('.//cac:AccountingSupplierParty//cac:PartyLegalEntity/cbc:RegistrationName'),
-        "client_ruc": find_text('.//cac:AccountingSupplierParty//cac:PartyIdentification/cbc:ID')
+        "debtor_name": _text(_first_match(customer_parties, PARTY_NAME_XPATH)),
+        "debtor_ruc": _text(_first_match(customer_parties, PARTY_ID_XPATH)),
+        "client_name": _text(_first_match(supplier_parties, PARTY_NAME_XPATH)),
+        "client_ruc": _text(_first_match(supplier_parties, PARTY_ID_XPATH))
     }
-    
-    return invoice_data
\ No newline at end of file
+
+    return invoice_data
+
+def try_extract_invoice_data(xml_content_bytes: bytes) -> dict:
+    """
+    Variante de extract_invoice_data para el pool de procesos del modo batch:
+    nunca lanza excepción (las de lxml no siempre se pueden serializar entre
+    procesos) y devuelve el error como texto.
+    """
+    try:
+        return {"status": "SUCCESS", "invoice_data": extract_invoice_data(xml_content_bytes)}
+    except Exception as e:
+        return {"status": "ERROR", "error_message": f"{type(e).__name__}: {e}"}
@@ -0,0 +1,13 @@
+from parse_cache import ParseCache
+
+
+def test_md5_miss_followed_by_sha256_counts_one_miss():
+    cache = ParseCache(version="test")
+    assert cache.get("md5:abc", count_miss=False) is None
+    assert cache.get("sha256:def") is None
+    assert cache.stats()["misses"] == 1
+
+    cache.put(["sha256:def", "md5:abc"], {"document_id": "F001-1"})
+    assert cache.get("md5:abc", count_miss=False) == {"document_id": "F001-1"}
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,107 @@
+"""
+Benchmark de extract_invoice_data (pytest-benchmark):
+
+    pytest integration_services/parser_service/tests/test_parser_benchmark.py --benchmark-only
+
+La columna OPS del reporte son los parseos por segundo. Cada caso agrega a
+extra_info `parses_per_sec` y `peak_memory_kib` (cuánto crece la memoria
+residente del proceso al parsear), que se ven con --benchmark-json=<archivo>.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from parser import extract_invoice_data
+
+pytest.importorskip("pytest_benchmark")
+
+INVOICE_TEMPLATE = """<?xml version="1.0" encoding="{encoding}"?>
+<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+         xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+         xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ID>F001-00000042</cbc:ID>
+  <cbc:IssueDate>2024-05-10</cbc:IssueDate>
+  <cac:AccountingSupplierParty><cac:Party>
+    <cac:PartyIdentification><cbc:ID>20100000001</cbc:ID></cac:PartyIdentification>
+    <cac:PartyLegalEntity><cbc:RegistrationName>{client_name}</cbc:RegistrationName></cac:PartyLegalEntity>
+  </cac:Party></cac:AccountingSupplierParty>
+  <cac:AccountingCustomerParty><cac:Party>
+    <cac:PartyIdentification><cbc:ID>20600000002</cbc:ID></cac:PartyIdentification>
+    <cac:PartyLegalEntity><cbc:RegistrationName>Deudor S.A.C.</cbc:RegistrationName></cac:PartyLegalEntity>
+  </cac:Party></cac:AccountingCustomerParty>
+  <cac:PaymentTerms><cbc:ID>FormaPago</cbc:ID><cbc:PaymentMeansID>Credito</cbc:PaymentMeansID></cac:PaymentTerms>
+  <cac:PaymentTerms><cbc:ID>FormaPago</cbc:ID><cbc:PaymentMeansID>Cuota001</cbc:PaymentMeansID>
+    <cbc:PaymentDueDate>2024-07-09</cbc:PaymentDueDate></cac:PaymentTerms>
+  <cac:PaymentTerms><cbc:ID>Detraccion</cbc:ID><cbc:PaymentPercent>12</cbc:PaymentPercent></cac:PaymentTerms>
+  <cac:LegalMonetaryTotal><cbc:PayableAmount currencyID="PEN">{total}</cbc:PayableAmount></cac:LegalMonetaryTotal>
+{lines}</Invoice>
+"""
+
+INVOICE_LINE = """  <cac:InvoiceLine>
+    <cbc:ID>{index}</cbc:ID>
+    <cbc:InvoicedQuantity unitCode="NIU">1</cbc:InvoicedQuantity>
+    <cbc:LineExtensionAmount currencyID="PEN">10.00</cbc:LineExtensionAmount>
+    <cac:Item><cbc:Description>Servicio de mantenimiento {index}</cbc:Description></cac:Item>
+    <cac:Price><cbc:PriceAmount currencyID="PEN">10.00</cbc:PriceAmount></cac:Price>
+  </cac:InvoiceLine>
+"""
+
+
+def build_invoice(lines: int = 1, encoding: str = "UTF-8", client_name: str = "Cliente S.A.C.") -> bytes:
+    body = "".join(INVOICE_LINE.format(index=i) for i in range(1, lines + 1))
+    xml = INVOICE_TEMPLATE.format(encoding=encoding, client_name=client_name, total=f"{lines * 10:.2f}", lines=body)
+    return xml.encode(encoding)
+
+
+CASES = {
+    "small": build_invoice(lines=1),
+    "large": build_invoice(lines=5000),
+    "utf8_bom": b"\xef\xbb\xbf" + build_invoice(lines=1, client_name="Compañía Andina S.A.C."),
+    "latin1": build_invoice(lines=1, encoding="ISO-8859-1", client_name="Compañía Andina S.A.C."),
+}
+
+
+# libxml2 reserva su memoria fuera del allocator de Python (tracemalloc no la
+# ve), así que el pico se mide en un proceso nuevo que ya tiene cargados lxml
+# y el XML: se reinicia el pico de memoria residente (VmHWM, Linux) y se
+# compara con el que queda tras parsear.
+PEAK_MEMORY_SCRIPT = """
+import sys
+from parser import extract_invoice_data
+
+def status(field):
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field))
+
+xml_bytes = sys.stdin.buffer.read()
+with open("/proc/self/clear_refs", "w") as f:
+    f.write("5")
+before = status("VmRSS")
+extract_invoice_data(xml_bytes)
+print(status("VmHWM") - before)
+"""
+
+
+def peak_memory_kib(xml_bytes: bytes) -> int:
+    result = subprocess.run([sys.executable, "-c", PEAK_MEMORY_SCRIPT], input=xml_bytes, capture_output=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+    return int(result.stdout)
+
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_parser_benchmark(benchmark, case):
+    xml_bytes = CASES[case]
+    result = benchmark(extract_invoice_data, xml_bytes)
+
+    assert result["document_id"] == "F001-00000042"
+    assert result["due_date"] == "2024-07-09T00:00:00"
+    assert result["net_amount"] == pytest.approx(result["total_amount"] * 0.88)
+    if case in ("utf8_bom", "latin1"):
+        assert result["client_name"] == "Compañía Andina S.A.C."
+
+    benchmark.extra_info["xml_bytes"] = len(xml_bytes)
+    benchmark.extra_info["peak_memory_kib"] = peak_memory_kib(xml_bytes)
+    if benchmark.stats:
+        benchmark.extra_info["parses_per_sec"] = round(benchmark.stats.stats.ops, 1)
@@ -1,35 +1,66 @@
-import base64
-import json
+import asyncio
 import os
-import requests
 import datetime
 from fastapi import FastAPI, Request
-from google.cloud import pubsub_v1
+from pydantic import ValidationError
 from typing import List, Dict, Any
+from trello_client import TrelloClient
+from shared import codec, instrumentation
+from shared.event_models import TrelloCommand
+from shared.transport import get_transport, start_pull_consumers, stop_pull_consumers
 
 app = FastAPI(title="Trello Service")
+instrumentation.instrument_app(app, "trello-service")
 
 # --- Configuración ---
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
-publisher = pubsub_v1.PublisherClient()
+publisher = get_transport()
+COMMAND_TOPIC_NAME = "commands-create-trello-card"
+consumers = []
 EVENT_TOPIC_PATH = publisher.topic_path(PROJECT_ID, "events-trello-created")
 
 TRELLO_CONFIG = {
     "api_key": os.getenv("TRELLO_API_KEY"),
     "api_token": os.getenv("TRELLO_API_TOKEN"),
     "list_id": os.getenv("TRELLO_LIST_ID"),
-    "label_ids": os.getenv("TRELLO_LABEL_IDS", "")
+    "label_ids": os.getenv("TRELLO_LABEL_IDS", ""),
+    "api_url": os.getenv("TRELLO_API_URL", "https://api.trello.com/1"),
+    # Trello limita ~100 peticiones cada 10 s por token: burst + rate * 10 <= 100.
+    "rate_per_second": float(os.getenv("TRELLO_RATE_PER_SECOND", "9")),
+    "burst": float(os.getenv("TRELLO_BURST", "10")),
+    "max_concurrency": int(os.getenv("TRELLO_MAX_CONCURRENCY", "4")),
+    "max_retries": int(os.getenv("TRELLO_MAX_RETRIES", "5")),
+    "timeout": float(os.getenv("TRELLO_TIMEOUT", "30"))
 }
 
+trello_client = TrelloClient(
+    TRELLO_CONFIG["api_key"], TRELLO_CONFIG["api_token"], base_url=TRELLO_CONFIG["api_url"],
+    rate=TRELLO_CONFIG["rate_per_second"], burst=TRELLO_CONFIG["burst"],
+    max_concurrency=TRELLO_CONFIG["max_concurrency"], max_retries=TRELLO_CONFIG["max_retries"],
+    timeout=TRELLO_CONFIG["timeout"]
+)
+
+@app.on_event("startup")
+async def on_startup():
+    global consumers
+    consumers = start_pull_consumers([COMMAND_TOPIC_NAME], "trello-service", process_message, asyncio.get_running_loop())
+
+@app.on_event("shutdown")
+async def on_shutdown_consumers():
+    # Se detienen antes que el resto: los mensajes en curso aún necesitan los clientes y el event loop.
+    await stop_pull_consumers(consumers)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    trello_client.close()
+
 def _format_number(num: float) -> str:
     return "{:,.2f}".format(num)
 
 def _sanitize_name(name: str) -> str:
     return name.strip() if name else "—"
 
-def create_operation_card(card_details: Dict[str, Any]) -> str:
-    print("Creando tarjeta en Trello...")
-    
+def build_card_payload(card_details: Dict[str, Any]) -> Dict[str, Any]:
     current_date = datetime.datetime.now().strftime('%d.%m')
     debtors_info = card_details.get("debtors_info", {})
     operation_amounts = card_details.get("operation_amounts", {})
@@ -55,19 +86,18 @@ def create_operation_card(card_details: Dict[str, Any]) -> str:
         f"**Errores:** {', '.join(card_details.get('errors', [])) or 'Ninguno'}"
     )
         
-    url_card = "https://api.trello.com/1/cards"
-    auth_params = {'key': TRELLO_CONFIG['api_key'], 'token': TRELLO_CONFIG['api_token']}
-    card_payload = {
+    return {
         'idList': TRELLO_CONFIG['list_id'],
         'name': card_title,
         'desc': card_description,
         'pos': 'top',
         'idLabels': TRELLO_CONFIG['label_ids']
     }
-        
-    response = requests.post(url_card, params=auth_params, json=card_payload)
-    response.raise_for_status()
-    card_data = response.json()
+
+async def create_operation_card(card_details: Dict[str, Any]) -> str:
+    print("Creando tarjeta en Trello...")
+    # La tarjeta entra en la cola del cliente, que respeta el límite de Trello.
+    card_data = await asyncio.wrap_future(trello_client.submit_post("/cards", build_card_payload(card_details)))
     card_url = card_data['url']
     print(f"Tarjeta creada exitosamente: {card_url}")
     return card_url
@@ -77,11 +107,21 @@ async def handle_pubsub_message(request: Request):
     envelope = await request.json()
     message = envelope.get("message")
     if not message: return ""
+    return await process_message(message)
 
-    command = json.loads(base64.b64decode(message["data"]).decode("utf-8"))
-    op_id = command.get("operation_id")
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
+    try:
+        command = codec.decode_push_message(TrelloCommand, message)
+    except ValidationError as e:
+        print(f"[Trello Service] Comando inválido descartado: {e}")
+        error_event = codec.invalid_command_event(message, e)
+        if error_event is not None:
+            await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, error_event))
+        return ""
+    op_id = command.operation_id
     # El orquestador debe enviar un diccionario "card_details" con toda la data
-    card_details = command.get("card_details", {})
+    card_details = command.card_details.model_dump() if command.card_details else {}
     card_details["operation_id"] = op_id # Aseguramos que el op_id esté
 
     print(f"[Trello Service] Comando recibido para op: {op_id}")
@@ -91,11 +131,16 @@ async def handle_pubsub_message(request: Request):
         result_event.update({"status": "SKIPPED", "message": "No card details provided"})
     else:
         try:
-            card_url = create_operation_card(card_details)
+            card_url = await create_operation_card(card_details)
             result_event.update({"status": "SUCCESS", "trello_card_url": card_url})
         except Exception as e:
             print(f"[Trello Service] ERROR para op {op_id}: {e}")
             result_event.update({"status": "ERROR", "error_message": str(e)})
 
-    publisher.publish(EVENT_TOPIC_PATH, json.dumps(result_event).encode("utf-8"))
-    return ""
\ No newline at end of file
+    # Si la publicación falla, el handler falla y el comando se reintenta.
+    await asyncio.wrap_future(codec.publish(publisher, EVENT_TOPIC_PATH, result_event))
+    return ""
+
+@app.get("/queue/stats")
+def queue_stats():
+    return trello_client.stats()
@@ -0,0 +1,46 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+ROOT = os.path.dirname(os.path.dirname(SERVICE_DIR))
+sys.path.insert(0, ROOT)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def fake_trello():
+    """loadtest/fake_apis.py sin latencia en las rutas de Trello."""
+    sys.path.insert(0, os.path.join(ROOT, "loadtest"))
+    import fake_apis
+    import uvicorn
+
+    fake_apis.LATENCY_MS["trello"] = 0
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(fake_apis.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield fake_apis, f"http://127.0.0.1:{port}/trello/1"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def trello_api(fake_trello):
+    """El servidor falso con la ventana de límite de Trello vacía."""
+    fake_apis, base_url = fake_trello
+    fake_apis._trello_requests.clear()
+    yield fake_apis, base_url
+    fake_apis._trello_requests.clear()
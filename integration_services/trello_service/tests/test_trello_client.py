@@ -0,0 +1,87 @@
+import time
+
+import pytest
+import requests
+
+from trello_client import TrelloClient
+
+
+def new_client(base_url, **kwargs):
+    options = dict(rate=1000, burst=100, max_concurrency=4)
+    options.update(kwargs)
+    return TrelloClient("key", "token", base_url=base_url, **options)
+
+
+def fill_rate_window(fake_apis, seconds_left: float):
+    """Agota el límite de Trello del servidor falso durante `seconds_left` segundos más."""
+    started = time.monotonic() - 10 + seconds_left
+    fake_apis._trello_requests.extend([started] * fake_apis.TRELLO_RATE_LIMIT)
+
+
+def test_creates_cards(trello_api):
+    _, base_url = trello_api
+    client = new_client(base_url)
+    try:
+        futures = [client.submit_post("/cards", {"name": f"Operación {i}"}) for i in range(10)]
+        cards = [future.result(timeout=10) for future in futures]
+    finally:
+        client.close()
+
+    assert len({card["id"] for card in cards}) == 10
+    assert all(card["url"].startswith("https://trello.com/c/") for card in cards)
+    stats = client.stats()
+    assert stats["sent"] == 10 and stats["failed"] == 0 and stats["throttled"] == 0
+    assert stats["queue_depth"] == 0 and stats["in_flight"] == 0
+
+
+def test_429_pauses_every_thread_until_retry_after(trello_api):
+    fake_apis, base_url = trello_api
+    fill_rate_window(fake_apis, seconds_left=0.5)
+    throttled_before = fake_apis._stats["trello_throttled"]
+    client = new_client(base_url)
+    try:
+        started = time.monotonic()
+        futures = [client.submit_post("/cards", {"name": f"Operación {i}"}) for i in range(8)]
+        cards = [future.result(timeout=10) for future in futures]
+        elapsed = time.monotonic() - started
+    finally:
+        client.close()
+
+    assert len(cards) == 8
+    stats = client.stats()
+    assert stats["sent"] == 8 and stats["failed"] == 0
+    # Tras el primer 429 el bucket se pausa para todos: a lo sumo un 429 por hilo.
+    assert 1 <= stats["throttled"] <= 4
+    assert fake_apis._stats["trello_throttled"] - throttled_before == stats["throttled"]
+    assert elapsed >= 0.4
+
+
+def test_429_after_last_retry_fails_the_request(trello_api):
+    fake_apis, base_url = trello_api
+    fill_rate_window(fake_apis, seconds_left=10)
+    client = new_client(base_url, max_retries=0)
+    try:
+        with pytest.raises(requests.HTTPError) as excinfo:
+            client.submit_post("/cards", {"name": "Operación"}).result(timeout=10)
+    finally:
+        client.close()
+
+    assert excinfo.value.response.status_code == 429
+    assert client.stats()["failed"] == 1
+
+
+def test_token_bucket_limits_the_request_rate(trello_api):
+    fake_apis, base_url = trello_api
+    client = new_client(base_url, rate=20, burst=1)
+    try:
+        started = time.monotonic()
+        futures = [client.submit_post("/cards", {"name": f"Operación {i}"}) for i in range(11)]
+        [future.result(timeout=10) for future in futures]
+        elapsed = time.monotonic() - started
+    finally:
+        client.close()
+
+    # Un token de ráfaga y luego 20 por segundo: las 10 restantes tardan al menos 0.5 s.
+    assert elapsed >= 0.45
+    assert len(fake_apis._trello_requests) == 11
+    assert client.stats()["bucket_wait_seconds"] > 0
@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict
+import requests
+from requests.adapters import HTTPAdapter
+from shared import instrumentation
+
+class TokenBucket:
+    """
+    Token bucket compartido por todos los hilos. Con capacidad C y tasa r, en
+    cualquier ventana de T segundos salen como máximo C + r*T peticiones.
+    `pause_until` detiene la salida de todos los hilos (p. ej. tras un 429).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Bloquea hasta obtener un token; retorna los segundos esperados."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return now - started
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause_until(self, until: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, until)
+            self._tokens = 0
+
+class TrelloClient:
+    """
+    Cliente de Trello con una sesión keep-alive y una cola de peticiones
+    limitada por un token bucket (Trello permite ~100 peticiones cada 10 s por
+    token). Ante un 429 respeta `Retry-After` o aplica backoff exponencial con
+    jitter, y pausa el bucket para todos los hilos, no solo el que lo recibió.
+    """
+
+    def __init__(self, api_key: str, api_token: str, base_url: str = "https://api.trello.com/1",
+                 rate: float = 9.0, burst: float = 10.0, max_concurrency: int = 4, max_retries: int = 5, timeout: float = 30.0,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0):
+        self.auth_params = {'key': api_key, 'token': api_token}
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="trello")
+        self._lock = threading.Lock()
+        self._stats = {"queue_depth": 0, "in_flight": 0, "sent": 0, "failed": 0, "throttled": 0,
+                       "bucket_wait_seconds": 0.0, "retry_wait_seconds": 0.0}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key: str, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def submit_post(self, path: str, payload: Dict[str, Any]) -> Future:
+        """Encola un POST a la API de Trello; el Future resuelve con el JSON de la respuesta."""
+        self._count("queue_depth")
+        return self._executor.submit(instrumentation.in_context(self._post), path, payload)
+
+    def _retry_delay(self, response: requests.Response, attempt: int) -> float:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+        delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+        return random.uniform(delay / 2, delay)
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        self._count("queue_depth", -1)
+        self._count("in_flight")
+        try:
+            for attempt in range(self.max_retries + 1):
+                self._count("bucket_wait_seconds", self.bucket.acquire())
+                with instrumentation.span("trello.post", path=path, attempt=attempt):
+                    response = self.session.post(f"{self.base_url}{path}", params=self.auth_params, json=payload,
+                                                 timeout=self.timeout)
+                if response.status_code != 429 or attempt == self.max_retries:
+                    break
+                delay = self._retry_delay(response, attempt)
+                self._count("throttled")
+                self._count("retry_wait_seconds", delay)
+                print(f"Trello respondió 429; se pausan los envíos {delay:.1f}s (intento {attempt + 1}).")
+                self.bucket.pause_until(time.monotonic() + delay)
+            response.raise_for_status()
+            self._count("sent")
+            return response.json()
+        except Exception:
+            self._count("failed")
+            raise
+        finally:
+            self._count("in_flight", -1)
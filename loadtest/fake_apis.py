@@ -0,0 +1,159 @@
+"""
+Servidor falso de las APIs externas para las pruebas de carga: Cavali,
+Trello y Google (Drive y Gmail). Cada grupo de rutas agrega una latencia
+configurable para simular la red y el tiempo de respuesta del proveedor.
+
+- Cavali:  /cavali/token, /cavali/block, /cavali/status
+- Trello:  /trello/1/cards (con el límite de Trello: FAKE_TRELLO_RATE_LIMIT
+           peticiones cada 10 s, por encima responde 429 con Retry-After)
+- Google:  /google/... (GOOGLE_API_ROOT_URL de los servicios): metadatos,
+           subidas multipart y resumables, y batch requests de Gmail.
+"""
+import asyncio
+import itertools
+import os
+import random
+import time
+import uuid
+from collections import deque
+from typing import Dict
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake External APIs")
+
+# Latencia por API: media en milisegundos y jitter relativo (0.5 = ±50 %).
+LATENCY_MS = {
+    "cavali": float(os.getenv("FAKE_CAVALI_LATENCY_MS", "300")),
+    "trello": float(os.getenv("FAKE_TRELLO_LATENCY_MS", "150")),
+    "google": float(os.getenv("FAKE_GOOGLE_LATENCY_MS", "200")),
+}
+LATENCY_JITTER = float(os.getenv("FAKE_LATENCY_JITTER", "0.5"))
+# Segundos que Cavali reporta un proceso como pendiente antes del estado final.
+CAVALI_PROCESS_SECONDS = float(os.getenv("FAKE_CAVALI_PROCESS_SECONDS", "3"))
+TRELLO_RATE_LIMIT = int(os.getenv("FAKE_TRELLO_RATE_LIMIT", "100"))
+
+_process_ids = itertools.count(1)
+_processes: Dict[int, float] = {}
+_trello_requests = deque()
+# Subidas resumables en curso: id de sesión -> (bytes recibidos, respuesta final).
+_upload_sessions: Dict[str, dict] = {}
+_stats = {"cavali": 0, "trello": 0, "trello_throttled": 0, "google": 0}
+
+async def _latency(api: str):
+    _stats[api] += 1
+    mean = LATENCY_MS[api] / 1000
+    await asyncio.sleep(max(0.0, random.uniform(mean * (1 - LATENCY_JITTER), mean * (1 + LATENCY_JITTER))))
+
+@app.get("/stats")
+def stats():
+    return dict(_stats, upload_sessions=len(_upload_sessions), cavali_processes=len(_processes))
+
+# --- Cavali ---
+
+@app.post("/cavali/token")
+async def cavali_token():
+    await _latency("cavali")
+    return {"access_token": uuid.uuid4().hex, "token_type": "Bearer", "expires_in": 300}
+
+@app.post("/cavali/block")
+async def cavali_block(request: Request):
+    await request.body()
+    await _latency("cavali")
+    process_id = next(_process_ids)
+    _processes[process_id] = time.monotonic() + CAVALI_PROCESS_SECONDS
+    return {"response": {"idProceso": process_id}}
+
+@app.post("/cavali/status")
+async def cavali_status(request: Request):
+    body = await request.json()
+    await _latency("cavali")
+    process_id = body.get("ProcessFilter", {}).get("idProcess")
+    ready_at = _processes.get(process_id)
+    if ready_at is None:
+        return JSONResponse({"message": f"Proceso {process_id} no existe"}, status_code=404)
+    if time.monotonic() < ready_at:
+        return {"response": {"idProceso": process_id, "estado": "PENDIENTE"}}
+    _processes.pop(process_id, None)
+    return {"response": {"idProceso": process_id, "estado": "PROCESADO"}}
+
+# --- Trello ---
+
+@app.post("/trello/1/cards")
+async def trello_create_card(request: Request):
+    await request.body()
+    now = time.monotonic()
+    while _trello_requests and _trello_requests[0] <= now - 10:
+        _trello_requests.popleft()
+    if len(_trello_requests) >= TRELLO_RATE_LIMIT:
+        _stats["trello_throttled"] += 1
+        retry_after = _trello_requests[0] + 10 - now
+        return JSONResponse({"message": "API_TOKEN_LIMIT_EXCEEDED"}, status_code=429,
+                            headers={"Retry-After": f"{retry_after:.1f}"})
+    _trello_requests.append(now)
+    await _latency("trello")
+    card_id = uuid.uuid4().hex[:24]
+    return {"id": card_id, "url": f"https://trello.com/c/{card_id[:8]}"}
+
+# --- Google (Drive y Gmail) ---
+
+def _google_resource(path: str) -> dict:
+    resource_id = uuid.uuid4().hex
+    if path.startswith("drive/"):
+        return {"id": resource_id, "webViewLink": f"https://drive.google.com/drive/folders/{resource_id}"}
+    return {"id": resource_id, "threadId": resource_id, "labelIds": ["SENT"]}
+
+@app.post("/google/batch/{api}/{version}")
+async def google_batch(request: Request):
+    # Una parte application/http por petición; la respuesta lleva el Content-ID
+    # de cada una con el prefijo "response-", como espera googleapiclient.
+    body = await request.body()
+    await _latency("google")
+    boundary = request.headers["content-type"].split("boundary=", 1)[1].strip('"').encode()
+    response_boundary = uuid.uuid4().hex
+    parts = []
+    for part in body.split(b"--" + boundary)[1:]:
+        if part.startswith(b"--"):
+            break
+        headers = part.split(b"\r\n\r\n", 1)[0].decode()
+        content_id = next(line.split(":", 1)[1].strip() for line in headers.splitlines()
+                          if line.lower().startswith("content-id:"))
+        parts.append(
+            f"--{response_boundary}\r\nContent-Type: application/http\r\n"
+            f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+            f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n"
+            f'{{"id": "{uuid.uuid4().hex}", "labelIds": ["SENT"]}}\r\n'
+        )
+    return Response("".join(parts) + f"--{response_boundary}--\r\n",
+                    media_type=f"multipart/mixed; boundary={response_boundary}")
+
+@app.post("/google/upload/{path:path}")
+async def google_upload_start(path: str, request: Request):
+    await request.body()
+    await _latency("google")
+    if request.query_params.get("uploadType") != "resumable":
+        return _google_resource(path)
+    session_id = uuid.uuid4().hex
+    _upload_sessions[session_id] = {"received": 0, "result": _google_resource(path)}
+    location = str(request.url.include_query_params(upload_id=session_id))
+    return Response(status_code=200, headers={"Location": location})
+
+@app.put("/google/upload/{path:path}")
+async def google_upload_chunk(path: str, request: Request):
+    body = await request.body()
+    await _latency("google")
+    session = _upload_sessions.get(request.query_params.get("upload_id"))
+    if session is None:
+        return JSONResponse({"error": {"code": 404, "message": "Sesión de subida no encontrada"}}, status_code=404)
+    session["received"] += len(body)
+    total = request.headers.get("content-range", "*/*").rsplit("/", 1)[1]
+    if total != "*" and session["received"] >= int(total):
+        _upload_sessions.pop(request.query_params["upload_id"], None)
+        return session["result"]
+    return Response(status_code=308, headers={"Range": f"bytes=0-{session['received'] - 1}"})
+
+@app.post("/google/{path:path}")
+async def google_call(path: str, request: Request):
+    await request.body()
+    await _latency("google")
+    return _google_resource(path)
@@ -0,0 +1,57 @@
+"""
+Firestore falso (gRPC) para correr el flujo sin el emulador de gcloud, que
+requiere Java. Solo implementa Commit, lo único que usa el orquestador
+(FirestoreStatusWriter escribe con batched writes): guarda en memoria los
+campos de cada documento y cuenta las escrituras. Los clientes lo usan con
+FIRESTORE_EMULATOR_HOST=host:puerto.
+"""
+import threading
+from concurrent import futures
+from typing import Any, Dict
+
+import grpc
+from google.cloud.firestore_v1.types import CommitRequest, CommitResponse, WriteResult
+from google.protobuf.timestamp_pb2 import Timestamp
+
+class FakeFirestore:
+    def __init__(self):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.commits = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def commit(self, request: CommitRequest, context) -> CommitResponse:
+        now = Timestamp()
+        now.GetCurrentTime()
+        with self._lock:
+            self.commits += 1
+            for write in request.writes:
+                self.writes += 1
+                if write.update and write.update.name:
+                    # Solo los valores escalares: basta para consultar el último estado.
+                    fields = {key: getattr(value, value._pb.WhichOneof("value_type"), None)
+                              for key, value in write.update.fields.items()}
+                    self.documents.setdefault(write.update.name, {}).update(fields)
+        return CommitResponse(write_results=[WriteResult(update_time=now) for _ in request.writes],
+                              commit_time=now)
+
+    def status(self, collection: str, document_id: str) -> Any:
+        for name, fields in self.documents.items():
+            if name.endswith(f"/documents/{collection}/{document_id}"):
+                return fields.get("status")
+        return None
+
+def serve(host: str = "127.0.0.1", port: int = 8200):
+    """Arranca el servidor en hilos propios; retorna (servidor gRPC, FakeFirestore)."""
+    fake = FakeFirestore()
+    handler = grpc.method_handlers_generic_handler("google.firestore.v1.Firestore", {
+        "Commit": grpc.unary_unary_rpc_method_handler(
+            fake.commit, request_deserializer=CommitRequest.deserialize,
+            response_serializer=CommitResponse.serialize
+        ),
+    })
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
+    server.add_generic_rpc_handlers((handler,))
+    server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, fake
@@ -0,0 +1,159 @@
+"""
+El flujo completo en un solo proceso, sin Docker ni RabbitMQ, para correr
+run.py donde no hay contenedores:
+
+    pip install -r loadtest/requirements-local.txt
+    python loadtest/run.py --local-stack --operations 200 --concurrency 20
+
+- Postgres: un servidor real (los binarios que trae pgserver) en 127.0.0.1.
+- GCS: gcp-storage-emulator en memoria.
+- Firestore: fake_firestore.py (solo Commit, lo que usa el orquestador).
+- Cavali, Trello, Drive y Gmail: fake_apis.py.
+- Los siete servicios con MESSAGE_TRANSPORT=inprocess y consumidores pull:
+  cada app FastAPI corre con uvicorn en su propio hilo y event loop, y todas
+  comparten el transporte en memoria del proceso.
+
+Mide el código de los servicios, pero no la red entre contenedores ni el
+broker, así que sus números no son comparables con los de docker-compose.
+"""
+import asyncio
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (directorio del servicio, puerto relativo a base_port). El gateway queda en base_port.
+SERVICES = [
+    ("api_gateway", 0),
+    ("orchestration_service", 1),
+    ("integration_services/parser_service", 2),
+    ("integration_services/cavali_service", 3),
+    ("integration_services/drive_service", 4),
+    ("integration_services/gmail_service", 5),
+    ("integration_services/trello_service", 6),
+]
+FAKE_APIS_OFFSET, GCS_OFFSET, FIRESTORE_OFFSET, POSTGRES_OFFSET = 10, 11, 12, 13
+
+def load_app(service_dir: str):
+    """Importa `<service_dir>/main.py` con un nombre de módulo propio y retorna su app."""
+    path = os.path.join(ROOT, service_dir)
+    sys.path.insert(0, path)
+    module_name = service_dir.replace("/", "_") + "_main"
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(path, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module.app
+
+class LocalStack:
+    def __init__(self, base_port: int = 8080, bucket: str = "capitalexpress-operations",
+                 work_dir: Optional[str] = None):
+        self.base_port = base_port
+        self.bucket = bucket
+        self._owns_work_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="loadtest-stack-")
+        self.gateway_url = f"http://127.0.0.1:{base_port}"
+        self.fake_firestore = None
+        self._postgres = None
+        self._gcs = None
+        self._firestore_server = None
+        self._servers: List = []
+        self._threads: List[threading.Thread] = []
+
+    def _port(self, offset: int) -> int:
+        return self.base_port + offset
+
+    def _configure_environment(self):
+        fake_apis = f"http://127.0.0.1:{self._port(FAKE_APIS_OFFSET)}"
+        os.environ.update({
+            "MESSAGE_TRANSPORT": "inprocess",
+            "MESSAGE_CONSUMER_MODE": "pull",
+            "GCP_PROJECT_ID": "operaciones-peru",
+            "GOOGLE_CLOUD_PROJECT": "operaciones-peru",
+            "STORAGE_EMULATOR_HOST": f"http://127.0.0.1:{self._port(GCS_OFFSET)}",
+            "FIRESTORE_EMULATOR_HOST": f"127.0.0.1:{self._port(FIRESTORE_OFFSET)}",
+            "DB_HOST": "127.0.0.1",
+            "DB_PORT": str(self._port(POSTGRES_OFFSET)),
+            "DB_PASSWORD": "loadtest",
+            "CAVALI_CLIENT_ID": "loadtest",
+            "CAVALI_CLIENT_SECRET": "loadtest",
+            "CAVALI_SCOPE": "loadtest",
+            "CAVALI_API_KEY": "loadtest",
+            "CAVALI_TOKEN_URL": f"{fake_apis}/cavali/token",
+            "CAVALI_BLOCK_URL": f"{fake_apis}/cavali/block",
+            "CAVALI_STATUS_URL": f"{fake_apis}/cavali/status",
+            "GOOGLE_API_ROOT_URL": f"{fake_apis}/google/",
+            "DRIVE_PARENT_FOLDER_ID": "loadtest",
+            "TRELLO_API_URL": f"{fake_apis}/trello/1",
+            "TRELLO_API_KEY": "loadtest",
+            "TRELLO_API_TOKEN": "loadtest",
+            "TRELLO_LIST_ID": "loadtest",
+        })
+        os.environ.setdefault("CAVALI_STATUS_INITIAL_DELAY", "1")
+
+    def _start_postgres(self):
+        # pgserver arranca Postgres solo con socket Unix; se reinicia escuchando
+        # también en TCP porque database.py se conecta por DB_HOST/DB_PORT.
+        import pgserver
+        from pgserver._commands import pg_ctl
+        self._postgres = pgserver.get_server(os.path.join(self.work_dir, "pgdata"), cleanup_mode="stop")
+        socket_dir = self._postgres.get_uri().split("host=", 1)[1]
+        pg_ctl(["-w", "-o", f"-h 127.0.0.1 -p {self._port(POSTGRES_OFFSET)} -k {socket_dir}",
+                "-l", str(self._postgres.log), "restart"],
+               pgdata=self._postgres.pgdata, user=self._postgres.system_user)
+
+    def _start_gcs(self):
+        from gcp_storage_emulator.server import create_server
+        self._gcs = create_server("127.0.0.1", self._port(GCS_OFFSET), in_memory=True)
+        self._gcs.start()
+
+    def _serve(self, app, port: int):
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        thread = threading.Thread(target=lambda: asyncio.run(server.serve()), name=f"uvicorn-{port}", daemon=True)
+        thread.start()
+        self._servers.append(server)
+        self._threads.append(thread)
+        return server
+
+    def start(self, timeout: float = 120):
+        self._configure_environment()
+        self._start_postgres()
+        self._start_gcs()
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import fake_apis
+        import fake_firestore
+        self._firestore_server, self.fake_firestore = fake_firestore.serve(port=self._port(FIRESTORE_OFFSET))
+        self._serve(fake_apis.app, self._port(FAKE_APIS_OFFSET))
+        # Los servicios leen su configuración al importarse: después del entorno.
+        for service_dir, offset in SERVICES:
+            self._serve(load_app(service_dir), self._port(offset))
+        deadline = time.monotonic() + timeout
+        while not all(server.started for server in self._servers):
+            if time.monotonic() > deadline or not all(thread.is_alive() for thread in self._threads):
+                raise RuntimeError("El stack local no arrancó; revise los errores de los servicios.")
+            time.sleep(0.1)
+
+    def stop(self):
+        for server in self._servers:
+            server.should_exit = True
+        for thread in self._threads:
+            thread.join(timeout=30)
+        if self._firestore_server is not None:
+            self._firestore_server.stop(grace=None)
+        if self._gcs is not None:
+            self._gcs.stop()
+        if self._postgres is not None:
+            # Tras el restart de _start_postgres, el postmaster que conoce pgserver ya
+            # no existe y su cleanup no detiene el servidor: se detiene aquí.
+            from pgserver._commands import pg_ctl
+            pg_ctl(["-w", "-m", "fast", "stop"], pgdata=self._postgres.pgdata, user=self._postgres.system_user)
+            self._postgres.cleanup()
+        if self._owns_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
@@ -1,28 +1,55 @@
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASS = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME", "postgres")
 INSTANCE_CONNECTION_NAME = os.getenv("INSTANCE_CONNECTION_NAME")
+# Conexión por TCP (p. ej. un Postgres local para pruebas de carga) en lugar del socket de Cloud SQL.
+DB_HOST = os.getenv("DB_HOST")
+DB_PORT = os.getenv("DB_PORT", "5432")
 
-if not all([DB_PASS, INSTANCE_CONNECTION_NAME]):
-    raise ValueError("Se requieren las variables de entorno: DB_PASSWORD, INSTANCE_CONNECTION_NAME")
+if not DB_PASS or not (DB_HOST or INSTANCE_CONNECTION_NAME):
+    raise ValueError("Se requieren las variables de entorno: DB_PASSWORD, INSTANCE_CONNECTION_NAME (o DB_HOST)")
 
-DATABASE_URL = (
-    f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@/{DB_NAME}"
-    f"?host=/cloudsql/{INSTANCE_CONNECTION_NAME}"
-)
+if DB_HOST:
+    DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+else:
+    DATABASE_URL = (
+        f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@/{DB_NAME}"
+        f"?host=/cloudsql/{INSTANCE_CONNECTION_NAME}"
+    )
+    ASYNC_DATABASE_URL = (
+        f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@/{DB_NAME}"
+        f"?host=/cloudsql/{INSTANCE_CONNECTION_NAME}"
+    )
 
-engine = create_engine(DATABASE_URL)
+# Tamaño del pool: cada instancia atiende muchos push concurrentes, pero Cloud SQL
+# limita las conexiones totales, así que se ajusta por variables de entorno.
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": True,
+}
+
+# El motor síncrono solo lo usan create_all al arrancar y el hilo del relay del
+# outbox (una conexión a la vez), así que tiene su propio pool pequeño.
+SYNC_POOL_SETTINGS = {
+    **POOL_SETTINGS,
+    "pool_size": int(os.getenv("DB_SYNC_POOL_SIZE", "2")),
+    "max_overflow": 0,
+}
+engine = create_engine(DATABASE_URL, **SYNC_POOL_SETTINGS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
\ No newline at end of file
+# El motor asíncrono lo usan los handlers, para no bloquear el event loop.
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **POOL_SETTINGS)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
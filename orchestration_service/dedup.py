@@ -0,0 +1,26 @@
+from collections import OrderedDict
+
+class ProcessedEventCache:
+    """
+    LRU acotado de los messageId ya procesados. Es la primera barrera contra
+    reentregas; la tabla processed_messages cubre lo que no está aquí
+    (reinicios u otras instancias).
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def seen(self, message_id: str) -> bool:
+        if message_id and message_id in self._entries:
+            self._entries.move_to_end(message_id)
+            return True
+        return False
+
+    def add(self, message_id: str):
+        if not message_id:
+            return
+        self._entries[message_id] = True
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -1,85 +1,136 @@
-import base64
-import json
+import asyncio
 import os
-from fastapi import FastAPI, Request, HTTPException, Depends
-from sqlalchemy.orm import Session
-from google.cloud import pubsub_v1, firestore
+from fastapi import FastAPI, Request, HTTPException
+from pydantic import ValidationError
+from google.cloud import firestore
 
-import models, repository, database
+import models, repository, database, workflow
+from status_writer import FirestoreStatusWriter
+from outbox_relay import OutboxRelay
+from dedup import ProcessedEventCache
+from shared import codec, instrumentation
+from shared.event_models import TOPIC_MODELS, OperationMessage
+from shared.transport import get_transport, start_pull_consumers, stop_pull_consumers
 
 # --- Configuración ---
 app = FastAPI(title="Orchestration Service")
-publisher = pubsub_v1.PublisherClient()
+instrumentation.instrument_app(app, "orchestration-service")
+publisher = get_transport()
 db_firestore = firestore.Client()
 PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
 FIRESTORE_COLLECTION = "operations_status"
+STATUS_FLUSH_INTERVAL = float(os.getenv("FIRESTORE_STATUS_FLUSH_INTERVAL", "0.5"))
+status_writer = FirestoreStatusWriter(db_firestore, FIRESTORE_COLLECTION, STATUS_FLUSH_INTERVAL)
+outbox_relay = OutboxRelay(
+    database.SessionLocal, publisher, PROJECT_ID,
+    batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")),
+    poll_interval=float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+)
+processed_events = ProcessedEventCache(int(os.getenv("DEDUP_CACHE_SIZE", "10000")))
+# En modo pull el orquestador consume directamente los eventos de todo el flujo.
+EVENT_TOPICS = list(workflow.STEP_BY_EVENT)
+consumers = []
 
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
+    global consumers
     database.Base.metadata.create_all(bind=database.engine)
+    status_writer.start()
+    outbox_relay.start()
+    consumers = start_pull_consumers(EVENT_TOPICS, "orchestration-service", process_message, asyncio.get_running_loop())
 
-def publish_command(topic_name: str, data: dict):
-    topic_path = publisher.topic_path(PROJECT_ID, topic_name)
-    future = publisher.publish(topic_path, json.dumps(data).encode("utf-8"))
-    future.result()
-    print(f"  -> Comando '{topic_name}' publicado para op: {data['operation_id']}")
+@app.on_event("shutdown")
+async def on_shutdown_consumers():
+    # Se detienen antes que el resto: los mensajes en curso aún necesitan la base de datos y el event loop.
+    await stop_pull_consumers(consumers)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Escribe los estados pendientes antes de que el proceso termine.
+    outbox_relay.stop()
+    status_writer.stop()
+
+def publish_command(repo: repository.AsyncOperationRepository, topic_name: str, data: dict):
+    # Transactional outbox: el comando se guarda en la misma transacción que el
+    # siguiente cambio de estado y el relay lo publica en segundo plano.
+    # Un comando que no corresponde a su modelo falla aquí, no en el servicio.
+    TOPIC_MODELS[topic_name].model_validate(data)
+    # El traceparent viaja en el payload hasta el relay, que lo pasa a los atributos.
+    repo.enqueue_command(data["operation_id"], topic_name, instrumentation.inject(data))
+    print(f"  -> Comando '{topic_name}' encolado para op: {data['operation_id']}")
 
 def update_firestore_status(op_id: str, status: str, details: dict = None):
-    doc_ref = db_firestore.collection(FIRESTORE_COLLECTION).document(op_id)
-    update_data = {"status": status, "last_updated": firestore.SERVER_TIMESTAMP}
-    if details:
-        update_data["details"] = details
-    doc_ref.set(update_data, merge=True)
-    print(f"  -> Estado en Firestore actualizado a: {status}")
+    # Write-behind: el estado se agrupa por operación y se escribe en lote fuera del request.
+    status_writer.update(op_id, status, details)
+    print(f"  -> Estado en Firestore encolado: {status}")
 
 @app.post("/", status_code=204)
-async def handle_pubsub_message(request: Request, db: Session = Depends(database.get_db)):
+async def handle_pubsub_message(request: Request):
     envelope = await request.json()
     message = envelope.get("message")
     if not message:
         raise HTTPException(status_code=400, detail="Payload de Pub/Sub inválido.")
-    
-    source_topic = message.get("attributes", {}).get("googclient_delivery_topic", "unknown").split("/")[-1]
-    event_data = json.loads(base64.b64decode(message["data"]).decode("utf-8"))
-    op_id = event_data.get("operation_id")
-    
-    if not op_id:
-        return ""
-
-    print(f"[Orquestador] Evento '{source_topic}' recibido para op: {op_id}")
-    repo = repository.OperationRepository(db)
-    
-    try:
-        if source_topic == "operations-received":
-            repo.create_log(operation_id=op_id, file_paths=event_data.get("file_paths", {}))
-            update_firestore_status(op_id, "RECIBIDO")
-            repo.update_status(op_id, "PARSING_XML")
-            update_firestore_status(op_id, "PROCESANDO_FACTURA")
-            
-            xml_path = next((p for p in event_data.get("file_paths", {}).values() if p.lower().endswith('.xml')), None)
-            if xml_path:
-                publish_command("commands-parse-xml", {
-                    "operation_id": op_id,
-                    "xml_file_path": xml_path
-                })
-
-        elif source_topic == "events-invoices-parsed":
-            if event_data.get("status") == "SUCCESS":
-                repo.update_status(op_id, "VALIDATING_CAVALI")
-                update_firestore_status(op_id, "VALIDANDO_CON_CAVALI")
-                # Aquí publicarías el comando para Cavali
-                # publish_command("commands-validate-cavali", {...})
-            else:
-                error = event_data.get("error_message")
-                repo.update_status(op_id, "ERROR_PARSING", error)
-                update_firestore_status(op_id, "ERROR_PROCESANDO_FACTURA", {"error": error})
-        
-        # Aquí puedes seguir agregando lógica para otros eventos futuros...
-
-    except Exception as e:
-        error_msg = f"Error crítico en Orquestador: {e}"
-        print(f"ERROR para op {op_id}: {error_msg}")
-        repo.update_status(op_id, "ERROR_ORCHESTRATION", error_msg)
-        update_firestore_status(op_id, "ERROR_INESPERADO", {"error": error_msg})
-    
-    return ""
\ No newline at end of file
+    return await process_message(message)
+
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
+    async with database.AsyncSessionLocal() as db:
+        source_topic = message.get("attributes", {}).get("googclient_delivery_topic", "unknown").split("/")[-1]
+        try:
+            event = codec.decode_push_message(TOPIC_MODELS.get(source_topic, OperationMessage), message)
+        except ValidationError as e:
+            print(f"[Orquestador] Evento '{source_topic}' inválido descartado: {e}")
+            return ""
+        event_data = event.model_dump(mode="json", exclude_unset=True)
+        op_id = event.operation_id
+
+        message_id = message.get("messageId") or message.get("message_id")
+        if processed_events.seen(message_id):
+            print(f"[Orquestador] Evento duplicado '{source_topic}' para op: {op_id}. Se ignora.")
+            return ""
+
+        print(f"[Orquestador] Evento '{source_topic}' recibido para op: {op_id}")
+        repo = repository.AsyncOperationRepository(db)
+        # Los estados para Firestore se acumulan y solo se encolan tras el commit:
+        # si la transacción se revierte, Firestore no debe mostrar un estado que no ocurrió.
+        status_updates = []
+
+        def queue_status_update(update_op_id: str, status: str, details: dict = None):
+            status_updates.append((update_op_id, status, details))
+
+        try:
+            # Todo el evento (marca de procesado, log, estado y comandos del outbox)
+            # se confirma en una sola transacción.
+            if not await repo.mark_processed(message_id, op_id, source_topic):
+                await repo.rollback()
+                processed_events.add(message_id)
+                print(f"[Orquestador] Evento '{source_topic}' ya procesado para op: {op_id}. Se ignora.")
+                return ""
+
+            if source_topic == "operations-received":
+                await repo.create_log(operation_id=op_id, file_paths=event_data.get("file_paths", {}),
+                                      status=workflow.initial_status())
+                queue_status_update(op_id, "RECIBIDO")
+
+            # El motor de workflow decide qué pasos se lanzan según el tópico y el estado del evento.
+            if not await workflow.handle_event(repo, op_id, source_topic, event_data,
+                                               publish_command, queue_status_update):
+                print(f"[Orquestador] Tópico '{source_topic}' no pertenece al flujo. Se ignora.")
+
+            with instrumentation.span("db.commit", topic=source_topic):
+                await repo.commit()
+            processed_events.add(message_id)
+            for update in status_updates:
+                update_firestore_status(*update)
+
+        except Exception as e:
+            error_msg = f"Error crítico en Orquestador: {e}"
+            print(f"ERROR para op {op_id}: {error_msg}")
+            # Descarta los comandos encolados en la transacción fallida.
+            await repo.rollback()
+            await repo.update_status(op_id, "ERROR_ORCHESTRATION", error_msg)
+            await repo.commit()
+            update_firestore_status(op_id, "ERROR_INESPERADO", {"error": error_msg})
+
+        outbox_relay.notify()
+        return ""
\ No newline at end of file
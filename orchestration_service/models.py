@@ -1,6 +1,6 @@
-from sqlalchemy import Column, String, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, JSON
 from sqlalchemy.sql import func
-from .database import Base
+from database import Base
 
 class OperationLog(Base):
     __tablename__ = "operations_log"
@@ -10,4 +10,23 @@ class OperationLog(Base):
     results = Column(JSON, default={}) # Para guardar resultados de cada paso
     error_message = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+
+class OutboxCommand(Base):
+    # Comandos pendientes de publicar; se escriben en la misma transacción que el cambio de estado.
+    __tablename__ = "command_outbox"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    operation_id = Column(String, nullable=False, index=True)
+    topic = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ProcessedMessage(Base):
+    # Mensajes ya aplicados, para descartar las reentregas de Pub/Sub (at-least-once).
+    # La clave es el messageId: un mismo paso puede volver a ejecutarse legítimamente
+    # (reintentos, reprocesos) y cada ejecución llega en un mensaje distinto.
+    __tablename__ = "processed_messages"
+    message_id = Column(String, primary_key=True)
+    operation_id = Column(String, nullable=False, index=True)
+    source_topic = Column(String, nullable=False)
+    processed_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
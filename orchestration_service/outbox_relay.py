@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import Future
+from typing import Callable, Iterable, List, Tuple
+from sqlalchemy.orm import Session
+
+import models
+from shared import codec, instrumentation
+
+class InMemoryPublisher:
+    """
+    Sustituto de pubsub_v1.PublisherClient para probar el relay: guarda los
+    mensajes publicados en memoria. La publicación a los tópicos de
+    `failing_topics` falla (el Future termina con excepción), como un
+    publish rechazado por Pub/Sub.
+    """
+
+    def __init__(self, failing_topics: Iterable[str] = ()):
+        self.messages: List[Tuple[str, bytes]] = []
+        self.failing_topics = set(failing_topics)
+        self._lock = threading.Lock()
+
+    def topic_path(self, project_id: str, topic_name: str) -> str:
+        return f"projects/{project_id}/topics/{topic_name}"
+
+    def publish(self, topic_path: str, data: bytes, **attributes) -> Future:
+        future = Future()
+        if topic_path.rsplit("/", 1)[-1] in self.failing_topics:
+            future.set_exception(RuntimeError(f"Publicación rechazada en {topic_path}"))
+            return future
+        with self._lock:
+            self.messages.append((topic_path, data))
+            future.set_result(str(len(self.messages)))
+        return future
+
+class OutboxRelay:
+    """
+    Publica en Pub/Sub los comandos de la tabla command_outbox.
+
+    Un hilo en segundo plano toma lotes de hasta `batch_size` comandos (con
+    SKIP LOCKED, para que varias instancias no publiquen lo mismo), los
+    publica todos a la vez y borra los que Pub/Sub confirmó. Los que fallan
+    quedan en la tabla para el siguiente ciclo.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], publisher, project_id: str,
+                 batch_size: int = 100, poll_interval: float = 1.0):
+        self.session_factory = session_factory
+        self.publisher = publisher
+        self.project_id = project_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=instrumentation.in_service(self._run), name="outbox-relay", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify(self):
+        """Despierta al relay tras un commit para no esperar el siguiente ciclo."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # Mientras haya lotes completos se sigue drenando sin esperar.
+                while self.relay_batch() == self.batch_size and not self._stopped.is_set():
+                    pass
+            except Exception as e:
+                print(f"ERROR en el relay del outbox: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _publish(self, command: models.OutboxCommand) -> Future:
+        # El comando se publica dentro de la traza del evento que lo originó
+        # (publish_command guarda su traceparent en el payload).
+        payload = dict(command.payload)
+        parent = instrumentation.SpanContext.parse(payload.pop(instrumentation.TRACEPARENT_ATTRIBUTE, None))
+        with instrumentation.span("outbox.publish", parent=parent, topic=command.topic):
+            return codec.publish(self.publisher, self.publisher.topic_path(self.project_id, command.topic), payload)
+
+    def relay_batch(self) -> int:
+        db = self.session_factory()
+        try:
+            commands = (
+                db.query(models.OutboxCommand)
+                .order_by(models.OutboxCommand.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not commands:
+                db.rollback()
+                return 0
+
+            futures = [(command, self._publish(command)) for command in commands]
+            published = 0
+            for command, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"ERROR publicando '{command.topic}' para op {command.operation_id}: {e}")
+                    continue
+                db.delete(command)
+                published += 1
+                print(f"  -> Comando '{command.topic}' publicado para op: {command.operation_id}")
+            with instrumentation.span("db.outbox_commit", commands=published):
+                db.commit()
+            return published
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
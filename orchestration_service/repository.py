@@ -1,22 +1,87 @@
-from sqlalchemy.orm import Session
-from . import models
+from sqlalchemy import update, cast, func, literal
+from sqlalchemy.dialects.postgresql import insert, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
 
-class OperationRepository:
-    def __init__(self, db: Session):
+# Constructores de las sentencias que ejecuta el repositorio. Ninguna hace
+# commit: cada evento se confirma como una única transacción.
+
+def _insert_log_stmt(operation_id: str, file_paths: dict, status: str):
+    # Upsert: si la operación ya existe (reentrega de Pub/Sub) no se duplica ni falla.
+    return (
+        insert(models.OperationLog)
+        .values(operation_id=operation_id, file_paths=file_paths, status=status, results={})
+        .on_conflict_do_nothing(index_elements=[models.OperationLog.operation_id])
+        .returning(models.OperationLog.operation_id)
+    )
+
+def _update_status_stmt(operation_id: str, new_status: str, error_msg: str = None):
+    values = {"status": new_status}
+    if error_msg:
+        values["error_message"] = error_msg
+    return (
+        update(models.OperationLog)
+        .where(models.OperationLog.operation_id == operation_id)
+        .values(**values)
+        .returning(models.OperationLog.status)
+    )
+
+def _record_step_stmt(operation_id: str, step: str, result: dict):
+    # Fusiona {step: result} en `results` de forma atómica (jsonb ||). El bloqueo de fila
+    # del UPDATE serializa eventos concurrentes de la misma operación, así que cada uno
+    # ve en RETURNING los resultados de los pasos que terminaron antes.
+    merged = func.coalesce(cast(models.OperationLog.results, JSONB), literal({}, JSONB)).op("||")(
+        literal({step: result}, JSONB)
+    )
+    return (
+        update(models.OperationLog)
+        .where(models.OperationLog.operation_id == operation_id)
+        .values(results=cast(merged, models.OperationLog.results.type))
+        .returning(models.OperationLog.results, models.OperationLog.file_paths)
+    )
+
+def _mark_processed_stmt(message_id: str, operation_id: str, source_topic: str):
+    return (
+        insert(models.ProcessedMessage)
+        .values(message_id=message_id, operation_id=operation_id, source_topic=source_topic)
+        .on_conflict_do_nothing(index_elements=[models.ProcessedMessage.message_id])
+        .returning(models.ProcessedMessage.message_id)
+    )
+
+class AsyncOperationRepository:
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def create_log(self, operation_id: str, file_paths: dict):
-        db_log = models.OperationLog(operation_id=operation_id, file_paths=file_paths)
-        self.db.add(db_log)
-        self.db.commit()
-
-    def update_status(self, operation_id: str, new_status: str, error_msg: str = None):
-        db_log = self.db.query(models.OperationLog).filter_by(operation_id=operation_id).first()
-        if db_log:
-            db_log.status = new_status
-            if error_msg:
-                db_log.error_message = error_msg
-            self.db.commit()
-    
-    def get_operation(self, operation_id: str):
-        return self.db.query(models.OperationLog).filter_by(operation_id=operation_id).first()
\ No newline at end of file
+    async def create_log(self, operation_id: str, file_paths: dict, status: str = "RECEIVED") -> bool:
+        """Retorna False si la operación ya existía."""
+        result = await self.db.execute(_insert_log_stmt(operation_id, file_paths, status))
+        return result.scalar() is not None
+
+    async def update_status(self, operation_id: str, new_status: str, error_msg: str = None):
+        """UPDATE ... RETURNING en un solo viaje; retorna None si la operación no existe."""
+        result = await self.db.execute(_update_status_stmt(operation_id, new_status, error_msg))
+        return result.scalar()
+
+    async def record_step_result(self, operation_id: str, step: str, result: dict):
+        """Guarda el resultado de un paso y retorna (results, file_paths) actualizados, o None."""
+        result_row = await self.db.execute(_record_step_stmt(operation_id, step, result))
+        return result_row.first()
+
+    def enqueue_command(self, operation_id: str, topic: str, payload: dict):
+        self.db.add(models.OutboxCommand(operation_id=operation_id, topic=topic, payload=payload))
+
+    async def mark_processed(self, message_id: str, operation_id: str, source_topic: str) -> bool:
+        """Retorna False si el mensaje ya había sido procesado. Sin messageId no se deduplica."""
+        if not message_id:
+            return True
+        result = await self.db.execute(_mark_processed_stmt(message_id, operation_id, source_topic))
+        return result.scalar() is not None
+
+    async def commit(self):
+        await self.db.commit()
+
+    async def rollback(self):
+        await self.db.rollback()
+
+    async def get_operation(self, operation_id: str):
+        return await self.db.get(models.OperationLog, operation_id)
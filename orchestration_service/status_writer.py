@@ -0,0 +1,107 @@
+import datetime
+import threading
+from typing import Dict, Any
+from google.cloud import firestore
+
+from shared import instrumentation
+
+# Firestore admite como máximo 500 escrituras por batch.
+FIRESTORE_MAX_BATCH = 500
+
+class FirestoreStatusWriter:
+    """
+    Escritor write-behind de estados en Firestore.
+
+    `update()` solo registra el cambio en memoria; un hilo en segundo plano
+    agrupa los cambios por operation_id durante `flush_interval` segundos y
+    los escribe con batched writes. Por cada operación se conserva el último
+    estado (y sus detalles) más el historial de transiciones de la ventana.
+    """
+
+    def __init__(self, db: firestore.Client, collection: str, flush_interval: float = 0.5):
+        self.db = db
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=instrumentation.in_service(self._run), name="firestore-status-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Detiene el hilo y escribe todo lo pendiente antes de salir."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def update(self, op_id: str, status: str, details: dict = None):
+        transition = {"status": status, "at": datetime.datetime.utcnow().isoformat()}
+        with self._lock:
+            entry = self._pending.setdefault(op_id, {"history": []})
+            entry["status"] = status
+            if details:
+                entry["details"] = details
+            entry["history"].append(transition)
+            should_wake = len(self._pending) >= FIRESTORE_MAX_BATCH
+        if should_wake:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"ERROR escribiendo estados en Firestore: {e}")
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            items = list(pending.items())
+            for start in range(0, len(items), FIRESTORE_MAX_BATCH):
+                chunk = items[start:start + FIRESTORE_MAX_BATCH]
+                try:
+                    self._commit(chunk)
+                except Exception:
+                    self._requeue(items[start:])
+                    raise
+            if items:
+                print(f"  -> {len(items)} estado(s) escritos en Firestore")
+
+    def _commit(self, chunk):
+        batch = self.db.batch()
+        for op_id, entry in chunk:
+            update_data = {
+                "status": entry["status"],
+                "last_updated": firestore.SERVER_TIMESTAMP,
+                "history": firestore.ArrayUnion(entry["history"]),
+            }
+            if "details" in entry:
+                update_data["details"] = entry["details"]
+            batch.set(self.db.collection(self.collection).document(op_id), update_data, merge=True)
+        with instrumentation.span("firestore.write", documents=len(chunk)):
+            batch.commit()
+
+    def _requeue(self, items):
+        # Devuelve a la cola lo que no se pudo escribir sin pisar estados más nuevos.
+        with self._lock:
+            for op_id, entry in items:
+                newer = self._pending.get(op_id)
+                if newer is None:
+                    self._pending[op_id] = entry
+                else:
+                    newer["history"] = entry["history"] + newer["history"]
+                    if "details" not in newer and "details" in entry:
+                        newer["details"] = entry["details"]
@@ -0,0 +1,95 @@
+import json
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import models
+from outbox_relay import InMemoryPublisher, OutboxRelay
+
+
+@pytest.fixture
+def session_factory():
+    # Una sola conexión compartida para que el hilo del relay vea la misma base en memoria.
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    models.OutboxCommand.__table__.create(engine)
+    yield sessionmaker(bind=engine, autoflush=False)
+    engine.dispose()
+
+
+def add_commands(session_factory, *commands):
+    db = session_factory()
+    for op_id, topic in commands:
+        db.add(models.OutboxCommand(operation_id=op_id, topic=topic, payload={"operation_id": op_id, "topic": topic}))
+    db.commit()
+    db.close()
+
+
+def pending(session_factory):
+    db = session_factory()
+    try:
+        return [(c.operation_id, c.topic) for c in db.query(models.OutboxCommand).order_by(models.OutboxCommand.id)]
+    finally:
+        db.close()
+
+
+def published(publisher):
+    return [(json.loads(data)["operation_id"], topic.rsplit("/", 1)[-1]) for topic, data in publisher.messages]
+
+
+def test_relay_batch_drains_outbox(session_factory):
+    commands = [(f"op-{i}", "parse-command") for i in range(5)]
+    add_commands(session_factory, *commands)
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(session_factory, publisher, "proyecto", batch_size=2)
+
+    assert relay.relay_batch() == 2
+    assert relay.relay_batch() == 2
+    assert relay.relay_batch() == 1
+    assert relay.relay_batch() == 0
+    assert pending(session_factory) == []
+    assert published(publisher) == commands
+
+
+def test_failed_publish_keeps_row(session_factory):
+    add_commands(session_factory, ("op-1", "parse-command"), ("op-1", "cavali-command"), ("op-2", "parse-command"))
+    publisher = InMemoryPublisher(failing_topics={"cavali-command"})
+    relay = OutboxRelay(session_factory, publisher, "proyecto")
+
+    assert relay.relay_batch() == 2
+    assert pending(session_factory) == [("op-1", "cavali-command")]
+    assert published(publisher) == [("op-1", "parse-command"), ("op-2", "parse-command")]
+
+    # Cuando Pub/Sub vuelve a aceptar el tópico, el siguiente ciclo lo publica.
+    publisher.failing_topics.clear()
+    assert relay.relay_batch() == 1
+    assert pending(session_factory) == []
+
+
+def test_relay_publishes_in_insertion_order(session_factory):
+    commands = [("op-3", "parse-command"), ("op-1", "drive-command"), ("op-2", "gmail-command"), ("op-1", "trello-command")]
+    add_commands(session_factory, *commands)
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(session_factory, publisher, "proyecto", batch_size=10)
+
+    assert relay.relay_batch() == 4
+    assert published(publisher) == commands
+
+
+def test_background_thread_drains_after_notify(session_factory):
+    publisher = InMemoryPublisher()
+    relay = OutboxRelay(session_factory, publisher, "proyecto", poll_interval=30)
+    relay.start()
+    try:
+        add_commands(session_factory, ("op-1", "parse-command"))
+        relay.notify()
+        for _ in range(200):
+            if publisher.messages:
+                break
+            time.sleep(0.01)
+    finally:
+        relay.stop()
+    assert published(publisher) == [("op-1", "parse-command")]
+    assert pending(session_factory) == []
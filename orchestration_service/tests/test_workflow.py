@@ -0,0 +1,56 @@
+import asyncio
+
+import workflow
+
+
+class FakeRepo:
+    """Repositorio en memoria con la misma interfaz que usa workflow.handle_event."""
+
+    def __init__(self, results: dict, file_paths: dict = None):
+        self.results = dict(results)
+        self.file_paths = file_paths or {}
+        self.statuses = []
+
+    async def record_step_result(self, operation_id, step, result):
+        self.results[step] = result
+        return dict(self.results), self.file_paths
+
+    async def update_status(self, operation_id, new_status, error_msg=None):
+        self.statuses.append(new_status)
+        return new_status
+
+
+def run_drive_event(repo, correos):
+    repo.results["received"] = {"operation_details": {"correos_adicionales": correos}}
+    commands, ui_statuses = [], []
+    handled = asyncio.run(workflow.handle_event(
+        repo, "op-1", "events-drive-archived", {"operation_id": "op-1", "status": "SUCCESS"},
+        lambda _repo, topic, data: commands.append((topic, data)),
+        lambda _op, status, details=None: ui_statuses.append(status),
+    ))
+    assert handled
+    return commands, ui_statuses
+
+
+def test_gmail_uses_operation_recipients():
+    repo = FakeRepo({"parse": {}, "cavali": {}, "trello": {}})
+    commands, _ = run_drive_event(repo, ["a@example.com", " ", "b@example.com"])
+    assert [topic for topic, _ in commands] == ["commands-send-gmail"]
+    assert commands[0][1]["recipient_email"] == "a@example.com,b@example.com"
+
+
+def test_gmail_falls_back_to_default_recipients(monkeypatch):
+    monkeypatch.setattr(workflow, "GMAIL_DEFAULT_RECIPIENTS", "operaciones@example.com")
+    repo = FakeRepo({"parse": {}, "cavali": {}, "trello": {}})
+    commands, _ = run_drive_event(repo, [])
+    assert commands[0][1]["recipient_email"] == "operaciones@example.com"
+
+
+def test_gmail_is_skipped_without_recipients(monkeypatch):
+    monkeypatch.setattr(workflow, "GMAIL_DEFAULT_RECIPIENTS", "")
+    repo = FakeRepo({"parse": {}, "cavali": {}, "trello": {}})
+    commands, ui_statuses = run_drive_event(repo, [""])
+    assert commands == []
+    assert repo.results["gmail"] == workflow.SKIPPED_RESULT
+    assert repo.statuses == [workflow.COMPLETED_STATUS[0]]
+    assert ui_statuses == [workflow.COMPLETED_STATUS[1]]
@@ -0,0 +1,209 @@
+import os
+from typing import Callable, Dict, List, Any, Optional
+
+# --- Definición declarativa del flujo ---
+#
+# Cada paso declara el comando que lo inicia, el evento con el que reporta su
+# resultado y los pasos de los que depende (`after`). Un paso se lanza en
+# cuanto todas sus dependencias terminaron: así Drive, Trello y Cavali arrancan
+# en paralelo tras el parseo (fan-out) y Gmail espera a Cavali y Drive (fan-in).
+# `status` es el par (estado en Postgres, estado en Firestore) mientras corre y
+# `error_status` el que se usa si el servicio reporta un error.
+
+ENTRY_STEP = "received"
+
+STEPS: Dict[str, Dict[str, Any]] = {
+    "received": {
+        "event": "operations-received",
+        "after": [],
+    },
+    "parse": {
+        "command": "commands-parse-xml",
+        "event": "events-invoices-parsed",
+        "after": ["received"],
+        "status": ("PARSING_XML", "PROCESANDO_FACTURA"),
+        "error_status": ("ERROR_PARSING", "ERROR_PROCESANDO_FACTURA"),
+    },
+    "cavali": {
+        "command": "commands-validate-cavali",
+        "event": "events-cavali-validated",
+        "after": ["parse"],
+        "status": ("PROCESSING_INTEGRATIONS", "PROCESANDO_INTEGRACIONES"),
+        "error_status": ("ERROR_CAVALI", "ERROR_VALIDANDO_CON_CAVALI"),
+    },
+    "drive": {
+        "command": "commands-archive-drive",
+        "event": "events-drive-archived",
+        "after": ["parse"],
+        "status": ("PROCESSING_INTEGRATIONS", "PROCESANDO_INTEGRACIONES"),
+        "error_status": ("ERROR_DRIVE", "ERROR_ARCHIVANDO_EN_DRIVE"),
+    },
+    "trello": {
+        "command": "commands-create-trello-card",
+        "event": "events-trello-created",
+        "after": ["parse"],
+        "status": ("PROCESSING_INTEGRATIONS", "PROCESANDO_INTEGRACIONES"),
+        "error_status": ("ERROR_TRELLO", "ERROR_CREANDO_TARJETA"),
+    },
+    "gmail": {
+        "command": "commands-send-gmail",
+        "event": "events-gmail-sent",
+        "after": ["cavali", "drive"],
+        "status": ("SENDING_CONFIRMATION", "ENVIANDO_CONFIRMACION"),
+        "error_status": ("ERROR_GMAIL", "ERROR_ENVIANDO_CORREO"),
+    },
+}
+
+COMPLETED_STATUS = ("COMPLETED", "COMPLETADO")
+
+# Destinatarios de la confirmación cuando la operación no trae correos (separados por comas).
+# Si tampoco hay valor por defecto, el paso de Gmail se omite.
+GMAIL_DEFAULT_RECIPIENTS = os.getenv("GMAIL_DEFAULT_RECIPIENTS", "")
+
+# Resultado que se guarda para un paso cuyo constructor no genera comando.
+SKIPPED_RESULT = {"status": "SKIPPED"}
+
+# Índices precalculados para despachar en O(1).
+STEP_BY_EVENT = {step["event"]: name for name, step in STEPS.items()}
+DEPENDENTS = {name: [other for other, step in STEPS.items() if name in step["after"]] for name in STEPS}
+
+def initial_status() -> str:
+    """Estado en Postgres con el que se inserta la operación: el del paso que lanza la entrada."""
+    return STEPS[DEPENDENTS[ENTRY_STEP][0]]["status"][0]
+
+# --- Construcción de los comandos de cada paso ---
+
+def _all_paths(file_paths: dict) -> List[str]:
+    paths = []
+    for value in (file_paths or {}).values():
+        paths.extend(value if isinstance(value, list) else [value])
+    return [p for p in paths if p]
+
+def _xml_paths(file_paths: dict) -> List[str]:
+    return [p for p in _all_paths(file_paths) if p.lower().endswith('.xml')]
+
+def _invoices(results: dict) -> List[dict]:
+    parsed = results.get("parse", {}).get("parsed_invoice_data") or []
+    return parsed if isinstance(parsed, list) else [parsed]
+
+def _operation_details(results: dict) -> dict:
+    return results.get(ENTRY_STEP, {}).get("operation_details", {})
+
+def build_parse_command(op_id: str, file_paths: dict, results: dict) -> dict:
+    # Modo batch del parser: todos los XML de la operación en un solo comando.
+    return {"operation_id": op_id, "xml_file_paths": _xml_paths(file_paths)}
+
+def build_cavali_command(op_id: str, file_paths: dict, results: dict) -> dict:
+    return {"operation_id": op_id, "xml_file_paths": _xml_paths(file_paths)}
+
+def build_drive_command(op_id: str, file_paths: dict, results: dict) -> dict:
+    return {"operation_id": op_id, "file_paths": _all_paths(file_paths)}
+
+def build_trello_command(op_id: str, file_paths: dict, results: dict) -> dict:
+    invoices = _invoices(results)
+    details = _operation_details(results)
+    amounts: Dict[str, float] = {}
+    for invoice in invoices:
+        currency = invoice.get("currency", "N/A")
+        amounts[currency] = amounts.get(currency, 0) + float(invoice.get("net_amount") or 0)
+    return {
+        "operation_id": op_id,
+        "card_details": {
+            "client_name": invoices[0].get("client_name") if invoices else None,
+            "debtors_info": {i.get("debtor_ruc"): i.get("debtor_name") for i in invoices if i.get("debtor_ruc")},
+            "operation_amounts": amounts,
+            "tasa": details.get("tasa", 0),
+            "comision": details.get("comision", 0),
+        },
+    }
+
+def _recipients(details: dict) -> List[str]:
+    recipients = [c.strip() for c in details.get("correos_adicionales") or [] if c and c.strip()]
+    if not recipients:
+        recipients = [c.strip() for c in GMAIL_DEFAULT_RECIPIENTS.split(",") if c.strip()]
+    return recipients
+
+def build_gmail_command(op_id: str, file_paths: dict, results: dict) -> Optional[dict]:
+    invoices = _invoices(results)
+    details = _operation_details(results)
+    recipients = _recipients(details)
+    if not recipients:
+        return None
+    client_name = invoices[0].get("client_name") if invoices else ""
+    return {
+        "operation_id": op_id,
+        "recipient_email": ",".join(recipients),
+        "email_subject": f"Confirmación de facturas negociables - {client_name} - {op_id}",
+        "invoices_data": invoices,
+        "attachment_paths": [p for p in (file_paths.get("pdf"), file_paths.get("xml")) if p],
+    }
+
+# Un constructor que retorna None indica que el paso no aplica a la operación:
+# se registra como SKIPPED y el flujo continúa con sus dependientes.
+COMMAND_BUILDERS: Dict[str, Callable[[str, dict, dict], Optional[dict]]] = {
+    "parse": build_parse_command,
+    "cavali": build_cavali_command,
+    "drive": build_drive_command,
+    "trello": build_trello_command,
+    "gmail": build_gmail_command,
+}
+
+# --- Motor ---
+
+def ready_steps(completed_step: str, results: dict) -> List[str]:
+    """Pasos dependientes de `completed_step` cuyas dependencias ya terminaron todas."""
+    return [
+        name for name in DEPENDENTS[completed_step]
+        if name not in results and all(dep in results for dep in STEPS[name]["after"])
+    ]
+
+async def handle_event(repo, op_id: str, source_topic: str, event_data: dict,
+                       publish_command: Callable, update_firestore_status: Callable) -> bool:
+    """
+    Aplica un evento al flujo de la operación dentro de la transacción de `repo`.
+    Retorna False si el tópico no pertenece al flujo.
+    """
+    step_name = STEP_BY_EVENT.get(source_topic)
+    if step_name is None:
+        return False
+    step = STEPS[step_name]
+
+    if event_data.get("status") == "ERROR":
+        error = event_data.get("error_message")
+        db_status, ui_status = step["error_status"]
+        await repo.update_status(op_id, db_status, error)
+        update_firestore_status(op_id, ui_status, {"error": error})
+        return True
+
+    step_result = {k: v for k, v in event_data.items() if k not in ("operation_id", "file_paths")}
+    row = await repo.record_step_result(op_id, step_name, step_result)
+    if row is None:
+        print(f"  -> La operación {op_id} no existe; se ignora '{source_topic}'.")
+        return True
+    results, file_paths = row
+
+    launched = []
+    finished = [step_name]
+    while finished:
+        for name in ready_steps(finished.pop(), results):
+            if name in launched:
+                continue
+            command = COMMAND_BUILDERS[name](op_id, file_paths or {}, results)
+            if command is None:
+                print(f"  -> Paso '{name}' omitido para op: {op_id}")
+                results, file_paths = await repo.record_step_result(op_id, name, SKIPPED_RESULT)
+                finished.append(name)
+                continue
+            publish_command(repo, STEPS[name]["command"], command)
+            launched.append(name)
+
+    if launched:
+        db_status, ui_status = STEPS[launched[0]]["status"]
+    elif all(name in results for name in STEPS):
+        db_status, ui_status = COMPLETED_STATUS
+    else:
+        return True
+    if step_name != ENTRY_STEP:  # la entrada ya insertó el log con este estado
+        await repo.update_status(op_id, db_status)
+    update_firestore_status(op_id, ui_status)
+    return True
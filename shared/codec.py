@@ -0,0 +1,75 @@
+"""
+Codificación de los mensajes del flujo.
+
+- Serializa con pydantic-core (JSON en Rust) tanto modelos como diccionarios.
+- Decodifica validando contra el modelo del tópico con `model_validate_json`,
+  sin pasar por json.loads: el mensaje se valida una sola vez, al recibirlo.
+- Un comando inválido del que se puede leer `operation_id` se responde con un
+  evento ERROR (`invalid_command_event`), para que la operación no quede
+  esperando un resultado que nunca llegará.
+- Los mensajes de al menos CODEC_COMPRESS_THRESHOLD bytes (p. ej. comandos con
+  xml_files_data) se comprimen con gzip y llevan el atributo
+  `content_encoding=gzip`.
+"""
+import base64
+import gzip
+import os
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple, Type, TypeVar, Union
+from pydantic import BaseModel, ValidationError
+from pydantic_core import from_json, to_json
+
+from shared import instrumentation
+
+COMPRESS_THRESHOLD = int(os.getenv("CODEC_COMPRESS_THRESHOLD", str(64 * 1024)))
+COMPRESS_LEVEL = int(os.getenv("CODEC_COMPRESS_LEVEL", "6"))
+CONTENT_ENCODING_ATTRIBUTE = "content_encoding"
+
+M = TypeVar("M", bound=BaseModel)
+
+def encode(payload: Union[BaseModel, Dict[str, Any]]) -> Tuple[bytes, Dict[str, str]]:
+    """Retorna (bytes, atributos) listos para publish()."""
+    if isinstance(payload, BaseModel):
+        data = payload.model_dump_json(exclude_unset=True).encode("utf-8")
+    else:
+        data = to_json(payload)
+    if len(data) >= COMPRESS_THRESHOLD:
+        return gzip.compress(data, compresslevel=COMPRESS_LEVEL), {CONTENT_ENCODING_ATTRIBUTE: "gzip"}
+    return data, {}
+
+def publish(publisher, topic_path: str, payload: Union[BaseModel, Dict[str, Any]]) -> Future:
+    """Publica `payload` con el contexto de traza actual en el atributo `traceparent`."""
+    data, attributes = encode(payload)
+    return publisher.publish(topic_path, data, **instrumentation.inject(attributes))
+
+def decode(model: Type[M], data: bytes, attributes: Dict[str, str] = None) -> M:
+    """Valida `data` contra `model`; lanza pydantic.ValidationError si no corresponde."""
+    if (attributes or {}).get(CONTENT_ENCODING_ATTRIBUTE) == "gzip":
+        data = gzip.decompress(data)
+    return model.model_validate_json(data)
+
+def decode_push_message(model: Type[M], message: Dict[str, Any]) -> M:
+    """Decodifica el diccionario `message` de un push de Pub/Sub (o de un consumidor pull)."""
+    return decode(model, base64.b64decode(message["data"]), message.get("attributes"))
+
+def invalid_command_event(message: Dict[str, Any], error: ValidationError) -> Optional[Dict[str, Any]]:
+    """
+    Evento ERROR para un comando que no pasó la validación, si de su contenido
+    se puede recuperar un `operation_id`; si no (JSON roto, sin el campo), None.
+    """
+    try:
+        data = base64.b64decode(message["data"])
+        if (message.get("attributes") or {}).get(CONTENT_ENCODING_ATTRIBUTE) == "gzip":
+            data = gzip.decompress(data)
+        payload = from_json(data)
+    except Exception:
+        return None
+    operation_id = payload.get("operation_id") if isinstance(payload, dict) else None
+    if not isinstance(operation_id, str) or not operation_id:
+        return None
+    fields = ", ".join(".".join(str(part) for part in detail["loc"]) or "(raíz)" for detail in error.errors())
+    return {
+        "operation_id": operation_id,
+        "status": "ERROR",
+        "error_message": f"Comando inválido ({fields}): {error.errors()[0]['msg']}"
+    }
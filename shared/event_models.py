@@ -1,15 +1,134 @@
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Any, Optional, Union
 
-class OperationReceivedEvent(BaseModel):
-    operation_id: str
-    metadata: Dict[str, Any]
-    # En un sistema real, aquí irían las URLs a un bucket de S3/GCS
-    temp_file_paths: Dict[str, str] 
+# Modelos de todos los comandos y eventos del flujo. Se validan una sola vez,
+# al decodificar el mensaje en el servicio que lo recibe (ver shared/codec.py).
+# Los campos extra se conservan: el orquestador guarda el evento completo como
+# resultado del paso.
+
+class OperationMessage(BaseModel):
+    model_config = ConfigDict(extra="allow")
 
-class ParseCommand(BaseModel):
     operation_id: str
-    xml_file_paths: List[str]
 
-# Define aquí otros modelos para comandos y eventos
-# Ej: FilesArchivedEvent, InvoicesValidatedEvent, etc.
\ No newline at end of file
+class ResultEvent(OperationMessage):
+    status: str
+    error_message: Optional[str] = None
+
+# --- Recepción (API Gateway) ---
+
+class OperationDetails(BaseModel):
+    tasa: float
+    comision: float
+    adelanto: float
+    cuenta_bancaria: str
+    correos_adicionales: List[str] = []
+
+class OperationReceivedEvent(OperationMessage):
+    status: str = "RECEIVED"
+    received_at: str
+    # Rutas gs:// por tipo de archivo ("xml", "pdf", "respaldos"); cada valor es una ruta o una lista.
+    file_paths: Dict[str, Union[str, List[str]]]
+    operation_details: OperationDetails
+
+# --- Parser ---
+
+class InvoiceData(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    document_id: Optional[str] = None
+    issue_date: Optional[str] = None
+    due_date: Optional[str] = None
+    currency: Optional[str] = None
+    total_amount: Optional[float] = None
+    net_amount: Optional[float] = None
+    debtor_name: Optional[str] = None
+    debtor_ruc: Optional[str] = None
+    client_name: Optional[str] = None
+    client_ruc: Optional[str] = None
+
+class ParseCommand(OperationMessage):
+    xml_file_paths: List[str] = []
+    # Formato anterior: un solo XML por comando.
+    xml_file_path: Optional[str] = None
+
+class ParseFileResult(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    xml_file_path: str
+    status: str
+    invoice_data: Optional[InvoiceData] = None
+    error_message: Optional[str] = None
+
+class InvoicesParsedEvent(ResultEvent):
+    parsed_invoice_data: Union[List[InvoiceData], InvoiceData, None] = None
+    file_results: Optional[List[ParseFileResult]] = None
+
+# --- Cavali ---
+
+class XmlFileData(BaseModel):
+    filename: str
+    content_bytes: str
+
+class CavaliCommand(OperationMessage):
+    xml_file_paths: List[str] = []
+    # Formato anterior: el XML en base64 dentro del comando.
+    xml_files_data: List[XmlFileData] = []
+    # Traspaso de una instancia que se detuvo: lotes ya bloqueados (con su
+    # id_proceso) cuyo estado hay que seguir consultando, y el plazo en epoch.
+    pending_batches: List[Dict[str, Any]] = []
+    poll_deadline: Optional[float] = None
+
+class CavaliValidatedEvent(ResultEvent):
+    cavali_results: Any = None
+
+# --- Drive ---
+
+class DriveCommand(OperationMessage):
+    file_paths: List[str] = []
+
+class DriveArchivedEvent(ResultEvent):
+    drive_folder_url: Optional[str] = None
+
+# --- Trello ---
+
+class CardDetails(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    client_name: Optional[str] = None
+    debtors_info: Dict[str, Optional[str]] = {}
+    operation_amounts: Dict[str, float] = {}
+    tasa: float = 0
+    comision: float = 0
+
+class TrelloCommand(OperationMessage):
+    card_details: Optional[CardDetails] = None
+
+class TrelloCreatedEvent(ResultEvent):
+    trello_card_url: Optional[str] = None
+
+# --- Gmail ---
+
+class GmailCommand(OperationMessage):
+    recipient_email: str
+    email_subject: str
+    invoices_data: List[InvoiceData] = []
+    attachment_paths: List[str] = []
+
+class GmailSentEvent(ResultEvent):
+    sent_to: Optional[str] = None
+
+# Modelo de cada tópico.
+TOPIC_MODELS: Dict[str, type] = {
+    "operations-received": OperationReceivedEvent,
+    "commands-parse-xml": ParseCommand,
+    "events-invoices-parsed": InvoicesParsedEvent,
+    "commands-validate-cavali": CavaliCommand,
+    "events-cavali-validated": CavaliValidatedEvent,
+    "commands-archive-drive": DriveCommand,
+    "events-drive-archived": DriveArchivedEvent,
+    "commands-create-trello-card": TrelloCommand,
+    "events-trello-created": TrelloCreatedEvent,
+    "commands-send-gmail": GmailCommand,
+    "events-gmail-sent": GmailSentEvent,
+}
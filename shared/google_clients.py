@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import httplib2
+from typing import Dict, Tuple
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp, Request
+from googleapiclient.discovery import build, build_from_document, Resource
+from googleapiclient.discovery_cache import get_static_doc
+
+# Raíz alternativa para las APIs de Google (p. ej. http://fake_apis:8080/google/
+# en las pruebas de carga). Con ella se usan credenciales anónimas.
+GOOGLE_API_ROOT_URL = os.getenv("GOOGLE_API_ROOT_URL")
+
+class ThreadLocalHttp:
+    """
+    Transporte compatible con httplib2 para los clientes de googleapiclient.
+
+    httplib2 no es thread-safe, así que cada hilo usa su propio AuthorizedHttp
+    (con sus conexiones keep-alive) y todos comparten las mismas Credentials.
+    Cuando el token vence se renueva una sola vez, en el mismo objeto, aunque
+    varios hilos lo detecten a la vez.
+    """
+
+    def __init__(self, credentials: Credentials, timeout: float = 120):
+        self.credentials = credentials
+        self.timeout = timeout
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+
+    def _http(self) -> AuthorizedHttp:
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+            self._local.http = http
+        return http
+
+    def request(self, *args, **kwargs):
+        http = self._http()
+        if not self.credentials.valid:
+            with self._refresh_lock:
+                if not self.credentials.valid:
+                    self.credentials.refresh(Request(http.http))
+        return http.request(*args, **kwargs)
+
+    def close(self):
+        http = getattr(self._local, "http", None)
+        if http is not None:
+            http.close()
+
+_services: Dict[Tuple[str, str], Resource] = {}
+_services_lock = threading.Lock()
+
+def load_user_credentials(client_secrets_json: str, oauth_token_json: str) -> Credentials:
+    client_config = json.loads(client_secrets_json).get("installed")
+    token_info = json.loads(oauth_token_json)
+    return Credentials.from_authorized_user_info(info=token_info, client_config=client_config)
+
+def _build_with_root_url(api: str, version: str, root_url: str) -> Resource:
+    # Se reemplaza rootUrl en el documento de discovery (y no solo el endpoint)
+    # para que las subidas de media y los batch también vayan a root_url.
+    document = json.loads(get_static_doc(api, version))
+    document["rootUrl"] = root_url if root_url.endswith("/") else root_url + "/"
+    return build_from_document(document, http=ThreadLocalHttp(AnonymousCredentials()))
+
+def get_google_service(api: str, version: str, client_secrets_json: str, oauth_token_json: str) -> Resource:
+    """
+    Retorna el cliente de `api`/`version`, construido una sola vez por proceso
+    con el documento de discovery que trae empaquetado googleapiclient (sin
+    consultarlo por red) y un ThreadLocalHttp, así que puede usarse desde
+    varios hilos.
+    """
+    key = (api, version)
+    service = _services.get(key)
+    if service is None:
+        with _services_lock:
+            service = _services.get(key)
+            if service is None:
+                if GOOGLE_API_ROOT_URL:
+                    service = _build_with_root_url(api, version, GOOGLE_API_ROOT_URL)
+                else:
+                    credentials = load_user_credentials(client_secrets_json, oauth_token_json)
+                    service = build(api, version, http=ThreadLocalHttp(credentials),
+                                    static_discovery=True, cache_discovery=False)
+                _services[key] = service
+    return service
@@ -0,0 +1,299 @@
+"""
+Trazas y métricas compartidas por todos los servicios.
+
+- Contexto de traza W3C (`traceparent`): el gateway lo abre por request, viaja
+  en los atributos de cada mensaje (codec.publish lo agrega) y cada servicio lo
+  retoma al recibir el mensaje (`handles_message`).
+- `span(nombre)`: mide una etapa (GCS, parseo, DB, Firestore, APIs externas)
+  en el histograma `pipeline_span_seconds` y el gauge `pipeline_span_in_flight`,
+  y, con TRACE_LOG_SPANS=true, la escribe como una línea JSON con trace/span
+  id (el formato de logs estructurados de Cloud Logging). Viene apagado: con
+  carga, una línea por etapa satura stdout.
+- `instrument_app(app, servicio)`: agrega GET /metrics (Prometheus), las
+  métricas por request HTTP y, con PROFILER_ENABLED=true, GET /debug/profile:
+  un profiler por muestreo de todo el proceso que devuelve stacks en formato
+  "folded" (flamegraph.pl, speedscope).
+
+El nombre del servicio de cada métrica y línea de log es el de la app que
+ejecuta el código, no uno global del proceso: en el stack local de loadtest
+las siete apps corren en el mismo proceso (ver `service_name`).
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+from prometheus_client import CONTENT_TYPE_LATEST, Counter as PromCounter, Gauge, Histogram, generate_latest
+
+PROJECT_ID = os.getenv("GCP_PROJECT_ID", "operaciones-peru")
+TRACE_LOG_SPANS = os.getenv("TRACE_LOG_SPANS", "false").lower() == "true"
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+# Con intervalos menores el muestreo (que recorre los stacks de todos los hilos
+# con el GIL tomado) pasa a ser la carga principal del proceso.
+PROFILER_MIN_INTERVAL = 0.001
+TRACEPARENT_ATTRIBUTE = "traceparent"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SPAN_SECONDS = Histogram("pipeline_span_seconds", "Duración de cada etapa instrumentada.",
+                         ["service", "span", "outcome"], buckets=BUCKETS)
+SPAN_IN_FLIGHT = Gauge("pipeline_span_in_flight", "Etapas en curso.", ["service", "span"])
+HTTP_SECONDS = Histogram("http_request_seconds", "Duración de los requests HTTP.",
+                         ["service", "method", "route", "status"], buckets=BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests HTTP en curso.", ["service"])
+MESSAGES = PromCounter("pipeline_messages_total", "Mensajes recibidos por servicio.", ["service", "outcome"])
+
+# Servicio de la app en curso: lo fija el middleware HTTP, handles_message y el
+# arranque de la app (los hilos que se crean ahí lo heredan con in_context).
+_service: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("service_name", default=None)
+# Event loop de cada app, para el código que corre en él sin haber pasado por
+# el middleware (p. ej. los mensajes de los consumidores pull).
+_loop_services: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, str]" = weakref.WeakKeyDictionary()
+_registered_services: Set[str] = set()
+
+def service_name() -> str:
+    """
+    Servicio al que se atribuye el código en curso. Fuera de toda app (un hilo
+    que no heredó el contexto) es el único servicio registrado en el proceso,
+    o "unknown" si hay varios.
+    """
+    name = _service.get()
+    if name is None:
+        try:
+            name = _loop_services.get(asyncio.get_running_loop())
+        except RuntimeError:
+            pass
+    if name is None and len(_registered_services) == 1:
+        name = next(iter(_registered_services))
+    return name or "unknown"
+
+class SpanContext:
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def parse(cls, traceparent: Optional[str]) -> Optional["SpanContext"]:
+        parts = (traceparent or "").strip().split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+        except ValueError:
+            return None
+        return cls(parts[1], parts[2], bool(int(parts[3], 16) & 1))
+
+_current: contextvars.ContextVar[Optional[SpanContext]] = contextvars.ContextVar("span_context", default=None)
+
+def current() -> Optional[SpanContext]:
+    return _current.get()
+
+def inject(attributes: Dict[str, str]) -> Dict[str, str]:
+    """Agrega el `traceparent` de la etapa actual a los atributos de un mensaje."""
+    context = _current.get()
+    if context is not None:
+        attributes = dict(attributes, **{TRACEPARENT_ATTRIBUTE: context.traceparent()})
+    return attributes
+
+def _log_span(name: str, context: SpanContext, parent: Optional[SpanContext], started: float,
+              duration: float, error: Optional[BaseException], fields: Dict[str, Any]):
+    service = service_name()
+    record = {
+        "severity": "ERROR" if error else "INFO",
+        "message": f"[{service}] {name} {duration * 1000:.1f} ms",
+        "service": service,
+        "span": name,
+        "duration_ms": round(duration * 1000, 3),
+        "start_time": started,
+        "logging.googleapis.com/trace": f"projects/{PROJECT_ID}/traces/{context.trace_id}",
+        "logging.googleapis.com/spanId": context.span_id,
+        "parent_span_id": parent.span_id if parent else None,
+        **fields,
+    }
+    if error is not None:
+        record["error"] = repr(error)
+    print(json.dumps(record, default=str), flush=True)
+
+@contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, **fields) -> Iterator[SpanContext]:
+    """
+    Mide una etapa. Hereda la traza de la etapa actual (o de `parent`); sin
+    ninguna, abre una traza nueva. Sirve igual en código síncrono, en hilos y
+    en corutinas, porque el contexto vive en un ContextVar.
+    """
+    parent = parent or _current.get()
+    context = SpanContext(parent.trace_id if parent else secrets.token_hex(16), secrets.token_hex(8),
+                          parent.sampled if parent else True)
+    token = _current.set(context)
+    service = service_name()
+    in_flight = SPAN_IN_FLIGHT.labels(service, name)
+    in_flight.inc()
+    wall_started, started = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield context
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        in_flight.dec()
+        _current.reset(token)
+        SPAN_SECONDS.labels(service, name, "error" if error else "ok").observe(duration)
+        if TRACE_LOG_SPANS and context.sampled:
+            _log_span(name, context, parent, wall_started, duration, error, fields)
+
+def traced(name: str):
+    """Decorador: ejecuta la función (síncrona o async) dentro de span(name)."""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def in_context(fn: Callable) -> Callable:
+    """
+    `fn` ligada a una copia del contexto actual, para pasarla a un executor
+    (run_in_executor no propaga los ContextVar). Crear una por llamada: una
+    misma copia no puede correr en dos hilos a la vez.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+def in_service(fn: Callable) -> Callable:
+    """
+    `fn` para el hilo de fondo o temporizador de una app: lleva el servicio
+    actual pero no la traza en curso (sus etapas abren trazas propias).
+    """
+    service = service_name()
+
+    def run(*args, **kwargs):
+        _service.set(service)
+        return fn(*args, **kwargs)
+    return functools.partial(contextvars.Context().run, run)
+
+def handles_message(name: str):
+    """
+    Decorador de `process_message(message)`: retoma la traza del atributo
+    `traceparent` del mensaje y mide el procesamiento completo.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(message: dict, *args, **kwargs):
+            parent = SpanContext.parse((message.get("attributes") or {}).get(TRACEPARENT_ATTRIBUTE))
+            # Se fija en el contexto para que lo hereden los executors (in_context) del mensaje.
+            service = service_name()
+            service_token = _service.set(service)
+            try:
+                with span(name, parent=parent, message_id=message.get("messageId") or message.get("message_id")):
+                    result = await fn(message, *args, **kwargs)
+            except Exception:
+                MESSAGES.labels(service, "error").inc()
+                raise
+            finally:
+                _service.reset(service_token)
+            MESSAGES.labels(service, "ok").inc()
+            return result
+        return wrapper
+    return decorator
+
+_profiler_lock = threading.Lock()
+
+def sample_stacks(seconds: float, interval: float = PROFILER_INTERVAL) -> str:
+    """
+    Muestrea los stacks de todos los hilos del proceso durante `seconds` y los
+    retorna en formato folded ("hilo;módulo:función;... cantidad").
+    """
+    own_thread = threading.get_ident()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    samples: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            samples[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common()) + "\n"
+
+def instrument_app(app, service_name: str):
+    """
+    Registra /metrics, las métricas HTTP y (opcional) /debug/profile en la app
+    FastAPI. Llamarla antes de registrar los demás eventos de startup: los
+    que vienen después (y los hilos que arrancan con in_context) ya corren
+    con el servicio en el contexto.
+    """
+    _registered_services.add(service_name)
+    from fastapi import HTTPException, Request, Response
+    from fastapi.responses import PlainTextResponse
+
+    @app.on_event("startup")
+    async def bind_service():
+        _loop_services[asyncio.get_running_loop()] = service_name
+        _service.set(service_name)
+
+    @app.middleware("http")
+    async def trace_requests(request: Request, call_next):
+        if request.url.path == "/metrics":
+            return await call_next(request)
+        in_flight = HTTP_IN_FLIGHT.labels(service_name)
+        in_flight.inc()
+        started = time.perf_counter()
+        status = 500
+        service_token = _service.set(service_name)
+        try:
+            parent = SpanContext.parse(request.headers.get(TRACEPARENT_ATTRIBUTE))
+            with span(f"http {request.method}", parent=parent, path=request.url.path):
+                response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            _service.reset(service_token)
+            in_flight.dec()
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            HTTP_SECONDS.labels(service_name, request.method, route, str(status)).observe(time.perf_counter() - started)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+    if PROFILER_ENABLED:
+        @app.get("/debug/profile", include_in_schema=False)
+        async def profile(seconds: float = 10, interval: float = PROFILER_INTERVAL):
+            seconds = min(max(seconds, 0.1), PROFILER_MAX_SECONDS)
+            interval = min(max(interval, PROFILER_MIN_INTERVAL), seconds)
+            # Un muestreo a la vez por proceso: varios en paralelo se miden entre sí.
+            if not _profiler_lock.acquire(blocking=False):
+                raise HTTPException(status_code=409, detail="Ya hay un muestreo en curso.")
+            try:
+                stacks = await asyncio.get_running_loop().run_in_executor(None, sample_stacks, seconds, interval)
+            finally:
+                _profiler_lock.release()
+            return PlainTextResponse(stacks)
@@ -0,0 +1,41 @@
+import base64
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from shared import codec
+from shared.event_models import CavaliCommand, GmailCommand
+
+
+def push(data: bytes, attributes=None) -> dict:
+    return {"data": base64.b64encode(data).decode(), "attributes": attributes or {}}
+
+
+def validation_error(model, payload: dict) -> ValidationError:
+    with pytest.raises(ValidationError) as info:
+        model.model_validate(payload)
+    return info.value
+
+
+def test_invalid_command_with_operation_id_yields_error_event():
+    payload = {"operation_id": "op-1", "email_subject": "Hola"}
+    error = validation_error(GmailCommand, payload)
+    event = codec.invalid_command_event(push(json.dumps(payload).encode()), error)
+    assert event["operation_id"] == "op-1"
+    assert event["status"] == "ERROR"
+    assert "recipient_email" in event["error_message"]
+
+
+def test_invalid_compressed_command_is_decompressed_first():
+    payload = {"operation_id": "op-2", "xml_files_data": [{"filename": "a.xml"}] * 5000}
+    data, attributes = codec.encode(payload)
+    assert attributes == {codec.CONTENT_ENCODING_ATTRIBUTE: "gzip"}
+    event = codec.invalid_command_event(push(data, attributes), validation_error(CavaliCommand, payload))
+    assert event["operation_id"] == "op-2"
+
+
+@pytest.mark.parametrize("data", [b"{no es json", b'["op-3"]', b'{"operation_id": 3}', b'{"otro": "op-3"}'])
+def test_no_error_event_without_recoverable_operation_id(data):
+    error = validation_error(GmailCommand, {})
+    assert codec.invalid_command_event(push(data), error) is None
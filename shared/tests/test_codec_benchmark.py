@@ -0,0 +1,70 @@
+"""
+Benchmark del codec (pytest-benchmark) contra el camino anterior con json
+de la biblioteca estándar (json.dumps / json.loads y diccionarios sin tipo):
+
+    pytest shared/tests/test_codec_benchmark.py --benchmark-only --benchmark-group-by=param:payload
+
+Para el camino anterior, `decode` incluye la validación con el modelo a
+partir del dict, para comparar el mismo resultado: un evento ya validado.
+La columna OPS son mensajes por segundo.
+"""
+import base64
+import json
+
+import pytest
+
+from shared import codec
+from shared.event_models import CavaliCommand, InvoicesParsedEvent
+
+pytest.importorskip("pytest_benchmark")
+
+
+def invoice(i: int) -> dict:
+    return {
+        "document_id": f"F001-{i:08d}", "issue_date": "2024-05-10T00:00:00", "due_date": "2024-07-09T00:00:00",
+        "currency": "PEN", "total_amount": 1180.0 + i, "net_amount": 1038.4 + i,
+        "debtor_name": "Deudor S.A.C.", "debtor_ruc": "20600000002",
+        "client_name": "Cliente S.A.C.", "client_ruc": "20100000001",
+    }
+
+
+PAYLOADS = {
+    # Evento de parseo de una operación de 50 facturas.
+    "invoices_parsed": (InvoicesParsedEvent, {
+        "operation_id": "op-bench", "status": "SUCCESS",
+        "parsed_invoice_data": [invoice(i) for i in range(50)],
+        "file_results": [{"xml_file_path": f"gs://bucket/op-bench/{i}.xml", "status": "SUCCESS",
+                          "invoice_data": invoice(i)} for i in range(50)],
+    }),
+    # Comando de Cavali con 20 XML de ~40 KB en línea (se comprime).
+    "cavali_inline_xml": (CavaliCommand, {
+        "operation_id": "op-bench",
+        "xml_files_data": [{"filename": f"{i}.xml",
+                            "content_bytes": base64.b64encode((b"<Invoice>" + b"<cbc:Note>x</cbc:Note>" * 2000
+                                                               + b"</Invoice>")).decode()} for i in range(20)],
+    }),
+}
+
+
+@pytest.mark.parametrize("payload", list(PAYLOADS))
+@pytest.mark.parametrize("path", ["codec", "stdlib_json"])
+def test_encode_benchmark(benchmark, payload, path):
+    _, data = PAYLOADS[payload]
+    if path == "codec":
+        encoded, _ = benchmark(codec.encode, data)
+    else:
+        encoded = benchmark(lambda: json.dumps(data).encode("utf-8"))
+    benchmark.extra_info["encoded_bytes"] = len(encoded)
+
+
+@pytest.mark.parametrize("payload", list(PAYLOADS))
+@pytest.mark.parametrize("path", ["codec", "stdlib_json"])
+def test_decode_benchmark(benchmark, payload, path):
+    model, data = PAYLOADS[payload]
+    if path == "codec":
+        encoded, attributes = codec.encode(data)
+        decoded = benchmark(codec.decode, model, encoded, attributes)
+    else:
+        encoded = json.dumps(data).encode("utf-8")
+        decoded = benchmark(lambda: model.model_validate(json.loads(encoded)))
+    assert decoded.operation_id == "op-bench"
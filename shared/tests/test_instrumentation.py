@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from shared import instrumentation
+
+
+def new_app(name: str) -> FastAPI:
+    app = FastAPI()
+    instrumentation.instrument_app(app, name)
+
+    @app.get("/service")
+    async def current_service():
+        return {"service": instrumentation.service_name()}
+
+    return app
+
+
+@instrumentation.handles_message("process_message")
+async def process_message(message: dict):
+    loop = asyncio.get_running_loop()
+    in_executor = await loop.run_in_executor(None, instrumentation.in_context(instrumentation.service_name))
+    return instrumentation.service_name(), in_executor
+
+
+@pytest.mark.skipif("TRACE_LOG_SPANS" in os.environ, reason="TRACE_LOG_SPANS definido en el entorno")
+def test_span_logging_is_off_by_default():
+    assert instrumentation.TRACE_LOG_SPANS is False
+
+
+def test_each_app_reports_its_own_service():
+    # Como en el stack local de loadtest: dos apps en el mismo proceso, cada una con su event loop.
+    with TestClient(new_app("svc-a")) as client_a, TestClient(new_app("svc-b")) as client_b:
+        assert client_a.get("/service").json() == {"service": "svc-a"}
+        assert client_b.get("/service").json() == {"service": "svc-b"}
+
+        # Un mensaje de un consumidor pull llega al loop de la app sin pasar por el middleware.
+        message = {"data": "", "attributes": {}, "messageId": "1"}
+        assert client_a.portal.call(process_message, message) == ("svc-a", "svc-a")
+        assert client_b.portal.call(process_message, message) == ("svc-b", "svc-b")
+
+    metrics = instrumentation.generate_latest().decode()
+    assert 'pipeline_messages_total{outcome="ok",service="svc-a"}' in metrics
+    assert 'pipeline_messages_total{outcome="ok",service="svc-b"}' in metrics
+    assert 'http_request_seconds_count{method="GET",route="/service",service="svc-b",status="200"}' in metrics
+
+
+def test_in_service_carries_the_service_but_not_the_trace():
+    result = {}
+
+    def background():
+        result["service"] = instrumentation.service_name()
+        result["trace"] = instrumentation.current()
+
+    token = instrumentation._service.set("svc-background")
+    try:
+        with instrumentation.span("request"):
+            thread = threading.Thread(target=instrumentation.in_service(background))
+            thread.start()
+            thread.join()
+    finally:
+        instrumentation._service.reset(token)
+
+    assert result == {"service": "svc-background", "trace": None}
+
+
+@pytest.fixture
+def profiled_app(monkeypatch):
+    calls = []
+    monkeypatch.setattr(instrumentation, "PROFILER_ENABLED", True)
+    monkeypatch.setattr(instrumentation, "sample_stacks", lambda seconds, interval: calls.append((seconds, interval)) or "")
+    return TestClient(new_app("svc-profiled")), calls
+
+
+def test_profile_interval_and_duration_are_clamped(profiled_app):
+    client, calls = profiled_app
+    assert client.get("/debug/profile", params={"seconds": 5, "interval": 0}).status_code == 200
+    assert client.get("/debug/profile", params={"seconds": 10 ** 6, "interval": 10 ** 6}).status_code == 200
+    assert calls == [(5, instrumentation.PROFILER_MIN_INTERVAL),
+                     (instrumentation.PROFILER_MAX_SECONDS, instrumentation.PROFILER_MAX_SECONDS)]
+
+
+def test_only_one_profile_at_a_time(profiled_app):
+    client, calls = profiled_app
+    with instrumentation._profiler_lock:
+        assert client.get("/debug/profile", params={"seconds": 1}).status_code == 409
+    assert calls == []
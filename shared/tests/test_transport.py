@@ -0,0 +1,215 @@
+import threading
+import time
+
+import pytest
+
+from shared.transport import InProcessTransport, RabbitMQTransport
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "tiempo de espera agotado"
+        time.sleep(0.01)
+
+
+def test_inprocess_nack_retries_with_delay_and_gives_up():
+    transport = InProcessTransport(max_deliveries=3, retry_delay=0.1)
+    attempts = []
+
+    def callback(message):
+        attempts.append((message.delivery_attempt, time.monotonic()))
+        raise RuntimeError("mensaje envenenado")
+
+    handle = transport.subscribe("topico", "topico-test", callback, concurrency=2)
+    try:
+        transport.publish("projects/p/topics/topico", b"{}").result()
+        wait_for(lambda: transport.dead_letters)
+    finally:
+        handle.stop()
+
+    assert [attempt for attempt, _ in attempts] == [1, 2, 3]
+    assert attempts[1][1] - attempts[0][1] >= 0.1
+    assert attempts[2][1] - attempts[1][1] >= 0.2
+    assert transport.dead_letters[0].delivery_attempt == 3
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_closed = False
+        self.pending = []
+
+    def tx_select(self):
+        pass
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.pending.append((exchange, body, properties.message_id))
+
+    def tx_commit(self):
+        broker = self.connection.broker
+        if broker.fail_commits:
+            broker.fail_commits -= 1
+            self.is_closed = True
+            raise ConnectionError("conexión perdida")
+        broker.commits.append(list(self.pending))
+        self.pending = []
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def channel(self):
+        return FakeChannel(self)
+
+    def process_data_events(self, time_limit=None):
+        self.broker.idle_events += 1
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeBroker:
+    def __init__(self, fail_commits=0):
+        self.fail_commits = fail_commits
+        self.commits = []
+        self.connections = 0
+        self.idle_events = 0
+        self.accepting = threading.Event()
+        self.accepting.set()
+
+    def connect(self):
+        self.accepting.wait()
+        self.connections += 1
+        return FakeConnection(self)
+
+
+@pytest.fixture
+def rabbitmq(monkeypatch):
+    def make(broker, **kwargs):
+        monkeypatch.setattr(RabbitMQTransport, "_connect", lambda self: broker.connect())
+        return RabbitMQTransport("amqp://fake", **kwargs)
+    return make
+
+
+def test_rabbitmq_publishes_a_batch_with_one_commit(rabbitmq):
+    broker = FakeBroker()
+    transport = rabbitmq(broker, publish_batch_size=50)
+    # El primer mensaje sale solo; mientras se conecta se acumulan los demás.
+    broker.accepting.clear()
+    futures = [transport.publish("projects/p/topics/eventos", b"0")]
+    wait_for(lambda: transport._outgoing.empty())
+    futures += [transport.publish("projects/p/topics/eventos", f"{i}".encode()) for i in range(1, 20)]
+    broker.accepting.set()
+    ids = [future.result(timeout=5) for future in futures]
+    transport.close()
+
+    published = [message for commit in broker.commits for message in commit]
+    assert [body for _, body, _ in published] == [f"{i}".encode() for i in range(20)]
+    assert [message_id for _, _, message_id in published] == ids
+    assert [len(commit) for commit in broker.commits] == [1, 19]
+
+
+def test_rabbitmq_reconnects_and_retries_the_batch_once(rabbitmq):
+    broker = FakeBroker(fail_commits=1)
+    transport = rabbitmq(broker)
+    future = transport.publish("projects/p/topics/eventos", b"hola")
+    message_id = future.result(timeout=5)
+    transport.close()
+    assert broker.connections == 2
+    assert broker.commits == [[("eventos", b"hola", message_id)]]
+
+
+def test_rabbitmq_fails_futures_after_second_failure(rabbitmq):
+    broker = FakeBroker(fail_commits=2)
+    transport = rabbitmq(broker)
+    future = transport.publish("projects/p/topics/eventos", b"hola")
+    with pytest.raises(ConnectionError):
+        future.result(timeout=5)
+    transport.close()
+
+
+def test_rabbitmq_publisher_serves_heartbeats_while_idle(rabbitmq):
+    broker = FakeBroker()
+    transport = rabbitmq(broker)
+    transport.publish("projects/p/topics/eventos", b"hola").result(timeout=5)
+    events = broker.idle_events
+    time.sleep(0.5)
+    transport.close()
+    assert broker.idle_events > events
+
+
+class FakeConsumerChannel:
+    def __init__(self, deliveries):
+        self.deliveries = deliveries
+        self.acks = []
+        self.on_message = None
+
+    def exchange_declare(self, **kwargs):
+        pass
+
+    def queue_declare(self, **kwargs):
+        pass
+
+    def queue_bind(self, **kwargs):
+        pass
+
+    def basic_qos(self, **kwargs):
+        pass
+
+    def basic_consume(self, queue, on_message_callback):
+        self.on_message = on_message_callback
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.acks.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        pass
+
+
+class FakeConsumerConnection:
+    def __init__(self, channel):
+        self._channel = channel
+        self.is_open = True
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self, time_limit=None):
+        if self._channel.deliveries:
+            tag, body = self._channel.deliveries.pop(0)
+            properties = type("Properties", (), {"headers": {}, "message_id": f"m-{tag}"})()
+            method = type("Method", (), {"delivery_tag": tag})()
+            self._channel.on_message(self._channel, method, properties, body)
+        time.sleep(time_limit or 0)
+
+    def close(self):
+        self.is_open = False
+
+
+def test_rabbitmq_consumer_reconnects_after_connection_loss(monkeypatch):
+    channel = FakeConsumerChannel([(1, b"hola")])
+    connections = iter([ConnectionError("broker no disponible"), FakeConsumerConnection(channel)])
+
+    def connect(self):
+        result = next(connections)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(RabbitMQTransport, "_connect", connect)
+    monkeypatch.setattr(RabbitMQTransport, "_publish_loop", lambda self: None)
+    transport = RabbitMQTransport("amqp://fake", ack_interval=0.01)
+    received = []
+    handle = transport.subscribe("eventos", "eventos-test", lambda message: received.append(message.data))
+    try:
+        wait_for(lambda: channel.acks, timeout=5)
+    finally:
+        handle.stop()
+    assert received == [b"hola"]
+    assert channel.acks == [1]